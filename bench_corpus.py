@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""基准测试用的合成会话语料：确定性地生成 ~/.claude/projects 与 ~/.codex/sessions 目录树。
+
+同样的参数 + seed 生成逐字节相同的文件（时间戳相对 anchor 日期，默认今天 UTC）。
+形状仿照真实 Claude Code / Codex 记录：
+  - Claude：每个项目目录下若干会话 .jsonl；一轮 = 用户发言 → assistant(thinking/text/tool_use + usage)
+    → user(tool_result) → …；会话行数按对数正态分布；部分会话是 resume 出来的，开头复制上一个
+    会话的历史（同一 message.id:requestId 跨文件重复，考验去重）；少量 ai-title / custom-title 行。
+  - Codex：按 YYYY/MM/DD 分片的 rollout，含 session_meta / turn_context / response_item /
+    function_call_output / token_count。
+  - 文本按 cjk 比例混入中文，tool_result 大小按指数分布；MultiEdit 的 edits 条数也按指数分布，
+    每条带嵌套 dict，长尾上是几十上百 KB、content 里满是 }," 的 assistant 长行。
+纯标准库。
+
+用法：python bench_corpus.py <输出目录> [--projects=8] [--sessions=40] [--median-lines=120] ...
+  （输出目录即伪 HOME：<输出目录>/.claude/projects、<输出目录>/.codex/sessions）
+"""
+import os
+import re
+import json
+import math
+import random
+import shutil
+from pathlib import Path
+from datetime import datetime, date, timedelta, timezone
+
+DEFAULTS = {
+    "seed": 1,
+    "projects": 8,             # Claude 项目目录数
+    "sessions": 40,            # 每个项目的会话数
+    "median_lines": 120,       # 会话行数中位数（对数正态）
+    "lines_sigma": 0.9,        # 会话行数对数正态的 sigma
+    "max_lines": 4000,
+    "tool_result_bytes": 3000,  # tool_result 平均大小（指数分布）
+    "text_bytes": 400,         # assistant 文本 / thinking 平均大小
+    "multiedit_edits": 20,     # MultiEdit 工具输入的平均 edits 条数（指数分布）
+    "cjk": 0.3,                # 文本中中文字符比例
+    "resume_ratio": 0.1,       # 以上一个会话历史开头的会话比例
+    "days": 120,               # 会话分布在 anchor 之前多少天内
+    "codex_sessions": 60,
+    "codex_turns": 40,         # 每个 Codex 会话的平均轮数
+    "anchor": "",              # YYYY-MM-DD，空 = 今天（UTC）
+}
+
+PRESETS = {
+    "small": {"projects": 3, "sessions": 10, "median_lines": 60, "codex_sessions": 10},
+    "medium": {},
+    "large": {"projects": 20, "sessions": 150, "median_lines": 200, "codex_sessions": 400},
+}
+
+MANIFEST = "bench_corpus.json"
+
+_WORDS = ("the file function return value index cache offset session relay token request "
+          "stream buffer thread lock worker parse line json error retry config path list").split()
+_CJK = "会话文件索引缓存偏移请求响应线程解析错误配置路径列表中继模型用量增量扫描目录"
+_MODELS = ("claude-opus-4-1-20250805", "claude-sonnet-4-5-20250929", "claude-haiku-4-5-20251001")
+_CODEX_MODELS = ("gpt-5-codex", "gpt-5")
+_TOOLS = ("Read", "Edit", "Bash", "Grep", "Write", "MultiEdit")
+
+
+def _dump(v):
+    return json.dumps(v, ensure_ascii=False, separators=(",", ":"))
+
+
+def _uuid(rnd):
+    h = "%032x" % rnd.getrandbits(128)
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _text(rnd, size, cjk):
+    """约 size 个字符的混合文本（含换行与引号，接近真实转义开销）"""
+    out = []
+    n = 0
+    while n < size:
+        if rnd.random() < cjk:
+            w = "".join(rnd.choice(_CJK) for _ in range(rnd.randint(2, 6)))
+        else:
+            w = rnd.choice(_WORDS)
+        if rnd.random() < 0.05:
+            w += '\n'
+        elif rnd.random() < 0.02:
+            w = f'"{w}"'
+        out.append(w)
+        n += len(w) + 1
+    return " ".join(out)
+
+
+def _ts(t):
+    return t.strftime("%Y-%m-%dT%H:%M:%S.") + f"{t.microsecond // 1000:03d}Z"
+
+
+def _session_lines(rnd, cfg, project_path, session_id, start, n_lines):
+    """一个 Claude 会话的记录行（dict 列表，尚未序列化）与最后时刻"""
+    lines = []
+    t = start
+    parent = None
+    branch = rnd.choice(("main", "dev", "feature/relay"))
+    model = rnd.choice(_MODELS)
+    common = {"isSidechain": False, "userType": "external", "cwd": project_path,
+              "sessionId": session_id, "version": "2.0.14", "gitBranch": branch}
+
+    def rec(kind, message, **extra):
+        nonlocal parent, t
+        t += timedelta(seconds=rnd.randint(2, 90))
+        u = _uuid(rnd)
+        v = {"parentUuid": parent, **common, "message": message, **extra,
+             "type": kind, "uuid": u, "timestamp": _ts(t)}
+        parent = u
+        lines.append(v)
+
+    rec("user", {"role": "user", "content": _text(rnd, rnd.randint(20, 200), cfg["cjk"])})
+    if rnd.random() < 0.5:
+        lines.append({"type": "ai-title", "aiTitle": _text(rnd, 20, cfg["cjk"]), "sessionId": session_id})
+    def prose(mean, floor):
+        return _text(rnd, int(rnd.expovariate(1 / mean)) + floor, cfg["cjk"])
+
+    while len(lines) < n_lines:
+        content = []
+        if rnd.random() < 0.4:
+            content.append({"type": "thinking", "thinking": prose(cfg["text_bytes"], 20),
+                            "signature": "%064x" % rnd.getrandbits(256)})
+        content.append({"type": "text", "text": prose(cfg["text_bytes"], 10)})
+        tool_id = None
+        if rnd.random() < 0.7:
+            tool_id = "toolu_%024x" % rnd.getrandbits(96)
+            tool = rnd.choice(_TOOLS)
+            target = f"{project_path}/src/m{rnd.randint(0, 50)}.py"
+            if tool == "Edit":
+                tool_input = {"file_path": target, "old_string": _text(rnd, 200, cfg["cjk"]),
+                              "new_string": _text(rnd, 220, cfg["cjk"])}
+            elif tool == "MultiEdit":
+                n_edits = int(rnd.expovariate(1 / cfg["multiedit_edits"])) + 1
+                tool_input = {"file_path": target, "edits": [
+                    {"old_string": _text(rnd, 120, cfg["cjk"]), "new_string": _text(rnd, 140, cfg["cjk"]),
+                     "range": {"line": rnd.randint(1, 2000), "column": rnd.randint(0, 40)},
+                     "replace_all": False} for _ in range(n_edits)]}
+            else:
+                tool_input = {"file_path": target, "command": _text(rnd, 40, 0)}
+            content.append({"type": "tool_use", "id": tool_id, "name": tool, "input": tool_input})
+        usage = {"input_tokens": rnd.randint(1, 50), "cache_creation_input_tokens": rnd.randint(0, 4000),
+                 "cache_read_input_tokens": rnd.randint(0, 120000),
+                 "cache_creation": {"ephemeral_5m_input_tokens": 0, "ephemeral_1h_input_tokens": 0},
+                 "output_tokens": rnd.randint(1, 2000), "service_tier": "standard"}
+        msg = {"id": "msg_%024x" % rnd.getrandbits(96), "type": "message", "role": "assistant",
+               "model": model, "content": content,
+               "stop_reason": "tool_use" if tool_id else "end_turn", "stop_sequence": None, "usage": usage}
+        rec("assistant", msg, requestId="req_%024x" % rnd.getrandbits(96))
+        if tool_id:
+            rec("user", {"role": "user", "content": [
+                {"tool_use_id": tool_id, "type": "tool_result", "content": prose(cfg["tool_result_bytes"], 10)}]},
+                toolUseResult={"stdout": "", "stderr": "", "interrupted": False})
+        elif rnd.random() < 0.8:
+            rec("user", {"role": "user", "content": _text(rnd, rnd.randint(10, 300), cfg["cjk"])})
+    if rnd.random() < 0.1:
+        lines.append({"type": "custom-title", "customTitle": _text(rnd, 16, cfg["cjk"]), "sessionId": session_id})
+    return lines, t
+
+
+def _codex_session(rnd, cfg, start):
+    cwd = f"/work/codex-{rnd.randint(0, 9)}"
+    model = rnd.choice(_CODEX_MODELS)
+    sid = _uuid(rnd)
+    t = start
+    out = [{"timestamp": _ts(t), "type": "session_meta",
+            "payload": {"id": sid, "timestamp": _ts(t), "cwd": cwd, "originator": "codex_cli_rs",
+                        "cli_version": "0.46.0", "instructions": _text(rnd, 600, cfg["cjk"])}}]
+    total = 0
+    for _ in range(max(1, int(rnd.expovariate(1 / cfg["codex_turns"])))):
+        t += timedelta(seconds=rnd.randint(5, 120))
+        out.append({"timestamp": _ts(t), "type": "turn_context",
+                    "payload": {"cwd": cwd, "approval_policy": "on-request", "model": model,
+                                "sandbox_policy": {"mode": "workspace-write"}, "summary": "auto"}})
+        out.append({"timestamp": _ts(t), "type": "response_item",
+                    "payload": {"type": "message", "role": "user",
+                                "content": [{"type": "input_text", "text": _text(rnd, 150, cfg["cjk"])}]}})
+        for _ in range(rnd.randint(0, 3)):
+            cid = "call_%024x" % rnd.getrandbits(96)
+            out.append({"timestamp": _ts(t), "type": "response_item",
+                        "payload": {"type": "function_call", "name": "shell", "call_id": cid,
+                                    "arguments": _dump({"command": ["bash", "-lc", _text(rnd, 40, 0)]})}})
+            out.append({"timestamp": _ts(t), "type": "response_item",
+                        "payload": {"type": "function_call_output", "call_id": cid,
+                                    "output": _text(rnd, int(rnd.expovariate(1 / cfg["tool_result_bytes"])) + 10,
+                                                    cfg["cjk"])}})
+        inp = rnd.randint(1000, 60000)
+        last = {"input_tokens": inp, "cached_input_tokens": rnd.randint(0, inp),
+                "output_tokens": rnd.randint(10, 3000), "reasoning_output_tokens": 0}
+        total += inp
+        out.append({"timestamp": _ts(t), "type": "event_msg",
+                    "payload": {"type": "token_count",
+                                "info": {"total_token_usage": {"input_tokens": total}, "last_token_usage": last}}})
+        out.append({"timestamp": _ts(t), "type": "response_item",
+                    "payload": {"type": "message", "role": "assistant",
+                                "content": [{"type": "output_text", "text": _text(rnd, cfg["text_bytes"], cfg["cjk"])}]}})
+    return out, t
+
+
+def _write(fp, records, mtime):
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    data = "".join(_dump(r) + "\n" for r in records).encode("utf-8")
+    fp.write_bytes(data)
+    ts = mtime.timestamp()
+    os.utime(fp, (ts, ts))
+    return len(data)
+
+
+def build(root, **overrides):
+    """在 root（伪 HOME）下生成语料并返回统计；参数与已有清单相同则直接复用。
+    返回 {params, claude_files, codex_files, bytes, lines, projects: [项目路径...]}"""
+    cfg = dict(DEFAULTS)
+    cfg.update({k: v for k, v in overrides.items() if v is not None})
+    if not cfg["anchor"]:
+        cfg["anchor"] = datetime.now(timezone.utc).date().isoformat()
+    root = Path(root)
+    manifest = root / MANIFEST
+    try:
+        old = json.loads(manifest.read_text(encoding="utf-8"))
+        if old.get("params") == cfg:
+            return old
+    except Exception:
+        pass
+    for sub in (".claude", ".codex"):
+        shutil.rmtree(root / sub, ignore_errors=True)
+
+    rnd = random.Random(cfg["seed"])
+    anchor = datetime.combine(date.fromisoformat(cfg["anchor"]), datetime.min.time(), timezone.utc)
+    projects_dir = root / ".claude" / "projects"
+    stats = {"params": cfg, "claude_files": 0, "codex_files": 0, "bytes": 0, "lines": 0, "projects": []}
+    mu = math.log(max(1, cfg["median_lines"]))
+    for p in range(cfg["projects"]):
+        project_path = f"/work/bench/project-{p:02d}"
+        stats["projects"].append(project_path)
+        pdir = projects_dir / re.sub(r"[^A-Za-z0-9]", "-", project_path)  # Claude Code 的目录命名规则
+        previous = None
+        for s in range(cfg["sessions"]):
+            sid = _uuid(rnd)
+            start = anchor - timedelta(days=rnd.uniform(0, cfg["days"]))
+            n = int(min(cfg["max_lines"], max(4, rnd.lognormvariate(mu, cfg["lines_sigma"]))))
+            lines, end = _session_lines(rnd, cfg, project_path, sid, start, n)
+            if previous and rnd.random() < cfg["resume_ratio"]:
+                lines = previous + lines  # resume：复制历史（含已计过的 assistant 行）
+            previous = lines[:200]
+            stats["bytes"] += _write(pdir / f"{sid}.jsonl", lines, min(end, anchor + timedelta(hours=23)))
+            stats["lines"] += len(lines)
+            stats["claude_files"] += 1
+    codex_dir = root / ".codex" / "sessions"
+    for _ in range(cfg["codex_sessions"]):
+        start = anchor - timedelta(days=rnd.uniform(0, cfg["days"]))
+        records, end = _codex_session(rnd, cfg, start)
+        sid = records[0]["payload"]["id"]
+        fp = codex_dir / start.strftime("%Y/%m/%d") / f"rollout-{start.strftime('%Y-%m-%dT%H-%M-%S')}-{sid}.jsonl"
+        stats["bytes"] += _write(fp, records, min(end, anchor + timedelta(hours=23)))
+        stats["lines"] += len(records)
+        stats["codex_files"] += 1
+    manifest.write_text(json.dumps(stats, ensure_ascii=False, indent=1), encoding="utf-8")
+    return stats
+
+
+def parse_args(argv, defaults):
+    """--name=value 形式的参数按 defaults 里的类型转换（name 中的 - 等价于 _）"""
+    out = {}
+    rest = []
+    for a in argv:
+        if a.startswith("--") and "=" in a:
+            k, v = a[2:].split("=", 1)
+            k = k.replace("-", "_")
+            if k in defaults:
+                out[k] = type(defaults[k])(v) if defaults[k] is not None else v
+                continue
+        rest.append(a)
+    return out, rest
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    opts, rest = parse_args(sys.argv[1:], {**DEFAULTS, "preset": ""})
+    if not rest:
+        print(__doc__)
+        sys.exit(2)
+    preset = PRESETS.get(opts.pop("preset", "") or "medium", {})
+    t0 = time.perf_counter()
+    st = build(rest[0], **{**preset, **opts})
+    print(f"Claude {st['claude_files']} 个文件 / Codex {st['codex_files']} 个文件，"
+          f"{st['lines']:,} 行，{st['bytes'] / 1048576:.1f} MB（{time.perf_counter() - t0:.1f}s）")
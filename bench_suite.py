@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""性能基准：在 bench_corpus 生成的合成语料上计时各热点，结果写成 JSON 便于跨提交对比。
+
+计时项：
+  token.*    token_summary.compute 的全量扫描 / 冷建索引 / 热增量 / 按小时分组
+  viewer.*   ConversationViewer.get_sessions_info / list_sessions（遍历全部项目）
+  web.*      ConversationWebServerV2.parse_conversation_properly（最大的几个会话）
+  relay.*    进程内起一个薄中继，经 keep-alive 连接请求各端点
+每项重复 --repeat 次，记 min / median / max 秒；冷路径（全量、冷建索引）只跑 --heavy-repeat 次。
+
+语料放在伪 HOME 里（HOME / USERPROFILE 指过去，CLAUDE_CONFIG_DIR / CODEX_HOME 清掉），
+被测模块在此之后才 import，模块级的 ~/.claude 路径因此都落在语料目录下，不碰本机真实数据。
+纯标准库。
+
+用法：python bench_suite.py [--preset=small|medium|large] [--root=目录] [--repeat=5]
+                            [--out=bench_results.json] [--compare=上次结果.json] [--only=relay]
+  （语料参数同 bench_corpus.py，如 --projects=20 --cjk=0.5）
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+from pathlib import Path
+
+import bench_corpus
+
+SUITE_DEFAULTS = {
+    "preset": "medium",
+    "root": str(Path(tempfile.gettempdir()) / "claude_launcher_bench"),
+    "repeat": 5,
+    "heavy_repeat": 2,
+    "parse_sessions": 5,      # parse_conversation_properly 取最大的几个会话
+    "out": "bench_results.json",
+    "compare": "",
+    "only": "",
+}
+REGRESSION_THRESHOLD = 1.10  # 对比时 median 慢于上次这么多倍即标出
+
+
+def _isolate_home(root):
+    os.environ["HOME"] = str(root)
+    os.environ["USERPROFILE"] = str(root)
+    os.environ.pop("CLAUDE_CONFIG_DIR", None)
+    os.environ.pop("CODEX_HOME", None)
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _measure(fn, repeat, setup=None):
+    """跑 repeat 次，返回耗时统计；fn 返回 dict 时并入结果（字节数、行数等）"""
+    samples = []
+    extra = None
+    for _ in range(max(1, repeat)):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        extra = fn()
+        samples.append(time.perf_counter() - t0)
+    out = {"runs": len(samples), "min": min(samples), "median": statistics.median(samples),
+           "max": max(samples)}
+    if isinstance(extra, dict):
+        out.update(extra)
+    return out
+
+
+# ---------- 各组计时项：返回 [(名字, fn, setup, 是否冷路径)] ----------
+
+def _token_cases(root):
+    import token_summary
+
+    def reset():
+        shutil.rmtree(token_summary.INDEX_DIR, ignore_errors=True)
+        token_summary._index = None
+        token_summary._index_stamp = None
+
+    def run(**kw):
+        def fn():
+            return {"rows": len(token_summary.compute(400, **kw)["days"])}
+        return fn
+
+    return [
+        ("token.compute_full", run(incremental=False), None, True),
+        ("token.compute_cold", run(), reset, True),
+        ("token.compute_warm", run(), None, False),
+        ("token.compute_warm_hour", run(group="hour"), None, False),
+    ]
+
+
+def _viewer_cases(stats):
+    from conversation_viewer import ConversationViewer
+    from conversation_web_v2 import ConversationWebServerV2
+    viewer = ConversationViewer(None)
+    projects = stats["projects"]
+
+    def sessions_info():
+        return {"sessions": sum(len(viewer.get_sessions_info(p)) for p in projects)}
+
+    def list_sessions():
+        return {"sessions": sum(len(viewer.list_sessions(p)) for p in projects)}
+
+    files = sorted(viewer.claude_projects_dir.glob("*/*.jsonl"), key=lambda f: f.stat().st_size,
+                   reverse=True)[:stats["parse_sessions"]]
+    web = ConversationWebServerV2(projects[0], viewer)
+
+    def parse():
+        return {"files": len(files), "bytes": sum(f.stat().st_size for f in files),
+                "records": sum(len(web.parse_conversation_properly(str(f))) for f in files)}
+
+    return [
+        ("viewer.get_sessions_info", sessions_info, None, False),
+        ("viewer.list_sessions", list_sessions, None, False),
+        ("web.parse_conversation_properly", parse, None, False),
+    ]
+
+
+class _Relay:
+    """进程内薄中继 + 一条 keep-alive 连接"""
+
+    def __init__(self):
+        import http.client
+        import session_api_server as srv
+        self.srv = srv
+        self.server = srv.make_server('127.0.0.1', 0)
+        srv._file_index().start_watcher()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.conn = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=120)
+
+    def get(self, path, headers=None):
+        self.conn.request('GET', path, headers=headers or {})
+        resp = self.conn.getresponse()
+        body = resp.read()
+        if resp.status >= 400:
+            raise RuntimeError(f"{path} -> {resp.status}")
+        return resp, body
+
+    def close(self):
+        self.conn.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _relay_cases(relay):
+    from urllib.parse import quote
+    files = relay.srv._list_files()
+    largest = max(files, key=lambda e: e["size"])["key"]
+    key = quote(largest)
+    cursor = json.loads(relay.get('/raw/list')[1])["cursor"]
+
+    def req(path, headers=None):
+        def fn():
+            _, body = relay.get(path, headers)
+            return {"bytes": len(body)}
+        return fn
+
+    relay.get('/api/token_summary')  # 预热：建好 token 索引，后面计的是缓存/热路径
+    return [
+        ("relay.ping", req('/api/ping'), None, False),
+        ("relay.raw_list", req('/raw/list'), None, False),
+        ("relay.raw_list_delta", req(f'/raw/list?since={cursor}'), None, False),
+        ("relay.raw_file_full", req(f'/raw/file?key={key}'), None, False),
+        ("relay.raw_file_gzip", req(f'/raw/file?key={key}', {'Accept-Encoding': 'gzip'}), None, False),
+        ("relay.raw_file_tail", req(f'/raw/file?key={key}', {'Range': 'bytes=-65536'}), None, False),
+        ("relay.token_summary", req('/api/token_summary'), None, False),
+        ("relay.token_summary_ndjson_session",
+         req('/api/token_summary?format=ndjson&group=session'), None, False),
+    ]
+
+
+def run(opts):
+    root = Path(opts.pop("root"))
+    repeat, heavy = opts.pop("repeat"), opts.pop("heavy_repeat")
+    parse_n, only = opts.pop("parse_sessions"), opts.pop("only")
+    preset = bench_corpus.PRESETS.get(opts.pop("preset") or "medium", {})
+    opts.pop("out", None)
+    opts.pop("compare", None)
+
+    t0 = time.perf_counter()
+    stats = bench_corpus.build(root, **{**preset, **opts})
+    print(f"语料：Claude {stats['claude_files']} / Codex {stats['codex_files']} 个文件，"
+          f"{stats['bytes'] / 1048576:.1f} MB（{time.perf_counter() - t0:.1f}s）")
+    _isolate_home(root)
+    stats = dict(stats, parse_sessions=parse_n)
+
+    results = {}
+
+    def run_cases(cases):
+        for name, fn, setup, cold in cases:
+            if only and only not in name:
+                continue
+            r = _measure(fn, heavy if cold else repeat, setup)
+            results[name] = r
+            print(f"  {name:<40} median {r['median'] * 1000:10.2f} ms   min {r['min'] * 1000:10.2f} ms")
+
+    run_cases(_token_cases(root))
+    run_cases(_viewer_cases(stats))
+    relay = _Relay()
+    try:
+        run_cases(_relay_cases(relay))
+    finally:
+        relay.close()
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+            "heavy_repeat": heavy,
+        },
+        "corpus": {k: stats[k] for k in ("params", "claude_files", "codex_files", "bytes", "lines")},
+        "results": results,
+    }
+
+
+def compare(old, new):
+    """逐项对比两次结果的 median，返回慢于阈值的项名列表"""
+    slow = []
+    print(f"\n对比 {old['meta'].get('commit')} → {new['meta'].get('commit')}")
+    if old.get("corpus", {}).get("params") != new["corpus"]["params"]:
+        print("  注意：两次语料参数不同，数字不可直接比较")
+    for name, r in new["results"].items():
+        o = old.get("results", {}).get(name)
+        if not o:
+            continue
+        ratio = r["median"] / o["median"] if o["median"] else float("inf")
+        flag = "  ← 变慢" if ratio > REGRESSION_THRESHOLD else ""
+        if flag:
+            slow.append(name)
+        print(f"  {name:<40} {o['median'] * 1000:10.2f} → {r['median'] * 1000:10.2f} ms  x{ratio:.2f}{flag}")
+    return slow
+
+
+if __name__ == "__main__":
+    opts, _ = bench_corpus.parse_args(sys.argv[1:], {**bench_corpus.DEFAULTS, **SUITE_DEFAULTS})
+    opts = {**SUITE_DEFAULTS, **opts}
+    out_path, compare_path = opts["out"], opts["compare"]
+    report = run(dict(opts))
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"结果已写入 {out_path}")
+    if compare_path:
+        with open(compare_path, "r", encoding="utf-8") as f:
+            slow = compare(json.load(f), report)
+        sys.exit(1 if slow else 0)
@@ -4,6 +4,7 @@ import re
 from pathlib import Path
 from datetime import datetime
 from conversation_web_v2 import show_conversation_web
+import line_index
 
 class ConversationViewer:
     def __init__(self, launcher):
@@ -146,28 +147,27 @@ class ConversationViewer:
                 file_path = session_dir / file_name
                 session_id = file_name.replace(".jsonl", "")
 
-                # 读取第一条和最后一条消息获取时间
+                # 读取第一条和最后一条消息获取时间（行索引直接定位首尾行，消息数也由索引增量维护）；
+                # 末尾还没写换行的残行照旧算作最后一行（索引只收完整行）
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        lines = f.readlines()
-                        if lines:
-                            first_line = json.loads(lines[0])
-                            last_line = json.loads(lines[-1])
-
-                            first_time = self.parse_timestamp(first_line.get('timestamp', ''))
-                            last_time = self.parse_timestamp(last_line.get('timestamp', ''))
-
-                            # 统计消息数量
-                            message_count = len([l for l in lines if '"type":"user"' in l or '"type":"assistant"' in l])
-
-                            sessions.append({
-                                'id': session_id,
-                                'file_path': str(file_path),
-                                'first_time': first_time,
-                                'last_time': last_time,
-                                'message_count': message_count,
-                                'file_size': os.path.getsize(file_path)
-                            })
+                    idx = line_index.get(file_path)
+                    partial = idx.partial()
+                    if len(idx) or partial:
+                        first_line = json.loads(idx.read(0, 1)[0] if len(idx) else partial)
+                        last_line = json.loads(partial or idx.read(-1)[0])
+
+                        first_time = self.parse_timestamp(first_line.get('timestamp', ''))
+                        last_time = self.parse_timestamp(last_line.get('timestamp', ''))
+
+                        sessions.append({
+                            'id': session_id,
+                            'file_path': str(file_path),
+                            'first_time': first_time,
+                            'last_time': last_time,
+                            'message_count': idx.message_lines + ('"type":"user"' in partial
+                                                                  or '"type":"assistant"' in partial),
+                            'file_size': os.path.getsize(file_path)
+                        })
                 except Exception as e:
                     continue
 
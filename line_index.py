@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""JSONL 行偏移旁路索引：按行号 O(1) 定位，翻页只读那一页。
+
+会话文件只会追加（Claude Code 压缩/改写时整体重写），所以每个文件记一份「行首偏移表」：
+  - 第 i 行 = [starts[i], starts[i+1])，最后一行止于 covered（最后一个换行之后）；
+  - 文件变长时只扫 covered 之后的新字节，把新行首追加进表；不完整的尾行等下次；
+  - 顺手数出含 "type":"user" / "type":"assistant" 的行数（会话列表的消息数），免得为它读整个文件。
+文件变短、头部哈希对不上、或 covered 前一个字节不是换行 → 视为被改写，整份重建。
+
+大文件（>= PERSIST_MIN_BYTES）的表落盘到 ~/.claude/launcher_cache/line_index/<路径哈希>.idx：
+头部 struct HEADER_FMT = (magic, covered, 行数, 消息行数, 头部哈希, 源路径字节数)，跟着 UTF-8 源路径，
+其后是 array('Q') 原样 dump。源路径是给 prune() 用的：会话删掉后旁路文件按名字（路径哈希）找不回源头，
+get() 每 PRUNE_INTERVAL 秒顺手扫一遍缓存目录，删掉源文件已不存在的（以及旧格式的）旁路文件。
+增量时新偏移直接追加到文件尾、最后才改写头部——中途崩溃只会让头部行数偏小，多出的尾巴下次被截掉；
+全量重建走 tempfile + os.replace。小文件只在内存里建（扫一遍比读盘还快）。
+进程内最多缓存 MAX_LOADED 份，LRU 淘汰；中继（多线程）与 ConversationViewer 共用，
+span()/read() 与 refresh() 同拿索引自己的锁，读不到重建到一半的表。
+纯标准库。
+
+用法：
+  line_index.read_lines(path, 5000, 5100)  第 5000~5099 行（str，不含换行；负数从尾部数）
+  line_index.get(path).span(5000, 5100)     对应的字节区间 (begin, end, first, last)
+"""
+import os
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+CACHE_DIR = Path.home() / ".claude" / "launcher_cache" / "line_index"
+MAGIC = b'LIX2'
+HEADER_FMT = '<4sQQQ16sH'
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+HEAD_HASH_BYTES = 4096       # 用文件头这么多字节的哈希识别「同一路径被整体改写」
+PERSIST_MIN_BYTES = 256 * 1024
+SCAN_CHUNK = 1024 * 1024
+MAX_LOADED = 64
+PRUNE_INTERVAL = 3600
+MESSAGE_MARKS = (b'"type":"user"', b'"type":"assistant"')
+
+_lock = threading.Lock()
+_loaded = OrderedDict()  # 绝对路径 -> LineIndex
+_next_prune = 0.0
+
+
+def _sidecar(path):
+    name = hashlib.blake2b(str(path).encode('utf-8'), digest_size=12).hexdigest()
+    return CACHE_DIR / f"{name}.idx"
+
+
+def _head_hash(f, covered):
+    f.seek(0)
+    return hashlib.blake2b(f.read(min(HEAD_HASH_BYTES, covered)), digest_size=16).digest()
+
+
+class LineIndex:
+    """一个文件的行首偏移表；通过 get() 取得，refresh() 追上文件当前长度"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.starts = array('Q')
+        self.covered = 0
+        self.message_lines = 0
+        self.head = b''
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _reset(self):
+        self.starts = array('Q')
+        self.covered = 0
+        self.message_lines = 0
+        self.head = b''
+
+    def _load(self):
+        """从旁路文件恢复；不存在/损坏时保持空表"""
+        try:
+            with open(_sidecar(self.path), 'rb') as f:
+                magic, covered, count, msgs, head, plen = struct.unpack(HEADER_FMT, f.read(HEADER_SIZE))
+                if magic != MAGIC or f.read(plen) != self._source():
+                    return
+                starts = array('Q')
+                starts.frombytes(f.read(count * 8))
+        except (OSError, struct.error, ValueError):
+            return
+        if len(starts) != count or (count and starts[-1] >= covered):
+            return
+        self.starts, self.covered, self.message_lines, self.head = starts, covered, msgs, head
+
+    def _source(self):
+        return str(self.path).encode('utf-8', errors='surrogateescape')
+
+    def _valid(self, f, size):
+        """已索引的前缀是否仍是这个文件的前缀（只追加过）"""
+        if self.covered == 0:
+            return True
+        if size < self.covered:
+            return False
+        f.seek(self.covered - 1)
+        if f.read(1) != b'\n':
+            return False
+        return _head_hash(f, self.covered) == self.head
+
+    def refresh(self):
+        """把索引追到文件当前长度；返回自身。文件读不到时抛 OSError"""
+        with self.lock:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if not self.covered and size >= PERSIST_MIN_BYTES:
+                    self._load()
+                rebuilt = not self._valid(f, size)
+                if rebuilt:
+                    self._reset()
+                if size == self.covered:
+                    return self
+                old_count, old_covered = len(self.starts), self.covered
+                self._scan(f, size)
+                if old_covered < HEAD_HASH_BYTES:
+                    # 头部哈希覆盖 min(HEAD_HASH_BYTES, covered)，covered 还没到这个长度时跟着重算
+                    self.head = _head_hash(f, self.covered)
+            if self.covered >= PERSIST_MIN_BYTES and self.covered != old_covered:
+                self._save(0 if rebuilt else old_count)
+        return self
+
+    def _scan(self, f, size):
+        """扫 [covered, size) 的新字节，追加完整行的行首"""
+        f.seek(self.covered)
+        pos = self.covered        # data[0] 在文件里的位置
+        line_start = self.covered
+        carry = b''               # 上一块里还没遇到换行的半行
+        starts = self.starts
+        msgs = 0
+        while pos < size:
+            chunk = f.read(min(SCAN_CHUNK, size - pos))
+            if not chunk:
+                break
+            data = carry + chunk
+            base = pos - len(carry)
+            i = 0
+            while True:
+                j = data.find(b'\n', i)
+                if j < 0:
+                    break
+                if j > i:  # 空行不算一行内容，但照样前进
+                    starts.append(base + i)
+                    if data.find(MESSAGE_MARKS[0], i, j) >= 0 or data.find(MESSAGE_MARKS[1], i, j) >= 0:
+                        msgs += 1
+                i = j + 1
+                line_start = base + i
+            carry = data[i:]
+            pos += len(chunk)
+        self.covered = line_start
+        self.message_lines += msgs
+
+    def _save(self, old_count):
+        """落盘：old_count > 0 时只追加新偏移再改头部，否则整份原子重写"""
+        source = self._source()
+        header = struct.pack(HEADER_FMT, MAGIC, self.covered, len(self.starts), self.message_lines, self.head,
+                             len(source))
+        target = _sidecar(self.path)
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            if old_count and self._append(target, old_count, header):
+                return
+            fd, tmp = tempfile.mkstemp(dir=str(CACHE_DIR), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(header)
+                    f.write(source)
+                    f.write(self.starts.tobytes())
+                os.replace(tmp, target)
+            except Exception:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+        except (OSError, struct.error):
+            pass  # 索引只是加速用，写不了就每次在内存里建
+
+    def _append(self, target, old_count, header):
+        """旁路文件仍是上次写的那份（行数 == old_count）时就地追加；否则返回 False 走整份重写"""
+        try:
+            with open(target, 'r+b') as f:
+                magic, _, count, _, _, plen = struct.unpack(HEADER_FMT, f.read(HEADER_SIZE))
+                if magic != MAGIC or count != old_count:
+                    return False
+                f.seek(HEADER_SIZE + plen + old_count * 8)
+                f.write(self.starts[old_count:].tobytes())
+                f.truncate()
+                f.flush()
+                f.seek(0)
+                f.write(header)
+            return True
+        except (OSError, struct.error):
+            return False
+
+    def span(self, start=0, stop=None):
+        """行号区间 [start, stop)（切片语义：可为负、越界截断）对应的字节区间。
+        返回 (begin, end, first, last)：first/last 是实际落到的行号，空区间时 begin == end"""
+        with self.lock:
+            first, last, _ = slice(start, stop).indices(len(self.starts))
+            if first >= last:
+                return self.covered, self.covered, first, first
+            end = self.starts[last] if last < len(self.starts) else self.covered
+            return self.starts[first], end, first, last
+
+    def partial(self):
+        """covered 之后、还没写完换行的残行（str，去掉首尾空白；没有则为空串）；不先 refresh"""
+        with self.lock:
+            covered = self.covered
+        with open(self.path, 'rb') as f:
+            f.seek(covered)
+            data = f.read()
+        return data.rsplit(b'\n', 1)[-1].decode('utf-8', errors='replace').strip()
+
+    def read(self, start=0, stop=None):
+        """读第 [start, stop) 行（切片语义），返回 str 列表（不含换行）；不先 refresh"""
+        begin, end, _, _ = self.span(start, stop)
+        if end <= begin:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(begin)
+            data = f.read(end - begin)
+        return [ln.decode('utf-8', errors='replace') for ln in data.split(b'\n') if ln.strip()]
+
+
+def prune():
+    """删掉源文件已不存在的旁路文件（会话被删后留下的），旧格式的也一并删；返回删掉的个数。
+    头部读不全的（别的进程正在写）跳过，下一轮再看"""
+    removed = 0
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return 0
+    for name in names:
+        if not name.endswith('.idx'):
+            continue
+        target = CACHE_DIR / name
+        try:
+            with open(target, 'rb') as f:
+                magic, *_, plen = struct.unpack(HEADER_FMT, f.read(HEADER_SIZE))
+                source = f.read(plen) if magic == MAGIC else b''
+            if magic == MAGIC and (len(source) < plen
+                                   or os.path.exists(source.decode('utf-8', errors='surrogateescape'))):
+                continue
+            os.remove(target)
+            removed += 1
+        except (OSError, struct.error, ValueError):
+            continue
+    return removed
+
+
+def _prune_due():
+    """距上次 prune 满 PRUNE_INTERVAL 秒时返回 True（并占下这一轮）"""
+    global _next_prune
+    now = time.monotonic()
+    with _lock:
+        if now < _next_prune:
+            return False
+        _next_prune = now + PRUNE_INTERVAL
+    return True
+
+
+def get(path):
+    """取 path 的行索引并追到最新（进程内缓存）；顺带按 PRUNE_INTERVAL 清理孤立的旁路文件"""
+    if _prune_due():
+        prune()
+    key = os.path.abspath(path)
+    with _lock:
+        idx = _loaded.get(key)
+        if idx is None:
+            idx = _loaded[key] = LineIndex(key)
+            while len(_loaded) > MAX_LOADED:
+                _loaded.popitem(last=False)
+        else:
+            _loaded.move_to_end(key)
+    return idx.refresh()
+
+
+def read_lines(path, start=0, stop=None):
+    """读 path 的第 [start, stop) 行（切片语义），返回 str 列表（不含换行）"""
+    return get(path).read(start, stop)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""推送复制的本地收集端（测试/替身用）：接收中继 relay_push 推来的批，镜像成本地文件。
+
+每个 POST 正文（可能 gzip）是 relay_push 的批：首行 {relay, hostname, machine_id, seq, frames}，
+每帧 {key, offset, length, size, reset?} + length 个原始字节，删除帧 {key, deleted: true}，末行 {done: true}。
+落盘到 <out>/<machine_id 或 hostname>/<key>，按 offset 幂等：
+  - offset + length <= 已有长度：重推，跳过；有重叠只写新的那截；
+  - offset > 已有长度（本地丢过数据）：不写，回 409 {need: {key: 已有长度}}，中继从那里重推；
+  - reset：先截成 0 再写；deleted：删掉本地副本。
+GET /stats 返回收到的请求数、帧数、字节数与各中继最后的 seq。
+
+用法：python push_collector.py [--port=8790] [--out=./push_mirror]
+                              [--subscribe=http://中继:8765 [--codex=1] [--start_from=start] [--advertise=本机地址]]
+带 --subscribe 时起来后自己去中继 POST /push/subscribe 登记（url 指回本收集端）；跨机时中继须把
+本机 IP 列进 CLAUDE_RELAY_PUSH_ALLOW，否则回 403。纯标准库。
+"""
+import os
+import io
+import sys
+import json
+import gzip
+import time
+import socket
+import threading
+import urllib.request
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+COLLECTOR_DEFAULTS = {
+    "port": 8790,
+    "out": "push_mirror",
+    "subscribe": "",
+    "codex": 0,
+    "start_from": "now",
+    "advertise": "",
+}
+PUSH_PATH = "/push"
+SUBSCRIBE_ATTEMPTS = 10
+
+_lock = threading.Lock()
+_stats = {"requests": 0, "frames": 0, "bytes_in": 0, "bytes_written": 0, "conflicts": 0, "relays": {}}
+
+
+def _mirror_path(out, source, key):
+    """<out>/<source>/<key>；key 或 source 带 .. / 绝对路径时返回 None"""
+    parts = [p for p in key.split('/') if p]
+    if not parts or any(p in ('.', '..') or '\\' in p or ':' in p for p in parts):
+        return None
+    if not source or source in ('.', '..') or any(c in source for c in '/\\:'):
+        return None
+    return Path(out, source, *parts)
+
+
+def _apply_frame(path, head, data):
+    """把一帧写进本地副本；返回 (写入字节数, 本地长度不够时需要的 offset 或 None)"""
+    if head.get('deleted'):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return 0, None
+    offset = int(head.get('offset') or 0)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'r+b' if path.exists() else 'w+b') as f:
+        if head.get('reset'):
+            f.truncate(0)
+        have = f.seek(0, os.SEEK_END)
+        if offset > have:
+            return 0, have
+        skip = have - offset
+        if skip >= len(data):
+            return 0, None
+        f.write(data[skip:])
+        return len(data) - skip, None
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    out = COLLECTOR_DEFAULTS["out"]
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _json(self, obj, status=200):
+        data = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/stats':
+            with _lock:
+                self._json({'ok': True, **_stats})
+        else:
+            self._json({'ok': False, 'error': 'not found'}, 404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if urlparse(self.path).path != PUSH_PATH:
+            self._json({'ok': False, 'error': 'not found'}, 404)
+            return
+        try:
+            raw = gzip.decompress(body) if self.headers.get('Content-Encoding') == 'gzip' else body
+            buf = io.BytesIO(raw)
+            meta = json.loads(buf.readline())
+            source = str(meta.get('machine_id') or meta.get('hostname') or 'unknown')
+            frames, written, need = 0, 0, {}
+            with _lock:
+                while True:
+                    line = buf.readline()
+                    if not line.strip():
+                        raise ValueError('batch truncated')
+                    head = json.loads(line)
+                    if head.get('done'):
+                        break
+                    data = buf.read(int(head.get('length') or 0))
+                    key = str(head.get('key') or '')
+                    path = _mirror_path(self.out, source, key)
+                    if path is None:
+                        raise ValueError(f'bad key: {key!r}')
+                    n, want = _apply_frame(path, head, data)
+                    frames += 1
+                    written += n
+                    if want is not None:
+                        need[key] = want
+                _stats['requests'] += 1
+                _stats['frames'] += frames
+                _stats['bytes_in'] += len(body)
+                _stats['bytes_written'] += written
+                _stats['conflicts'] += bool(need)
+                _stats['relays'][source] = {'hostname': meta.get('hostname'), 'seq': meta.get('seq'),
+                                            'at': time.time()}
+        except (ValueError, OSError, EOFError) as e:
+            self._json({'ok': False, 'error': str(e)}, 400)
+            return
+        print(f"[{time.strftime('%H:%M:%S')}] {meta.get('hostname')} #{meta.get('seq')}："
+              f"{frames} 帧，收 {len(body)} B，写入 {written} B" + (f"，缺口 {len(need)} 个文件（回 409）" if need else ""))
+        if need:
+            self._json({'ok': False, 'need': need}, 409)
+        else:
+            self._json({'ok': True, 'frames': frames, 'written': written})
+
+
+def _advertise_host(relay_host):
+    """对中继可达的本机地址：朝中继方向开个 UDP 套接字看本端地址"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect((relay_host, 9))
+            return s.getsockname()[0]
+    except OSError:
+        return '127.0.0.1'
+
+
+def subscribe(relay, self_url, codex=False, start_from='now'):
+    payload = json.dumps({'url': self_url, 'codex': bool(codex), 'from': start_from}).encode('utf-8')
+    req = urllib.request.Request(relay.rstrip('/') + '/push/subscribe', data=payload,
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+
+def _parse_args(argv):
+    """--name=value（name 中的 - 等价于 _），按 COLLECTOR_DEFAULTS 里的类型转换；未知参数忽略"""
+    opts = dict(COLLECTOR_DEFAULTS)
+    for a in argv:
+        if not a.startswith("--") or "=" not in a:
+            continue
+        k, v = a[2:].split("=", 1)
+        k = k.replace("-", "_")
+        if k in opts:
+            try:
+                opts[k] = type(COLLECTOR_DEFAULTS[k])(v)
+            except ValueError:
+                print(f"参数 --{k}={v} 无效，已忽略")
+    return opts
+
+
+def run(opts):
+    CollectorHandler.out = opts["out"]
+    server = ThreadingHTTPServer(('0.0.0.0', opts["port"]), CollectorHandler)
+    server.daemon_threads = True
+    port = server.server_address[1]
+    print(f"推送收集端 :{port}{PUSH_PATH} → {os.path.abspath(opts['out'])}")
+    if opts["subscribe"]:
+        host = opts["advertise"] or _advertise_host(urlparse(opts["subscribe"]).hostname or '127.0.0.1')
+        self_url = f"http://{host}:{port}{PUSH_PATH}"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        for attempt in range(SUBSCRIBE_ATTEMPTS):
+            try:
+                r = subscribe(opts["subscribe"], self_url, opts["codex"], opts["start_from"])
+                print(f"已向 {opts['subscribe']} 订阅：{self_url}（{r.get('subscriber', r)}）")
+                break
+            except Exception as e:
+                if attempt == SUBSCRIBE_ATTEMPTS - 1:
+                    print(f"订阅失败：{e}")
+                time.sleep(1)  # 中继可能还在启动
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    else:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    run(_parse_args(sys.argv[1:]))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""薄中继 /raw/file 的行过滤与字段裁剪：只把对端要的那部分 JSONL 传出去。
+
+会话文件的大头是 tool_result 正文、toolUseResult（同一结果的结构化副本）和文件快照，
+只看对话文字的对端（手机、远程 Monitor）拿到后也是丢掉。过滤参数：
+  types=user,assistant      只留顶层 type 在其中的行
+  drop=tool_result_content  清空 tool_result 块的 content 并去掉顶层 toolUseResult
+  drop=tool_use_input       清空 tool_use 块的 input
+  drop=thinking             清空 thinking 块的正文与 signature
+  max_field=N               任何字符串值超过 N 个字符截断为前 N 个 + '…'
+  fields=type,uuid,message  字段投影：只留这些顶层键（cwd/version/gitBranch 等每行重复的信封不传）
+（types / drop / fields 均可逗号分隔多项。）
+Codex rollout 同样适用：types 按顶层 type（response_item / event_msg …）；三种 drop 分别对应
+function_call_output 的 output、function_call 的 arguments、reasoning 的 summary/content/encrypted_content。
+
+偏移仍按原文件算：输出的每个对象带 "_offset"（该行在原文件中的起始字节），响应头
+X-Next-Offset 给出处理到的原文件位置（最后一个完整行之后），对端下次 offset= 它即可，
+与未过滤的增量读完全衔接。不完整的尾行留到下次。
+不需改动的行整行原样透传（只在开头拼上 _offset），免去一次 json 往返。
+纯标准库。
+"""
+import json
+
+DROP_FIELDS = ('tool_result_content', 'tool_use_input', 'thinking')
+ELLIPSIS = '…'
+
+
+class LineFilter:
+    def __init__(self, types=None, drop=(), max_field=0, fields=None):
+        self.types = frozenset(types) if types else None
+        self.drop = frozenset(drop)
+        self.max_field = max_field
+        self.fields = tuple(fields) if fields else None
+        # 廉价预筛：行里连 "type":"user" 这样的片段都没有，就不可能是要的行，不必解析
+        self._type_marks = tuple(
+            m for t in sorted(self.types or ())
+            for m in (f'"type":"{t}"'.encode(), f'"type": "{t}"'.encode())
+        )
+        marks = []
+        if 'tool_result_content' in self.drop:
+            marks += [b'"tool_result"', b'"toolUseResult"', b'"function_call_output"']
+        if 'tool_use_input' in self.drop:
+            marks += [b'"tool_use"', b'"function_call"']
+        if 'thinking' in self.drop:
+            marks += [b'"thinking"', b'"reasoning"']
+        self._drop_marks = tuple(marks)
+
+    @classmethod
+    def from_query(cls, qs):
+        """从 /raw/file 的查询参数构造；没有任何过滤参数返回 None，参数不合法抛 ValueError"""
+        def values(name):
+            return [v.strip() for raw in qs.get(name, []) for v in raw.split(',') if v.strip()]
+
+        types, drop, fields = values('types'), values('drop'), values('fields')
+        raw_max = (qs.get('max_field', [''])[0] or '').strip()
+        if not (types or drop or raw_max or fields):
+            return None
+        unknown = [d for d in drop if d not in DROP_FIELDS]
+        if unknown:
+            raise ValueError(f'unknown drop: {",".join(unknown)}')
+        try:
+            max_field = int(raw_max) if raw_max else 0
+        except ValueError:
+            raise ValueError('invalid max_field')
+        if max_field < 0:
+            raise ValueError('invalid max_field')
+        return cls(types, drop, max_field, fields)
+
+    def apply(self, line, offset):
+        """处理一行（bytes，不含换行），返回要输出的行（带换行）；整行被滤掉返回 None"""
+        if self.types is not None and not any(m in line for m in self._type_marks):
+            return None
+        needs_edit = self.fields is not None or (self.max_field and len(line) > self.max_field) or \
+            any(m in line for m in self._drop_marks)
+        if not needs_edit and self.types is None:
+            return self._tag(line, offset)
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            # 半行/坏行：类型过滤下无从判断，丢掉；否则原样透传
+            return None if self.types is not None else line + b'\n'
+        if not isinstance(obj, dict):
+            return None if self.types is not None else line + b'\n'
+        if self.types is not None and obj.get('type') not in self.types:
+            return None
+        if not needs_edit:
+            return self._tag(line, offset)
+        if self.fields is not None:
+            obj = {k: obj[k] for k in self.fields if k in obj}
+        self._strip(obj)
+        if self.max_field:
+            obj = self._truncate(obj)
+        out = {'_offset': offset}
+        out.update(obj)
+        return json.dumps(out, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    @staticmethod
+    def _tag(line, offset):
+        if line.startswith(b'{') and len(line) > 2:
+            return b'{"_offset":%d,' % offset + line[1:] + b'\n'
+        return line + b'\n'
+
+    def _strip(self, obj):
+        if 'tool_result_content' in self.drop:
+            obj.pop('toolUseResult', None)
+        payload = obj.get('payload')
+        if isinstance(payload, dict):
+            self._strip_codex(payload)
+            return
+        msg = obj.get('message')
+        content = msg.get('content') if isinstance(msg, dict) else None
+        if not isinstance(content, list):
+            return
+        for block in content:
+            if not isinstance(block, dict):
+                continue
+            kind = block.get('type')
+            if kind == 'tool_result' and 'tool_result_content' in self.drop:
+                block['content'] = ''
+            elif kind == 'tool_use' and 'tool_use_input' in self.drop:
+                block['input'] = {}
+            elif kind == 'thinking' and 'thinking' in self.drop:
+                block['thinking'] = ''
+                block.pop('signature', None)
+
+    def _strip_codex(self, payload):
+        kind = payload.get('type')
+        if kind == 'function_call_output' and 'tool_result_content' in self.drop:
+            payload['output'] = ''
+        elif kind == 'function_call' and 'tool_use_input' in self.drop:
+            payload['arguments'] = ''
+        elif kind == 'reasoning' and 'thinking' in self.drop:
+            payload['summary'] = []
+            payload.pop('content', None)
+            payload.pop('encrypted_content', None)
+
+    def _truncate(self, value):
+        if isinstance(value, str):
+            return value if len(value) <= self.max_field else value[:self.max_field] + ELLIPSIS
+        if isinstance(value, dict):
+            return {k: self._truncate(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._truncate(v) for v in value]
+        return value
+
+    def iter_range(self, f, start, end):
+        """逐块产出 f 中 [start, end) 的过滤结果；end 须落在行边界（上一个字符是换行）"""
+        f.seek(start)
+        pos = start
+        buf = []
+        size = 0
+        while pos < end:
+            line = f.readline(end - pos)
+            if not line:
+                break
+            out = self.apply(line.rstrip(b'\r\n'), pos) if line.strip() else None
+            pos += len(line)
+            if out:
+                buf.append(out)
+                size += len(out)
+                if size >= 64 * 1024:
+                    yield b''.join(buf)
+                    buf, size = [], 0
+        if buf:
+            yield b''.join(buf)
+
+
+def line_bounds(f, start, size):
+    """把 [start, size) 收到完整行上：起点不在行首时跳到下一行开头，终点截到最后一个换行之后。
+    返回 (first, end)；区间内没有完整行时 first == end。"""
+    if start > 0:
+        f.seek(start - 1)
+        if f.read(1) != b'\n':
+            f.readline()
+            start = min(f.tell(), size)
+    end = size
+    block = 64 * 1024
+    while end > start:
+        lo = max(start, end - block)
+        f.seek(lo)
+        data = f.read(end - lo)
+        i = data.rfind(b'\n')
+        if i >= 0:
+            return start, lo + i + 1
+        end = lo
+    return start, start
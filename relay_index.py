@@ -0,0 +1,661 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""薄中继的会话文件索引：{key: (size, mtime)} + 变更代数，支撑 /raw/list 增量列表。
+
+每次发现某个文件的 (size, mtime) 变了（新增/追加/改写），全局代数 gen +1 并记到该 key 上；
+删除则记一条墓碑。游标 = 「进程纪元.代数」：
+  - 纪元每次中继启动随机生成，对端拿旧进程的游标来 → 认不出 → 回全量（full=true）；
+  - 墓碑只留最近 MAX_TOMBSTONES 条，游标早于被裁掉的那段 → 同样回全量，保证不漏删除。
+ETag 直接用当前游标：任何文件变化都会换 ETag，没变就能回 304。
+
+start_watcher() 后索引由后台线程维护，列表请求只读字典、不再遍历目录：
+  - Linux：ctypes 调 inotify，只对有事件的文件 stat；
+  - 其它平台 / inotify 不可用：轮询——目录 mtime 变了才 listdir（发现新增/删除），
+    最近活跃的「热」文件每轮 stat（发现追加），其余文件隔 FULL_SWEEP_SECONDS 才全量扫一次。
+两种模式都定期全量对账，兜住漏掉的事件。
+
+列表条目带 fingerprint：blake2b-128(8 字节小端 size + 头 FINGERPRINT_EDGE_BYTES 字节 + 尾同样多字节)，
+按 (size, mtime) 缓存，只在文件变了之后的下一次列表才重读首尾。对端记下拉到 size=L 时的指纹，
+之后用 /raw/fingerprint?upto=L 比对即可判断是追加（前缀未变，可继续增量读）还是被改写（须整文件重拉）。
+（mtime 按秒计：同一秒内改写成同样大小的极端情况会沿用旧指纹。）
+
+mounts 挂额外的目录树（Codex 的 sessions / archived_sessions），key 为「前缀/树内相对路径」，
+如 codex/sessions/2026/08/29/rollout-….jsonl。它们按 YYYY/MM/DD 分片、层级不固定，
+两种看门模式下都由 _TreePoller 轮询：每轮 stat 树内各目录，mtime 变了才 listdir，热文件每轮 stat。
+全量对账（refresh）同样覆盖这些树，代数/墓碑/游标/指纹与项目文件共用一套。
+
+subscribe() 给 /raw/watch(SSE) 用：每个订阅者一个有界队列，索引一有变化就推
+('change', key, size, mtime, cursor) / ('delete', key, cursor)。慢消费者队列满了不阻塞
+索引线程——直接清空并标记 overflowed，由消费者发一次 resync 让对端走增量列表补齐。
+纯标准库，线程安全（中继是多线程服务器）。
+"""
+import os
+import sys
+import time
+import errno
+import select
+import queue
+import struct
+import hashlib
+import threading
+from pathlib import Path
+
+from relay_metrics import REGISTRY
+
+MAX_TOMBSTONES = 10000
+POLL_INTERVAL = 1.0          # 轮询模式每轮间隔（秒）
+HOT_WINDOW = 15 * 60         # mtime 在这么久以内的文件算「热」，轮询模式每轮都 stat
+FULL_SWEEP_SECONDS = 30      # 轮询模式全量对账间隔
+INOTIFY_SWEEP_SECONDS = 300  # inotify 模式全量对账间隔（兜底丢事件 / 队列溢出之外的意外）
+INOTIFY_DEBOUNCE = 0.05      # 事件攒批：同一文件连写多次只 stat 一次
+SUBSCRIBER_QUEUE_SIZE = 1024  # 每个订阅者最多积压的事件数，超了丢弃并要求 resync
+FINGERPRINT_EDGE_BYTES = 4096  # 指纹取文件头、尾各这么多字节
+FINGERPRINT_ALGO = 'blake2b-128'
+
+
+def scan_projects(root):
+    """遍历 root/<project>/<session>.jsonl，返回 {key: (size, mtime)}"""
+    out = {}
+    root = Path(root)
+    if not root.exists():
+        return out
+    for dir_name in os.listdir(root):
+        dir_path = root / dir_name
+        if not dir_path.is_dir():
+            continue
+        for fn in os.listdir(dir_path):
+            if not fn.endswith('.jsonl'):
+                continue
+            try:
+                st = (dir_path / fn).stat()
+            except OSError:
+                continue
+            out[f"{dir_name}/{fn}"] = (int(st.st_size), int(st.st_mtime))
+    return out
+
+
+def _stat_key(root, key):
+    """stat 单个 key，返回 (size, mtime)；不存在返回 None"""
+    try:
+        st = os.stat(os.path.join(root, key))
+    except OSError:
+        return None
+    return int(st.st_size), int(st.st_mtime)
+
+
+def _scan_dir(root, dir_name):
+    """只扫一个项目目录，返回 {key: (size, mtime)}"""
+    out = {}
+    dir_path = Path(root) / dir_name
+    try:
+        names = os.listdir(dir_path)
+    except OSError:
+        return out
+    for fn in names:
+        if not fn.endswith('.jsonl'):
+            continue
+        try:
+            st = (dir_path / fn).stat()
+        except OSError:
+            continue
+        out[f"{dir_name}/{fn}"] = (int(st.st_size), int(st.st_mtime))
+    return out
+
+
+def fingerprint(f, size, edge=FINGERPRINT_EDGE_BYTES):
+    """已打开文件 f 前 size 字节的首尾指纹（hex）；文件已短于 size 返回 None"""
+    h = hashlib.blake2b(size.to_bytes(8, 'little'), digest_size=16)
+    f.seek(0)
+    head = f.read(min(edge, size))
+    f.seek(max(0, size - edge))
+    tail = f.read(min(edge, size))
+    if len(head) < min(edge, size) or len(tail) < min(edge, size):
+        return None
+    h.update(head)
+    h.update(tail)
+    return h.hexdigest()
+
+
+def scan_tree(root, prefix):
+    """递归遍历挂载树 root 下所有 .jsonl，返回 {前缀/相对路径: (size, mtime)}"""
+    out = {}
+    root = Path(root)
+    for dirpath, _dirnames, filenames in os.walk(root):
+        rel = Path(dirpath).relative_to(root).as_posix()
+        base = prefix if rel == '.' else f"{prefix}/{rel}"
+        for fn in filenames:
+            if not fn.endswith('.jsonl'):
+                continue
+            try:
+                st = os.stat(os.path.join(dirpath, fn))
+            except OSError:
+                continue
+            out[f"{base}/{fn}"] = (int(st.st_size), int(st.st_mtime))
+    return out
+
+
+def _entry(key, size, mtime):
+    name = key.rsplit('/', 1)[-1][:-6]
+    if key.startswith('codex/'):
+        # rollout-2026-08-29T03-18-12-<uuid>：会话 id 是结尾的 uuid
+        provider = 'codex'
+        if len(name) > 36 and name[-37] == '-':
+            name = name[-36:]
+    else:
+        provider = 'claude'
+    return {
+        'key': key,
+        'session_id': name,
+        'provider': provider,
+        'mtime': mtime,
+        'size': size,
+    }
+
+
+class Subscription:
+    """一个变化订阅者：有界队列 + 溢出标记"""
+
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def _push(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def get(self, timeout):
+        """取下一个事件；超时返回 None。溢出后返回一次 ('resync',) 并清除标记"""
+        if not self.overflowed:
+            try:
+                return self.queue.get(timeout=timeout)
+            except queue.Empty:
+                if not self.overflowed:
+                    return None
+        self.overflowed = False
+        return ('resync',)
+
+
+class FileIndex:
+    def __init__(self, root, mounts=None):
+        self.root = Path(root)
+        self.mounts = [(prefix, Path(path)) for prefix, path in (mounts or [])]  # [(key 前缀, 目录)]
+        self.epoch = os.urandom(4).hex()
+        self._lock = threading.Lock()
+        self._files = {}       # key -> (size, mtime)
+        self._changed = {}     # key -> 最近一次变化时的 gen
+        self._deleted = {}     # key -> 删除时的 gen（墓碑）
+        self._gen = 0
+        self._floor = 0        # 比它更早的墓碑已被裁掉，游标 < floor 只能回全量
+        self._watcher = None
+        self.mode = None       # 'inotify' / 'poll' / None(未启动，按请求现扫)
+        self._subs = set()
+        self._fps = {}         # key -> ((size, mtime), 指纹)
+
+    @property
+    def watching(self):
+        return self._watcher is not None and self._watcher.is_alive()
+
+    def start_watcher(self):
+        """先全量建索引，再起后台线程持续维护；可重复调用"""
+        if self.watching:
+            return
+        self.refresh()
+        watcher = None
+        if sys.platform.startswith('linux'):
+            watcher = _InotifyWatcher.create(self)
+        if watcher is None:
+            watcher = _PollWatcher(self)
+        self.mode = watcher.mode
+        self._watcher = threading.Thread(target=watcher.run, name='relay-index-watcher', daemon=True)
+        self._watcher.start()
+        # 后台把指纹先算好，第一次 /raw/list 不必现读几千个文件的首尾
+        threading.Thread(target=self._warm_fingerprints, name='relay-index-fingerprints', daemon=True).start()
+
+    def ensure_fresh(self):
+        """列表请求入口：有后台维护就直接读；没有就现扫一遍"""
+        if not self.watching:
+            self.refresh()
+
+    def subscribe(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        sub = Subscription(maxsize)
+        with self._lock:
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def get(self, key):
+        """单个 key 的 (size, mtime)；不存在返回 None"""
+        with self._lock:
+            return self._files.get(key)
+
+    def snapshot_keys(self):
+        with self._lock:
+            return dict(self._files)
+
+    def refresh(self):
+        """全量扫一遍并与上次结果求差，更新代数/墓碑"""
+        t0 = time.perf_counter()
+        files = scan_projects(self.root)
+        for prefix, path in self.mounts:
+            files.update(scan_tree(path, prefix))
+        REGISTRY.observe('relay_list_scan_seconds', time.perf_counter() - t0)
+        REGISTRY.gauge_set('relay_list_scan_files', len(files))
+        self.apply(files, complete=True)
+
+    def apply(self, files, complete=False):
+        """合入一批 {key: (size, mtime) 或 None(已删除)}；complete=True 表示这是全量快照，
+        快照里没有的旧 key 一并视为删除"""
+        with self._lock:
+            if complete:
+                files = dict(files)
+                for key in self._files:
+                    if key not in files:
+                        files[key] = None
+            for key, stat in files.items():
+                old = self._files.get(key)
+                if stat is None:
+                    if old is None:
+                        continue
+                    self._gen += 1
+                    del self._files[key]
+                    self._fps.pop(key, None)
+                    self._changed.pop(key, None)
+                    self._deleted[key] = self._gen
+                    self._notify(('delete', key, self.cursor()))
+                elif stat != old:
+                    self._gen += 1
+                    self._files[key] = stat
+                    self._changed[key] = self._gen
+                    self._deleted.pop(key, None)
+                    self._notify(('change', key, stat[0], stat[1], self.cursor()))
+            if len(self._deleted) > MAX_TOMBSTONES:
+                drop = sorted(self._deleted.items(), key=lambda kv: kv[1])
+                drop = drop[:len(self._deleted) - MAX_TOMBSTONES]
+                for key, gen in drop:
+                    del self._deleted[key]
+                    self._floor = max(self._floor, gen)
+
+    def _notify(self, event):
+        # 已持有 self._lock；_push 不会阻塞
+        for sub in self._subs:
+            sub._push(event)
+
+    def cursor(self):
+        return f"{self.epoch}.{self._gen}"
+
+    def etag(self):
+        return f'"{self.cursor()}"'
+
+    def path_of(self, key):
+        """key 对应的文件路径（不做越界检查，调用方负责 key 的合法性）"""
+        for prefix, path in self.mounts:
+            if key.startswith(prefix + '/'):
+                return path / key[len(prefix) + 1:]
+        return self.root / key
+
+    def fingerprint(self, key, stat):
+        """key 在 stat=(size, mtime) 时的首尾指纹，按 stat 缓存；读不到返回 None"""
+        with self._lock:
+            cached = self._fps.get(key)
+        if cached and cached[0] == stat:
+            return cached[1]
+        try:
+            with open(self.path_of(key), 'rb') as f:
+                fp = fingerprint(f, stat[0])
+        except OSError:
+            return None
+        with self._lock:
+            if fp and self._files.get(key) == stat:
+                self._fps[key] = (stat, fp)
+        return fp
+
+    def _with_fingerprints(self, entries):
+        # 在锁外读文件首尾：缓存命中时只是一次字典查找
+        for e in entries:
+            e['fingerprint'] = self.fingerprint(e['key'], (e['size'], e['mtime']))
+        return entries
+
+    def _warm_fingerprints(self):
+        for key, stat in self.snapshot_keys().items():
+            self.fingerprint(key, stat)
+
+    def files(self, keep=None):
+        """当前全部文件条目（与旧版 /raw/list 的 files 字段同形，另带 provider / fingerprint）；
+        keep(key) 为假的条目不返回（也就不必算指纹）"""
+        with self._lock:
+            entries = [_entry(k, size, mtime) for k, (size, mtime) in self._files.items()
+                       if keep is None or keep(k)]
+        return self._with_fingerprints(entries)
+
+    def changes_since(self, cursor, keep=None):
+        """返回 {full, files, deleted, cursor}：游标有效时只含其后变化的文件与删除，
+        否则 full=True 并给全量 files；keep 同 files()"""
+        with self._lock:
+            delta = self._changes_since(cursor)
+        if keep is not None:
+            delta['files'] = [e for e in delta['files'] if keep(e['key'])]
+            delta['deleted'] = [k for k in delta['deleted'] if keep(k)]
+        self._with_fingerprints(delta['files'])
+        return delta
+
+    def _changes_since(self, cursor):
+        # 已持有 self._lock
+        gen = None
+        epoch, _, raw_gen = (cursor or '').partition('.')
+        if epoch == self.epoch:
+            try:
+                gen = int(raw_gen)
+            except ValueError:
+                gen = None
+        if gen is None or gen < self._floor or gen > self._gen:
+            return {
+                'full': True,
+                'files': [_entry(k, s, m) for k, (s, m) in self._files.items()],
+                'deleted': [],
+                'cursor': self.cursor(),
+            }
+        return {
+            'full': False,
+            'files': [_entry(k, *self._files[k]) for k, g in self._changed.items() if g > gen],
+            'deleted': [k for k, g in self._deleted.items() if g > gen],
+            'cursor': self.cursor(),
+        }
+
+
+class _PollWatcher:
+    """目录 mtime 轮询：跨平台兜底"""
+    mode = 'poll'
+
+    def __init__(self, index):
+        self.index = index
+        self.dir_mtimes = {}
+        self.trees = [_TreePoller(index, prefix, path) for prefix, path in index.mounts]
+
+    def _dir_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def run(self):
+        root = self.index.root
+        last_full = time.monotonic()
+        while True:
+            time.sleep(POLL_INTERVAL)
+            try:
+                if time.monotonic() - last_full >= FULL_SWEEP_SECONDS:
+                    self.index.refresh()
+                    last_full = time.monotonic()
+                    continue
+                self._tick(root)
+                for tree in self.trees:
+                    tree.tick()
+            except Exception:
+                pass  # 看门线程绝不能死；下一轮/下次全量对账会补上
+
+    def _tick(self, root):
+        known = self.index.snapshot_keys()
+        for prefix, _ in self.index.mounts:
+            known = {k: v for k, v in known.items() if not k.startswith(prefix + '/')}
+        by_dir = {}
+        for key in known:
+            by_dir.setdefault(key.split('/', 1)[0], []).append(key)
+        try:
+            dirs = [d for d in os.listdir(root) if (root / d).is_dir()]
+        except OSError:
+            dirs = []
+        changes = {}
+        for d in set(by_dir) - set(dirs):
+            for key in by_dir[d]:
+                changes[key] = None
+            self.dir_mtimes.pop(d, None)
+        now = time.time()
+        for d in dirs:
+            m = self._dir_mtime(root / d)
+            if m != self.dir_mtimes.get(d):
+                # 目录项有增删：重扫这个目录（包括其中删除的）
+                self.dir_mtimes[d] = m
+                fresh = _scan_dir(root, d)
+                for key in by_dir.get(d, []):
+                    if key not in fresh:
+                        changes[key] = None
+                changes.update(fresh)
+                continue
+            for key in by_dir.get(d, []):
+                if now - known[key][1] <= HOT_WINDOW:
+                    changes[key] = _stat_key(root, key)
+        if changes:
+            self.index.apply(changes)
+
+
+class _TreePoller:
+    """一棵挂载树的轮询：缓存每个目录的 (mtime_ns, 子目录, {文件名: key})，目录 mtime 变了才 listdir，
+    没变只 stat 其中 HOT_WINDOW 内活跃过的文件（发现追加）。目录消失则其下文件记删除。
+    路径与 key 全用字符串拼，两年日分片（七百多个目录）一轮也只是几百次 stat。"""
+
+    def __init__(self, index, prefix, root):
+        self.index = index
+        self.prefix = prefix
+        self.root = str(root)
+        self.dirs = {}   # 目录路径 -> (mtime_ns, [子目录名], {jsonl 文件名: key})
+
+    def tick(self):
+        known = self.index.snapshot_keys()
+        changes = {}
+        seen = set()
+        now = time.time()
+        stack = [(self.root, self.prefix)]
+        while stack:
+            d, base = stack.pop()
+            try:
+                m = os.stat(d).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(d)
+            cached = self.dirs.get(d)
+            if cached is None or cached[0] != m:
+                subdirs, files = [], {}
+                try:
+                    with os.scandir(d) as it:
+                        for e in it:
+                            if e.is_dir():
+                                subdirs.append(e.name)
+                            elif e.name.endswith('.jsonl'):
+                                files[e.name] = f"{base}/{e.name}"
+                except OSError:
+                    continue
+                if cached:
+                    for fn, key in cached[2].items():
+                        if fn not in files:
+                            changes[key] = None
+                self.dirs[d] = (m, subdirs, files)
+                for fn, key in files.items():
+                    changes[key] = _stat_key(d, fn)
+            else:
+                subdirs = cached[1]
+                for fn, key in cached[2].items():
+                    st = known.get(key)
+                    if st is None or now - st[1] <= HOT_WINDOW:
+                        changes[key] = _stat_key(d, fn)
+            stack.extend((os.path.join(d, sub), f"{base}/{sub}") for sub in subdirs)
+        for d in [d for d in self.dirs if d not in seen]:
+            for key in self.dirs.pop(d)[2].values():
+                changes[key] = None
+        if changes:
+            self.index.apply(changes)
+
+
+# inotify(7) 常量
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HDR = struct.Struct('iIII')
+_ROOT_MASK = _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR
+_DIR_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_CREATE | _IN_DELETE
+             | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_ONLYDIR)
+
+
+class _InotifyWatcher:
+    """Linux inotify（ctypes 直调 libc，不引第三方依赖）"""
+    mode = 'inotify'
+
+    def __init__(self, index, libc, fd):
+        self.index = index
+        self.libc = libc
+        self.fd = fd
+        self.wd_dirs = {}   # wd -> 项目目录名；根目录记为 ''
+        self.trees = [_TreePoller(index, prefix, path) for prefix, path in index.mounts]
+
+    @classmethod
+    def create(cls, index):
+        """初始化 inotify；任何一步失败都返回 None，由调用方退回轮询"""
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd < 0:
+                return None
+            watcher = cls(index, libc, fd)
+            if not watcher._watch_all():
+                os.close(fd)
+                return None
+            return watcher
+        except Exception:
+            return None
+
+    def _add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            import ctypes
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, 'inotify watch limit reached')
+            return None
+        return wd
+
+    def _watch_all(self):
+        """给根目录和每个项目目录挂 watch；根目录不存在时返回 False（轮询会等它出现）"""
+        root = self.index.root
+        if not root.is_dir():
+            return False
+        try:
+            wd = self._add_watch(root, _ROOT_MASK)
+            if wd is None:
+                return False
+            self.wd_dirs[wd] = ''
+            for d in os.listdir(root):
+                if (root / d).is_dir():
+                    self._watch_dir(d)
+        except OSError:
+            return False
+        return True
+
+    def _watch_dir(self, dir_name):
+        wd = self._add_watch(self.index.root / dir_name, _DIR_MASK)
+        if wd is not None:
+            self.wd_dirs[wd] = dir_name
+
+    def _read_events(self, timeout):
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + _EVENT_HDR.size <= len(buf):
+            wd, mask, _cookie, length = _EVENT_HDR.unpack_from(buf, pos)
+            pos += _EVENT_HDR.size
+            name = buf[pos:pos + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            pos += length
+            events.append((wd, mask, name))
+        return events
+
+    def run(self):
+        root = self.index.root
+        last_full = last_tree = time.monotonic()
+        # 挂载树不挂 inotify（分片层级多、天天新建目录），按轮询节奏顺带看一眼
+        wait = POLL_INTERVAL if self.trees else INOTIFY_SWEEP_SECONDS
+        try:
+            while True:
+                events = self._read_events(wait)
+                if self.trees and time.monotonic() - last_tree >= POLL_INTERVAL:
+                    for tree in self.trees:
+                        tree.tick()
+                    last_tree = time.monotonic()
+                if events:
+                    time.sleep(INOTIFY_DEBOUNCE)  # 攒一小批，连续写入只处理一次
+                    events += self._read_events(0)
+                dirty = set()
+                rescan_dirs = set()
+                full = False
+                for wd, mask, name in events:
+                    if mask & _IN_Q_OVERFLOW:
+                        full = True
+                        continue
+                    dir_name = self.wd_dirs.get(wd)
+                    if mask & _IN_IGNORED:
+                        self.wd_dirs.pop(wd, None)
+                        continue
+                    if dir_name is None:
+                        continue
+                    if dir_name == '':
+                        if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                            full = True
+                        elif mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                            self._watch_dir(name)
+                            rescan_dirs.add(name)
+                        elif mask & _IN_ISDIR and mask & (_IN_DELETE | _IN_MOVED_FROM):
+                            rescan_dirs.add(name)
+                    elif name.endswith('.jsonl'):
+                        dirty.add(f"{dir_name}/{name}")
+                if full or time.monotonic() - last_full >= INOTIFY_SWEEP_SECONDS:
+                    self.index.refresh()
+                    last_full = time.monotonic()
+                    continue
+                changes = {key: _stat_key(root, key) for key in dirty}
+                if rescan_dirs:
+                    known = self.index.snapshot_keys()
+                    for d in rescan_dirs:
+                        fresh = _scan_dir(root, d)
+                        for key in known:
+                            if key.startswith(d + '/') and key not in fresh:
+                                changes[key] = None
+                        changes.update(fresh)
+                if changes:
+                    self.index.apply(changes)
+        except Exception:
+            # inotify 出意外（fd 失效等）：退回轮询，索引继续有人维护
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.index.mode = 'poll'
+            _PollWatcher(self.index).run()
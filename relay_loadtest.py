@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""薄中继压测：按真实比例混合 /api/ping、/raw/list、/raw/file、/api/token_summary 打一台中继，
+报告吞吐、各端点 p50/p95/p99 延迟与中继进程 RSS。
+
+默认自己准备靶子：用 bench_corpus 生成合成语料（伪 HOME），起一个子进程中继指过去，
+压完 POST /api/shutdown 收掉；--url= 则直接压已有中继（此时 RSS 需 --pid= 指定进程）。
+每个并发度一轮（--concurrency=1,8,32），每个虚拟客户端一条 keep-alive 连接，行为仿 Monitor：
+先 /raw/list 拿 key，之后按权重随机选请求；/raw/file 分整文件、尾部 Range、按已知大小增量三种。
+纯标准库。
+
+用法：python relay_loadtest.py [--preset=small] [--engine=threaded|asyncio] [--concurrency=1,8,32]
+                               [--duration=10] [--mix=ping:40,list:25,file:10,tail:10,delta:10,token:5]
+                               [--url=http://host:port --pid=N] [--out=结果.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import tempfile
+import threading
+import subprocess
+import http.client
+from pathlib import Path
+from urllib.parse import urlparse, quote
+
+import bench_corpus
+
+LOAD_DEFAULTS = {
+    "preset": "small",
+    "root": str(Path(tempfile.gettempdir()) / "claude_launcher_loadtest"),
+    "engine": "threaded",
+    "concurrency": "1,8,32",
+    "duration": 10.0,
+    "mix": "ping:40,list:25,file:10,tail:10,delta:10,token:5",
+    "url": "",
+    "pid": 0,
+    "out": "",
+    "seed": 1,
+}
+RSS_SAMPLE_SECONDS = 0.5
+TAIL_BYTES = 64 * 1024
+
+
+def _rss_bytes(pid):
+    """进程常驻内存；取不到返回 None（Linux 读 /proc，其余平台退回 ps / Win32 API）"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if sys.platform == "win32":
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class _Counters(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+            handle = ctypes.windll.kernel32.OpenProcess(0x1000 | 0x0010, False, pid)
+            if not handle:
+                return None
+            try:
+                c = _Counters()
+                c.cb = ctypes.sizeof(c)
+                if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(c), c.cb):
+                    return c.WorkingSetSize
+            finally:
+                ctypes.windll.kernel32.CloseHandle(handle)
+        except Exception:
+            return None
+        return None
+    try:
+        out = subprocess.run(["ps", "-o", "rss=", "-p", str(pid)], capture_output=True, text=True, timeout=5)
+        return int(out.stdout.strip()) * 1024
+    except Exception:
+        return None
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def _parse_mix(spec):
+    mix = []
+    for part in spec.split(","):
+        name, _, w = part.partition(":")
+        if name.strip() and float(w or 1) > 0:
+            mix.append((name.strip(), float(w or 1)))
+    return mix
+
+
+class _Client:
+    """一个虚拟 Monitor：一条 keep-alive 连接 + 已知的文件列表与大小"""
+
+    def __init__(self, host, port, rnd):
+        self.host, self.port = host, port
+        self.rnd = rnd
+        self.conn = None
+        self.files = []
+
+    def request(self, path, headers=None):
+        """发一个请求读完正文，返回 (状态码, 正文字节数, 正文)；连接坏了重连一次"""
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.conn.request("GET", path, headers=headers or {})
+                resp = self.conn.getresponse()
+                body = resp.read()
+                if resp.getheader("Connection", "").lower() == "close":
+                    self.conn.close()
+                    self.conn = None
+                return resp.status, len(body), body
+            except (OSError, http.client.HTTPException):
+                if self.conn is not None:
+                    self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def refresh_list(self):
+        status, n, body = self.request("/raw/list")
+        if status == 200:
+            self.files = [(e["key"], e["size"]) for e in json.loads(body).get("files", [])]
+        return status, n
+
+    def pick(self):
+        # 越新的文件越常被拉（列表按 mtime 排好序时近似 Monitor 的行为）
+        return self.files[min(len(self.files) - 1, int(self.rnd.expovariate(1 / 8)))]
+
+    def run_op(self, op):
+        if op == "ping":
+            status, n, _ = self.request("/api/ping")
+            return status, n
+        if op == "list":
+            return self.refresh_list()
+        if op == "token":
+            status, n, _ = self.request("/api/token_summary?since_days=400")
+            return status, n
+        if not self.files:
+            self.refresh_list()
+            if not self.files:
+                return 0, 0
+        key, size = self.pick()
+        path = f"/raw/file?key={quote(key)}"
+        if op == "tail":
+            status, n, _ = self.request(path, {"Range": f"bytes=-{TAIL_BYTES}"})
+        elif op == "delta":
+            status, n, _ = self.request(f"{path}&offset={size}")
+        else:
+            status, n, _ = self.request(path, {"Accept-Encoding": "gzip"})
+        return status, n
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def run_phase(host, port, concurrency, duration, mix, pid=None, seed=1):
+    """一个并发度压 duration 秒，返回汇总"""
+    names = [n for n, _ in mix]
+    weights = [w for _, w in mix]
+    lat = {n: [] for n in names}
+    stats = {"errors": 0, "bytes": 0, "status": {}}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    rss = []
+    done = threading.Event()
+
+    def sampler():
+        while not done.is_set():
+            v = _rss_bytes(pid) if pid else None
+            if v:
+                rss.append(v)
+            done.wait(RSS_SAMPLE_SECONDS)
+
+    def worker(i):
+        rnd = random.Random(seed * 1000 + i)
+        client = _Client(host, port, rnd)
+        local = {n: [] for n in names}
+        errors = nbytes = 0
+        codes = {}
+        try:
+            client.refresh_list()
+        except Exception:
+            pass
+        while time.monotonic() < stop_at:
+            op = rnd.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                status, n = client.run_op(op)
+            except Exception:
+                errors += 1
+                continue
+            local[op].append(time.perf_counter() - t0)
+            nbytes += n
+            codes[status] = codes.get(status, 0) + 1
+            if status >= 500 or status == 0:
+                errors += 1
+        client.close()
+        with lock:
+            for n in names:
+                lat[n].extend(local[n])
+            stats["errors"] += errors
+            stats["bytes"] += nbytes
+            for c, k in codes.items():
+                stats["status"][str(c)] = stats["status"].get(str(c), 0) + k
+
+    threading.Thread(target=sampler, daemon=True).start()
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    done.set()
+
+    def summary(samples):
+        s = sorted(samples)
+        return {"count": len(s),
+                "p50_ms": _ms(_percentile(s, 50)), "p95_ms": _ms(_percentile(s, 95)),
+                "p99_ms": _ms(_percentile(s, 99)), "max_ms": _ms(s[-1] if s else None)}
+
+    total = sum(len(v) for v in lat.values())
+    every = [x for v in lat.values() for x in v]
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0,
+        "mb_per_s": round(stats["bytes"] / elapsed / 1048576, 2) if elapsed else 0,
+        "errors": stats["errors"],
+        "status": stats["status"],
+        "latency": dict(summary(every), endpoints={n: summary(v) for n, v in lat.items()}),
+        "rss_bytes": {"min": min(rss), "max": max(rss), "last": rss[-1]} if rss else None,
+    }
+
+
+def _ms(v):
+    return None if v is None else round(v * 1000, 2)
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def _spawn_relay(root, engine):
+    """在伪 HOME 下起子进程中继，等它能响应 ping；返回 (Popen, port)"""
+    port = _free_port()
+    env = dict(os.environ, HOME=str(root), USERPROFILE=str(root))
+    env.pop("CLAUDE_CONFIG_DIR", None)
+    env.pop("CODEX_HOME", None)
+    script = Path(__file__).resolve().parent / "session_api_server.py"
+    proc = subprocess.Popen([sys.executable, str(script), str(port), "0", f"--engine={engine}"],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/api/ping")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("relay did not start")
+
+
+def _stop_relay(proc, port):
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        conn.request("POST", "/api/shutdown", body=b"")
+        conn.getresponse().read()
+    except Exception:
+        pass
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def main(opts):
+    mix = _parse_mix(opts["mix"])
+    levels = [int(x) for x in str(opts["concurrency"]).split(",") if x.strip()]
+    proc = None
+    report = {"target": None, "engine": None, "corpus": None, "mix": dict(mix), "phases": []}
+    if opts["url"]:
+        u = urlparse(opts["url"])
+        host, port, pid = u.hostname, u.port or 80, opts["pid"] or None
+        report["target"] = opts["url"]
+    else:
+        preset = bench_corpus.PRESETS.get(opts["preset"] or "small", {})
+        corpus = bench_corpus.build(opts["root"], **preset, seed=opts["seed"])
+        report["corpus"] = {k: corpus[k] for k in ("params", "claude_files", "codex_files", "bytes", "lines")}
+        print(f"语料：Claude {corpus['claude_files']} / Codex {corpus['codex_files']} 个文件，"
+              f"{corpus['bytes'] / 1048576:.1f} MB")
+        proc, port = _spawn_relay(opts["root"], opts["engine"])
+        host, pid = "127.0.0.1", proc.pid
+        report["target"] = f"http://127.0.0.1:{port}"
+        report["engine"] = opts["engine"]
+    report["rss_idle_bytes"] = _rss_bytes(pid) if pid else None
+    try:
+        # 预热：让 token 索引与文件列表先就绪，压的是稳态
+        warm = _Client(host, port, random.Random(0))
+        warm.run_op("token")
+        warm.close()
+        for c in levels:
+            r = run_phase(host, port, c, opts["duration"], mix, pid, opts["seed"])
+            report["phases"].append(r)
+            lat = r["latency"]
+            rss = r["rss_bytes"]
+            peak = f"{rss['max'] / 1048576:.1f} MB" if rss else "-"
+            print(f"并发 {c:>4}：{r['throughput_rps']:>8} req/s  {r['mb_per_s']:>7} MB/s  "
+                  f"p50 {lat['p50_ms']} ms  p95 {lat['p95_ms']} ms  p99 {lat['p99_ms']} ms  "
+                  f"错误 {r['errors']}  RSS 峰值 {peak}")
+            for name, e in lat["endpoints"].items():
+                print(f"        {name:<6} n={e['count']:<7} p50 {e['p50_ms']}  p95 {e['p95_ms']}  p99 {e['p99_ms']} ms")
+    finally:
+        if proc is not None:
+            _stop_relay(proc, port)
+    return report
+
+
+if __name__ == "__main__":
+    opts, _ = bench_corpus.parse_args(sys.argv[1:], LOAD_DEFAULTS)
+    opts = {**LOAD_DEFAULTS, **opts}
+    rep = main(opts)
+    if opts["out"]:
+        with open(opts["out"], "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=1)
+        print(f"结果已写入 {opts['out']}")
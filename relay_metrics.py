@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""薄中继的进程内指标：计数器 / 仪表 / 直方图，经 /api/metrics 以 JSON 或 Prometheus 文本导出。
+
+开销按「常开」设计：一次记录 = 一把锁 + 一次 dict 查找（直方图再加一次 bisect），
+不起线程、不落盘。标签只允许有限取值（端点名已在中继侧归一），避免序列数膨胀。
+纯标准库。
+"""
+import time
+import bisect
+import threading
+
+# 延迟直方图的桶上界（秒）；最后隐含 +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_HELP = {
+    'relay_requests_total': ('counter', '按端点/方法/状态码统计的请求数'),
+    'relay_request_seconds': ('histogram', '请求处理耗时（从分发到响应写完）'),
+    'relay_bytes_in_total': ('counter', '收到的请求正文字节数'),
+    'relay_bytes_out_total': ('counter', '发出的响应字节数（含头，含 sendfile）'),
+    'relay_in_flight': ('gauge', '正在处理的请求数'),
+    'relay_list_scan_seconds': ('histogram', '会话目录全量扫描耗时'),
+    'relay_list_scan_files': ('gauge', '最近一次全量扫描到的文件数'),
+    'relay_token_summary_seconds': ('histogram', 'token 汇总计算耗时'),
+    'relay_token_summary_cache_total': ('counter', 'token 汇总请求按 hit/miss/coalesced 计数'),
+    'relay_raw_filter_bytes_total': ('counter', '过滤读 /raw/file 处理的原文件字节(in)与发出的裁剪后字节(out)'),
+    'relay_push_batches_total': ('counter', '推送复制的批次数，按 ok/error/conflict 计'),
+    'relay_push_bytes_total': ('counter', '推送复制发出的正文字节数（压缩后）'),
+    'relay_push_lag_seconds': ('histogram', '推送复制延迟：文件变化被发现到收集端确认追平'),
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._hists = {}   # key -> [每桶计数..., +Inf 计数, sum, count]
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            self._counters[k] = self._counters.get(k, 0) + value
+
+    def gauge_add(self, name, value, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            self._gauges[k] = self._gauges.get(k, 0) + value
+
+    def gauge_set(self, name, value, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            self._gauges[k] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        k = _key(name, labels)
+        i = bisect.bisect_left(buckets, value)
+        with self._lock:
+            h = self._hists.get(k)
+            if h is None:
+                h = self._hists[k] = [0] * (len(buckets) + 1) + [0.0, 0]
+            h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def to_json(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            hists = {k: list(v) for k, v in self._hists.items()}
+        out = {'uptime_seconds': round(time.time() - self.started, 3),
+               'counters': [], 'gauges': [], 'histograms': []}
+        for (name, labels), v in sorted(counters.items()):
+            out['counters'].append({'name': name, 'labels': dict(labels), 'value': v})
+        for (name, labels), v in sorted(gauges.items()):
+            out['gauges'].append({'name': name, 'labels': dict(labels), 'value': v})
+        for (name, labels), h in sorted(hists.items()):
+            out['histograms'].append({
+                'name': name,
+                'labels': dict(labels),
+                'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], h[:-2])),
+                'sum': round(h[-2], 6),
+                'count': h[-1],
+            })
+        return out
+
+    def to_prometheus(self):
+        """Prometheus 文本格式 0.0.4（直方图桶为累计计数）"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            hists = {k: list(v) for k, v in self._hists.items()}
+        lines = []
+        seen = set()
+
+        def header(name):
+            if name in seen:
+                return
+            seen.add(name)
+            kind, doc = _HELP.get(name, ('untyped', ''))
+            if doc:
+                lines.append(f"# HELP {name} {doc}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+        for (name, labels), v in sorted(counters.items()):
+            header(name)
+            lines.append(f"{name}{fmt(labels)} {v}")
+        for (name, labels), v in sorted(gauges.items()):
+            header(name)
+            lines.append(f"{name}{fmt(labels)} {v}")
+        for (name, labels), h in sorted(hists.items()):
+            header(name)
+            acc = 0
+            for bound, n in zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], h[:-2]):
+                acc += n
+                lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {acc}")
+            lines.append(f"{name}_sum{fmt(labels)} {h[-2]}")
+            lines.append(f"{name}_count{fmt(labels)} {h[-1]}")
+        lines.append(f"relay_uptime_seconds {round(time.time() - self.started, 3)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(v):
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = Registry()
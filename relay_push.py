@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""薄中继的推送复制：把会话文件新追加的字节主动 POST 给订阅的收集端，取代收集端轮询。
+
+订阅：收集端（或主控机代它）POST /push/subscribe {url, codex?, from?} 到本机中继（只认本机与
+CLAUDE_RELAY_PUSH_ALLOW 列出的地址，见 session_api_server），
+订阅表存 ~/.claude/relay_subscribers.json（与 claim_registry.json 同一套「临时文件 + os.replace」），
+中继重启后照表恢复。from=now（默认）从当前大小开始推，from=start 先把已有内容按批补齐。
+
+每个订阅者一个推送线程，挂在 relay_index 的变化订阅上：
+  - 有变化先等 PUSH_LINGER_SECONDS 攒一批，再按「最早变脏的文件优先」装批，一批不超过 PUSH_BATCH_MAX_BYTES，
+    装不下的部分留给紧接着的下一批；
+  - 批的格式与 /raw/batch 相同：首行 {relay, hostname, machine_id, seq, frames}，每个文件一帧
+    {key, offset, length, size, reset?} + 恰好 length 个原始字节，删除为 {key, deleted: true, length: 0}，
+    末行 {done: true}；正文过 COMPRESS_MIN_BYTES 时 gzip（Content-Encoding: gzip）；
+  - 2xx 才推进游标；失败按 PUSH_RETRY_MIN..PUSH_RETRY_MAX 指数退避（带抖动）重试，期间的变化继续累积；
+  - 409 且回 {need: {key: offset}}：收集端手里的长度与我们记的不一致（它丢过数据/重建过），
+    游标改到它要的位置立即重推；
+  - 文件变短视为被改写，从 0 重推并带 reset=true。
+游标 = 每个文件已确认送达的字节数，每批成功后落盘到 ~/.claude/launcher_cache/push/<订阅 id>.json，
+所以中继重启、收集端宕机都只会重推未确认的部分；帧里带 offset，收集端按 offset 去重即可幂等。
+订阅队列溢出、或每隔 PUSH_RECONCILE_SECONDS，整表对一遍 size 与游标，兜住漏掉的事件。
+本地测试用的收集端见 push_collector.py。纯标准库。
+"""
+import os
+import gzip
+import json
+import time
+import random
+import hashlib
+import tempfile
+import threading
+import http.client
+from pathlib import Path
+from urllib.parse import urlparse
+
+from relay_metrics import REGISTRY
+
+SUBSCRIBERS_PATH = Path.home() / ".claude" / "relay_subscribers.json"
+CURSOR_DIR = Path.home() / ".claude" / "launcher_cache" / "push"
+PUSH_BATCH_MAX_BYTES = 4 * 1024 * 1024
+PUSH_LINGER_SECONDS = 0.2      # 第一个变化到来后再等这么久，把同一波写入攒进一批
+PUSH_RETRY_MIN = 1.0
+PUSH_RETRY_MAX = 60.0
+PUSH_TIMEOUT = 30
+PUSH_RECONCILE_SECONDS = 300
+COMPRESS_MIN_BYTES = 1024
+CODEX_KEY_PREFIX = 'codex/'
+
+_lock = threading.Lock()           # 只护 _pushers 的增删查，持有时间极短（status() 也要拿）
+_config_lock = threading.Lock()    # 串行化 subscribe/unsubscribe：等旧线程退出可能要几十秒，不能占着 _lock
+_pushers = {}        # 订阅 id -> _Pusher
+_context = None      # (index, resolve, identity)，start() 时设定
+
+
+def _sub_id(url):
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=6).hexdigest()
+
+
+def _write_json(path, obj):
+    """临时文件 + os.replace 写 JSON；失败静默返回 False"""
+    tmp = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        return True
+    except Exception:
+        try:
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+        except Exception:
+            pass
+        return False
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def load_subscribers():
+    """订阅表：[{url, codex}]"""
+    data = _read_json(SUBSCRIBERS_PATH) or {}
+    subs = data.get("subscribers")
+    return [s for s in subs if isinstance(s, dict) and s.get("url")] if isinstance(subs, list) else []
+
+
+def _save_subscribers(subs):
+    return _write_json(SUBSCRIBERS_PATH, {"version": 1, "subscribers": subs})
+
+
+class _Pusher(threading.Thread):
+    """一个订阅者的推送线程"""
+
+    def __init__(self, index, resolve, identity, url, codex, offsets, predecessor=None):
+        super().__init__(name=f"relay-push-{_sub_id(url)}", daemon=True)
+        self.index = index
+        self.resolve = resolve
+        self.identity = identity
+        self.url = url
+        self.codex = codex
+        self.id = _sub_id(url)
+        self.offsets = offsets          # key -> 已确认送达的字节数
+        self.predecessor = predecessor  # 同一订阅的旧线程：它退出后才接手游标
+        self.dirty = {}                 # key -> 首次变脏的 monotonic 时间
+        self.seq = 0
+        self.conn = None
+        self.stopping = threading.Event()
+        self.stats = {"batches": 0, "bytes": 0, "errors": 0, "last_ok": None, "last_error": None,
+                      "retry_in": 0}
+
+    # ---------- 游标 ----------
+
+    def _cursor_path(self):
+        return CURSOR_DIR / f"{self.id}.json"
+
+    def save_cursor(self):
+        if self.stopping.is_set():
+            return  # 已被停掉：游标归接手的新线程（或随退订删除），不再写
+        _write_json(self._cursor_path(), {"version": 1, "url": self.url, "offsets": self.offsets})
+
+    def _visible(self, key):
+        return self.codex or not key.startswith(CODEX_KEY_PREFIX)
+
+    def _reconcile(self):
+        """整表对账：size 与游标不一致的、游标里有但文件已没了的，都标脏"""
+        now = time.monotonic()
+        files = self.index.snapshot_keys()
+        for key, (size, _mtime) in files.items():
+            if self._visible(key) and self.offsets.get(key, 0) != size:
+                self.dirty.setdefault(key, now)
+        for key in self.offsets:
+            if key not in files:
+                self.dirty.setdefault(key, now)
+
+    def _on_event(self, ev):
+        if ev[0] == 'resync':
+            self._reconcile()
+        elif self._visible(ev[1]):
+            self.dirty.setdefault(ev[1], time.monotonic())
+
+    # ---------- 装批 / 发送 ----------
+
+    def _build(self):
+        """按变脏先后装一批，返回 (正文片段列表, {key: 送达后的新游标或 None(删除)}, 帧数)"""
+        budget = PUSH_BATCH_MAX_BYTES
+        parts, moved, frames = [], {}, 0
+        for key in sorted(self.dirty, key=self.dirty.get):
+            if budget <= 0:
+                break
+            fp = self.resolve(key) if self.index.get(key) is not None else None
+            off = self.offsets.get(key, 0)
+            if fp is None:
+                if key in self.offsets:
+                    parts.append(json.dumps({'key': key, 'deleted': True, 'length': 0}).encode('utf-8') + b'\n')
+                    frames += 1
+                moved[key] = None
+                continue
+            try:
+                with open(fp, 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    head = {'key': key, 'offset': off, 'size': size}
+                    if size < off:
+                        off = head['offset'] = 0
+                        head['reset'] = True
+                    length = min(size - off, budget)
+                    f.seek(off)
+                    data = f.read(length) if length > 0 else b''
+            except OSError:
+                continue
+            if not data and not head.get('reset'):
+                moved[key] = off
+                continue
+            head['length'] = len(data)
+            parts.append(json.dumps(head, ensure_ascii=False).encode('utf-8') + b'\n')
+            parts.append(data)
+            frames += 1
+            budget -= len(data)
+            moved[key] = off + len(data)
+        return parts, moved, frames
+
+    def _post(self, body, compressed):
+        u = urlparse(self.url)
+        if self.conn is None:
+            cls = http.client.HTTPSConnection if u.scheme == 'https' else http.client.HTTPConnection
+            self.conn = cls(u.hostname, u.port, timeout=PUSH_TIMEOUT)
+        headers = {'Content-Type': 'application/x-ndjson', 'Content-Length': str(len(body))}
+        if compressed:
+            headers['Content-Encoding'] = 'gzip'
+        try:
+            target = (u.path or '/') + (f'?{u.query}' if u.query else '')
+            self.conn.request('POST', target, body=body, headers=headers)
+            resp = self.conn.getresponse()
+            return resp.status, resp.read()
+        except Exception:
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def _push_once(self):
+        """发一批；返回 True 成功、False 要退避重试、None 没有可发的（剩下的脏文件暂时读不到新字节）"""
+        parts, moved, frames = self._build()
+        if not frames:
+            for key, off in moved.items():
+                self._settle(key, off)
+            return None
+        self.seq += 1
+        meta = {'relay': 'claude-session-relay', **self.identity, 'seq': self.seq, 'frames': frames}
+        body = b''.join([json.dumps(meta, ensure_ascii=False).encode('utf-8') + b'\n', *parts,
+                         b'{"done": true}\n'])
+        raw_len = len(body)
+        compressed = raw_len >= COMPRESS_MIN_BYTES
+        if compressed:
+            body = gzip.compress(body, 5)
+        try:
+            status, reply = self._post(body, compressed)
+        except Exception as e:
+            self.stats["last_error"] = f"{type(e).__name__}: {e}"
+            return False
+        if status == 409:
+            # 收集端的长度与游标对不上：按它要的位置重来
+            try:
+                need = json.loads(reply.decode('utf-8') or '{}').get('need') or {}
+            except ValueError:
+                need = {}
+            for key, off in need.items():
+                if isinstance(off, int) and off >= 0:
+                    self.offsets[key] = off
+                    self.dirty.setdefault(key, time.monotonic())
+            REGISTRY.inc('relay_push_batches_total', result='conflict')
+            return bool(need)
+        if not 200 <= status < 300:
+            self.stats["last_error"] = f"HTTP {status}"
+            return False
+        now = time.monotonic()
+        for key, off in moved.items():
+            first = self.dirty.get(key)
+            if self._settle(key, off) and first is not None:
+                REGISTRY.observe('relay_push_lag_seconds', now - first)
+        self.save_cursor()
+        self.stats.update(batches=self.stats["batches"] + 1, bytes=self.stats["bytes"] + len(body),
+                          last_ok=time.time(), last_error=None)
+        REGISTRY.inc('relay_push_batches_total', result='ok')
+        REGISTRY.inc('relay_push_bytes_total', len(body))
+        return True
+
+    def _settle(self, key, off):
+        """推进 key 的游标；追平当前大小（或已删除）时移出脏表并返回 True"""
+        if off is None:
+            self.offsets.pop(key, None)
+            self.dirty.pop(key, None)
+            return True
+        self.offsets[key] = off
+        st = self.index.get(key)
+        if st is None or off >= st[0]:
+            self.dirty.pop(key, None)
+            return True
+        return False
+
+    def _take_over(self):
+        """等同一订阅的旧线程退出再接手它的游标；等待中被停掉返回 False"""
+        old = self.predecessor
+        while old.is_alive():
+            if self.stopping.is_set():
+                return False
+            old.join(1.0)
+        self.offsets = dict(old.offsets)
+        self.predecessor = None
+        self.save_cursor()
+        return True
+
+    def run(self):
+        if self.predecessor is not None and not self._take_over():
+            return
+        sub = self.index.subscribe()
+        backoff = 0.0
+        last_reconcile = time.monotonic()
+        try:
+            self._reconcile()
+            while not self.stopping.is_set():
+                if not self.dirty:
+                    ev = sub.get(min(PUSH_RECONCILE_SECONDS, 5.0))
+                    if ev is not None:
+                        self._on_event(ev)
+                        if self.dirty:
+                            time.sleep(PUSH_LINGER_SECONDS)
+                while True:
+                    ev = sub.get(0)
+                    if ev is None:
+                        break
+                    self._on_event(ev)
+                if time.monotonic() - last_reconcile >= PUSH_RECONCILE_SECONDS:
+                    self._reconcile()
+                    last_reconcile = time.monotonic()
+                if not self.dirty:
+                    continue
+                ok = self._push_once()
+                if ok is None:
+                    ev = sub.get(5.0)  # 不空转：等下一个变化再试
+                    if ev is not None:
+                        self._on_event(ev)
+                    continue
+                if ok:
+                    backoff = 0.0
+                    self.stats["retry_in"] = 0
+                    continue
+                self.stats["errors"] += 1
+                REGISTRY.inc('relay_push_batches_total', result='error')
+                backoff = min(PUSH_RETRY_MAX, max(PUSH_RETRY_MIN, backoff * 2))
+                delay = backoff * random.uniform(0.8, 1.2)
+                self.stats["retry_in"] = round(delay, 1)
+                self.stopping.wait(delay)
+        finally:
+            self.index.unsubscribe(sub)
+            if self.conn is not None:
+                self.conn.close()
+
+    def status(self):
+        backlog = 0
+        for key in list(self.dirty):
+            st = self.index.get(key)
+            if st is not None:
+                backlog += max(0, st[0] - self.offsets.get(key, 0))
+        return {'id': self.id, 'url': self.url, 'codex': self.codex, 'files': len(self.offsets),
+                'pending_files': len(self.dirty), 'backlog_bytes': backlog, **self.stats}
+
+
+def _spawn(url, codex, offsets, save=False, predecessor=None):
+    """起推送线程并登记；调用方持有 _lock"""
+    index, resolve, identity = _context
+    p = _Pusher(index, resolve, identity, url, codex, offsets, predecessor)
+    if save:
+        p.save_cursor()  # 线程起来之前落盘，之后游标只由推送线程自己写
+    _pushers[p.id] = p
+    p.start()
+    return p
+
+
+def start(index, resolve, identity):
+    """按订阅表起推送线程；可重复调用（只第一次生效）。
+    resolve(key) -> 文件路径或 None；identity 是批首行里自报的 {hostname, machine_id}"""
+    global _context
+    with _lock:
+        if _context is not None:
+            return
+        _context = (index, resolve, identity)
+        subs = load_subscribers()
+        if subs:
+            index.start_watcher()
+        for s in subs:
+            cur = _read_json(CURSOR_DIR / f"{_sub_id(s['url'])}.json") or {}
+            offsets = cur.get("offsets") if isinstance(cur.get("offsets"), dict) else {}
+            _spawn(s["url"], bool(s.get("codex")), offsets)
+
+
+def subscribe(url, codex=False, start_from='now'):
+    """新增或更新订阅；返回该订阅的状态。start_from='start' 从头补齐，否则从当前大小开始。
+    已有同一 url 的订阅时沿用其游标：新线程等旧线程退出后才接手，不会两个线程同写一份游标"""
+    url = url.strip()
+    if urlparse(url).scheme not in ('http', 'https'):
+        raise ValueError('url must be http(s)')
+    with _config_lock:
+        with _lock:
+            if _context is None:
+                raise RuntimeError('push replication not started')
+            index = _context[0]
+            old = _pushers.pop(_sub_id(url), None)
+        index.start_watcher()
+        if old is not None:
+            old.stopping.set()
+            offsets = old.offsets
+        elif start_from == 'start':
+            offsets = {}
+        else:
+            offsets = {k: st[0] for k, st in index.snapshot_keys().items()
+                       if codex or not k.startswith(CODEX_KEY_PREFIX)}
+        subs = [s for s in load_subscribers() if s["url"] != url]
+        subs.append({"url": url, "codex": bool(codex)})
+        _save_subscribers(subs)
+        with _lock:
+            p = _spawn(url, bool(codex), offsets, save=old is None, predecessor=old)
+        return p.status()
+
+
+def unsubscribe(url):
+    url = url.strip()
+    with _config_lock:
+        with _lock:
+            p = _pushers.pop(_sub_id(url), None)
+        if p is not None:
+            p.stopping.set()
+            p.join(PUSH_TIMEOUT)  # 在 _lock 之外等：status() 不受影响
+        subs = load_subscribers()
+        kept = [s for s in subs if s["url"] != url]
+        if len(kept) != len(subs):
+            _save_subscribers(kept)
+        try:
+            os.remove(CURSOR_DIR / f"{_sub_id(url)}.json")
+        except OSError:
+            pass
+    return p is not None or len(kept) != len(subs)
+
+
+def status():
+    with _lock:
+        return [p.status() for p in _pushers.values()]
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""薄中继的 asyncio 引擎（可选，`session_api_server.py --engine=asyncio` 启用）。
+
+与默认的线程池引擎对外完全一致：端点逻辑仍是 session_api_server.RelayHandler，
+这里只换掉「连接怎么接、请求怎么排队」——
+  - 连接、keep-alive 空闲等待、请求头/正文读取全在事件循环里，挂着的空闲连接不占线程；
+  - 读完一个完整请求后按端点分类，各类有独立的并发上限（asyncio.Semaphore）和独立的小
+    线程池：文件服务、token 汇总、队列写入互不挤占，一个失控的拉取循环最多占满自己那一类；
+  - 廉价端点（心跳/身份/队列查看）直接在事件循环里跑，写进内存缓冲再发出；
+    /raw/list 冷启动时要现扫目录、算指纹，不算廉价，走线程池。
+RelayHandler 通过 handle_one_request() 从内存里的请求字节解析并执行，正文经 _LoopWriter
+线程安全地写回 asyncio 流（带 drain 背压），因此流式/分块/压缩/SSE 行为与线程引擎相同。
+纯标准库。
+"""
+import io
+import socket
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# 端点分类 → 并发上限。执行这些类请求的线程池大小与上限相同。
+ENDPOINT_LIMITS = {
+    'file': 8,    # /raw/file /raw/batch /raw/fingerprint：磁盘读 + 大响应
+    'token': 2,   # /api/token_summary：CPU 重
+    'queue': 2,   # /queue/push /claims/set_registry /push/*：写本机小文件
+    'watch': 16,  # /raw/watch：SSE 长连接，一个请求占一个线程直到断开
+    'other': 4,   # /raw/list 等：冷启动时现扫目录、算指纹
+}
+# 这些端点只读内存/小文件，直接在事件循环线程里执行
+INLINE_PATHS = {
+    '/api/ping', '/ping', '/api/info', '/info', '',
+    '/queue/list', '/queue', '/claims/registry', '/push/status',
+}
+MAX_HEADER_BYTES = 64 * 1024
+_TOO_LARGE_BODY = b'{"ok": false, "error": "body too large"}'
+_TOO_LARGE = (b'HTTP/1.1 413 Payload Too Large\r\nContent-Type: application/json; charset=utf-8\r\n'
+              b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(_TOO_LARGE_BODY)) + _TOO_LARGE_BODY
+
+
+def _classify(method, path):
+    if path in ('/raw/file', '/raw/batch', '/raw/fingerprint'):
+        return 'file'
+    if path in ('/api/token_summary', '/token/summary'):
+        return 'token'
+    if path == '/raw/watch':
+        return 'watch'
+    if method == 'POST' and path in ('/queue/push', '/queue', '/claims/set_registry',
+                                     '/push/subscribe', '/push/unsubscribe'):
+        return 'queue'
+    if method in ('GET', 'OPTIONS') and path in INLINE_PATHS:
+        return 'inline'
+    return 'other'
+
+
+class _LoopWriter:
+    """给工作线程里的 RelayHandler 当 wfile：每次 write 都投递到事件循环并等 drain 完成"""
+
+    def __init__(self, loop, writer):
+        self._loop = loop
+        self._writer = writer
+
+    async def _write(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+    def write(self, data):
+        if data:
+            asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self._loop).result()
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class _ServerShim:
+    """RelayHandler 只用到 server.shutdown()（/api/shutdown 与空闲看门狗）"""
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def shutdown(self):
+        self._owner.shutdown()
+
+
+class AsyncRelayServer:
+    """接口与 SessionHTTPServer 对齐：构造时 bind（端口被占抛 OSError），
+    serve_forever() 阻塞运行，shutdown() 可从任意线程调用，server_close() 收尾"""
+
+    def __init__(self, server_address, handler_class, idle_timeout=15, max_body=16 * 1024 * 1024):
+        self.handler_class = handler_class
+        self.idle_timeout = idle_timeout
+        self.max_body = max_body
+        family = socket.AF_INET6 if ':' in server_address[0] else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            # 不设 SO_REUSEADDR：与线程引擎一样靠 bind 失败保证单例
+            sock.bind(server_address)
+            sock.listen(128)
+        except OSError:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self.socket = sock
+        self.server_address = sock.getsockname()
+        self._loop = None
+        self._stop = None
+        self._limits = {}
+        self._pools = {k: ThreadPoolExecutor(n, thread_name_prefix=f'relay-{k}')
+                       for k, n in ENDPOINT_LIMITS.items()}
+        self._shim = _ServerShim(self)
+
+    def serve_forever(self):
+        asyncio.run(self._main())
+
+    def shutdown(self):
+        loop, stop = self._loop, self._stop
+        if loop is not None and stop is not None:
+            loop.call_soon_threadsafe(stop.set)
+
+    def server_close(self):
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._limits = {k: asyncio.Semaphore(n) for k, n in ENDPOINT_LIMITS.items()}
+        server = await asyncio.start_server(self._serve_conn, sock=self.socket,
+                                            limit=MAX_HEADER_BYTES)
+        async with server:
+            await self._stop.wait()
+
+    async def _serve_conn(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        client_address = (peer[0], peer[1]) if len(peer) >= 2 else ('', 0)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.idle_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError, ConnectionError):
+                    return
+                length = 0
+                for line in head.split(b'\r\n')[1:]:
+                    name, _, value = line.partition(b':')
+                    if name.strip().lower() == b'content-length':
+                        try:
+                            length = max(0, int(value.strip()))
+                        except ValueError:
+                            return
+                if length > self.max_body:
+                    # 先拒后读：不把客户端声称的正文长度整段缓冲进内存
+                    writer.write(_TOO_LARGE)
+                    await writer.drain()
+                    return
+                try:
+                    body = await asyncio.wait_for(reader.readexactly(length), self.idle_timeout) if length else b''
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                keep_alive = await self._dispatch(head, body, client_address, writer)
+                if not keep_alive:
+                    return
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    def _make_handler(self, head, body, client_address, wfile):
+        h = self.handler_class.__new__(self.handler_class)
+        h.server = self._shim
+        h.request = None
+        h.connection = None  # 没有真 socket：RelayHandler 会走分块读写而非 sendfile
+        h.client_address = client_address
+        h.rfile = io.BytesIO(head + body)
+        h.wfile = wfile
+        return h
+
+    async def _dispatch(self, head, body, client_address, writer):
+        """执行一个请求；返回连接是否可以继续复用"""
+        first = head.split(b'\r\n', 1)[0].decode('latin-1').split()
+        method = first[0].upper() if first else ''
+        target = first[1] if len(first) > 1 else '/'
+        kind = _classify(method, urlparse(target).path.rstrip('/'))
+        if kind == 'inline':
+            buf = io.BytesIO()
+            h = self._make_handler(head, body, client_address, buf)
+            h.handle_one_request()
+            writer.write(buf.getvalue())
+            await writer.drain()
+            return not h.close_connection
+        h = self._make_handler(head, body, client_address, _LoopWriter(self._loop, writer))
+        async with self._limits[kind]:
+            try:
+                await self._loop.run_in_executor(self._pools[kind], h.handle_one_request)
+            except Exception:
+                return False
+        return not h.close_connection
@@ -6,21 +6,44 @@
 只把本机 ~/.claude/projects 下的会话原始数据传出去，由 Claude Usage Monitor (Rust)
 统一解析 + rusqlite 物化。本机数据 Claude Usage Monitor 直接读文件系统、不经此中继；
 此中继只为「别的机器要读本机数据」而存在。
+Codex 的 rollout（~/.codex/sessions 与 archived_sessions，CODEX_HOME 可改）以 codex/ 前缀的 key 一并导出：
+列表/增量/指纹/Range/行号区间/过滤/压缩与 Claude 文件完全相同；列表与 watch 需带 codex=1 才列出它们，
+免得只认 Claude 格式的旧 Monitor 把 rollout 当会话解析。
 
 端点：
   GET  /api/ping           心跳
+  GET  /api/metrics        进程内指标（请求数/延迟直方图/收发字节/在途/扫描与汇总耗时）；format=prometheus 出文本格式
   GET  /api/info           本机身份（hostname/os）
-  GET  /raw/list           列出所有 .jsonl：{key, session_id, mtime, size}
-  GET  /raw/file?key=...   返回该文件的原始字节（纯文本）
+  GET  /raw/list           列出所有 .jsonl：{key, session_id, provider, mtime, size, fingerprint}；带 ETag，If-None-Match 命中回 304
+                           codex=1 连同 codex/sessions/…、codex/archived_sessions/… 一起列出
+                           （fingerprint = 首尾各 4KB + size 的 blake2b-128，见 relay_index）
+  GET  /raw/list?since=C   增量列表：只回游标 C 之后变化的文件 + 删除的 key + 新游标
+  GET  /raw/file?key=...   返回该文件的原始字节（纯文本）；支持 Range 头与 offset= 增量读(206)
+                           types=user,assistant / drop=tool_result_content / max_field=N / fields=… 只回裁剪后的
+                           JSONL（每行带原文件 _offset，X-Next-Offset 头给下次的 offset，见 relay_filter）
+                           from_line=A&to_line=B 按行号取 [A, B)（可为负，从尾部数），经 line_index 旁路索引直接定位
+  GET  /raw/fingerprint?key=...&upto=L  该文件前 L 字节的首尾指纹（与列表同算法）；full=1 另给整段前缀哈希
+                           对端据此判断缓存的前缀仍有效（追加）还是文件已被改写
+  GET  /raw/watch          SSE 变化推送 {key,size,mtime}；keys=a,b&lines=1 附带订阅文件新增的完整行
+  POST /raw/batch          一次拉多个文件 {keys:[{key, offset?}], max_bytes?, continue?}，NDJSON 帧流回
   GET  /api/token_summary?since_days=N  本机 token 用量摘要(date×provider×model)，供跨机器汇总
+                           （不限文件数；rust_compat=1 复现 Rust 版的 2000 文件上限）
+                           group=hour|session|project 细分；format=ndjson 逐行分帧返回（汇总算完才出首行，见 _token_summary_response）
+                           （同参并发请求合并为一次计算；会话文件无变化时短时复用上次结果）
+  （/raw/file 整文件、/raw/list、/api/token_summary 按 Accept-Encoding 协商 gzip/deflate，装了 zstandard 另支持 zstd）
   GET  /queue/list         查看本机待发的「预备发言」队列（按 session_id 分组）
   POST /queue/push         Claude Usage Monitor 推入一条待发草稿 {session_id, text, id?}
   POST /claims/set_registry 主控机下发 claim registry 地址 {url}（本机 hook 据此 acquire）
   GET  /claims/registry    查看本机已存的 registry 地址
+  POST /push/subscribe     推送复制：登记收集端 {url, codex?, from?: now|start}，之后新追加的字节分批 POST 过去
+  POST /push/unsubscribe   取消 {url}（这两个只认本机与 CLAUDE_RELAY_PUSH_ALLOW 列出的地址，其余 403）
+  GET  /push/status        各订阅者的游标/积压/重试状态（见 relay_push）
   POST /api/shutdown       本机优雅关闭
 
 空闲超时自动退出，不留常驻后台。
-用法：python session_api_server.py [port]   （默认 47800）
+用法：python session_api_server.py [port] [idle_timeout] [--engine=threaded|asyncio]
+  （默认 47800；引擎默认 threaded=固定 worker 池，asyncio 见 session_api_async.py；
+    也可用环境变量 CLAUDE_RELAY_ENGINE 指定）
 """
 import os
 import sys
@@ -28,24 +51,72 @@ import json
 import time
 import socket
 import threading
+import zlib
+import hashlib
+import queue
+import base64
 import platform
 from pathlib import Path
-from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse, parse_qs
 
+import relay_index
+import relay_filter
+import relay_push
+import line_index
+from relay_metrics import REGISTRY
+
+try:
+    import zstandard  # 可选：装了才多协商一个 zstd，没装只走 gzip/deflate
+except ImportError:
+    zstandard = None
+
 VERSION = "2.2.0"
 DEFAULT_PORT = 47800
 # 空闲多久没人访问就自动退出（秒）；0 = 常驻不退。
 # 设 0：本中继是「会话归档」的数据出口，别的机器随时可能来读，不该因本机没活动就退出
 # →常驻可达。单例由端口 bind 失败兜底，重启随 launcher 幂等自启，关机即没、pkill 可手动停。
 IDLE_TIMEOUT_SECONDS = 0
+# /raw/file 流式发送的块大小：无 sendfile 时每次最多读这么多进内存，峰值内存与文件大小无关
+STREAM_CHUNK = 256 * 1024
+# 小于这个字节数的响应不压缩（心跳/空增量压了反而更大、还白费 CPU）
+COMPRESS_MIN_BYTES = 1024
+# /raw/batch 单次响应的正文字节预算上限（超出的部分靠 continue 令牌续拉）
+BATCH_MAX_BYTES = 64 * 1024 * 1024
+# /raw/watch(SSE)：同时在线的订阅上限、心跳间隔、单次事件附带新增行的字节上限
+WATCH_MAX_CLIENTS = 16  # SSE 长占 worker，须远小于 WORKER_POOL_SIZE
+WATCH_HEARTBEAT_SECONDS = 15
+WATCH_MAX_APPEND_BYTES = 256 * 1024
+# 长连接空闲超时（秒）与 worker 池：连接数有上限，突发/失控客户端不会无限开线程
+KEEPALIVE_IDLE_SECONDS = 15
+WORKER_POOL_SIZE = 64
+PENDING_CONNECTIONS = 256  # 已 accept 待分配 worker 的连接上限，再多就让 accept 循环等
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# /api/token_summary 结果缓存：会话索引游标不变时最多复用这么久（游标已含 Codex 文件，TTL 兜住轮询间隙）
+TOKEN_CACHE_TTL = 10
+TOKEN_CACHE_MAX_ENTRIES = 16
+TOKEN_GROUPS = ('day', 'hour', 'session', 'project')  # 与 token_summary.GROUPS 一致
+TOKEN_NDJSON_FLUSH_BYTES = 64 * 1024  # format=ndjson 时攒够这么多行再发一块
 PROJECTS_DIR = Path.home() / ".claude" / "projects"
+CODEX_KEY_PREFIX = 'codex'
+# 允许登记/取消推送订阅的对端 IP（逗号分隔）；本机总是允许。订阅等于把会话全文持续推给对方，不能人人可设
+PUSH_ALLOW_ENV = 'CLAUDE_RELAY_PUSH_ALLOW'
+# 列表与 /raw/fingerprint 附带的指纹参数，对端据此在本地复算同一指纹
+_FINGERPRINT_INFO = {'algo': relay_index.FINGERPRINT_ALGO, 'edge_bytes': relay_index.FINGERPRINT_EDGE_BYTES}
 
 # 最近一次被访问的时刻（单调时钟），看门狗据此判断空闲
 _state = {"last": 0.0}
 
 _machine_id_cache = None
 
+_index = None
+_index_lock = threading.Lock()
+_watch_slots = threading.BoundedSemaphore(WATCH_MAX_CLIENTS)
+
+_token_lock = threading.Lock()
+_token_cache = {}    # (since_days, rust_compat, group) -> (stamp, computed_at, rep)
+_token_flights = {}  # (since_days, rust_compat, group) -> _Flight（正在算的那一次）
+
 
 def machine_id():
     """机器稳定标识：OS 原生硬件/系统 id，改名/换 IP/重装系统都不变。
@@ -82,48 +153,321 @@ def machine_id():
     except Exception:
         mid = ""
     if not mid:
-        import hashlib
         mid = "h:" + hashlib.sha1(socket.gethostname().encode("utf-8")).hexdigest()[:16]
     _machine_id_cache = mid.strip()
     return _machine_id_cache
 
 
-def _list_files():
-    """列出 ~/.claude/projects 下所有 .jsonl 的 key/session_id/mtime/size"""
-    out = []
-    if not PROJECTS_DIR.exists():
-        return out
-    for dir_name in os.listdir(PROJECTS_DIR):
-        dir_path = PROJECTS_DIR / dir_name
-        if not dir_path.is_dir():
-            continue
-        for fn in os.listdir(dir_path):
-            if not fn.endswith('.jsonl'):
-                continue
+def _codex_mounts():
+    """Codex 目录树的挂载表 [(key 前缀, 目录)]，目录位置与 token_summary 一致"""
+    import token_summary
+    return [(f"{CODEX_KEY_PREFIX}/{root.name}", root) for root in token_summary._codex_roots()]
+
+
+def _file_index():
+    """进程内唯一的会话文件索引（按当前 PROJECTS_DIR 与 Codex 目录懒建）"""
+    global _index
+    mounts = _codex_mounts()
+    with _index_lock:
+        if _index is None or _index.root != PROJECTS_DIR or _index.mounts != mounts:
+            _index = relay_index.FileIndex(PROJECTS_DIR, mounts)
+        return _index
+
+
+def _key_filter(qs):
+    """列表/watch 的可见范围：默认只有 Claude 项目文件，codex=1 时也含 codex/ 前缀的 key"""
+    if (qs.get('codex', [''])[0] or '').lower() in ('1', 'true', 'yes'):
+        return None
+    return lambda key: not key.startswith(CODEX_KEY_PREFIX + '/')
+
+
+def _list_files(codex=False):
+    """列出 ~/.claude/projects（codex=True 时再加 Codex 目录）下所有 .jsonl 的条目"""
+    idx = _file_index()
+    idx.ensure_fresh()
+    return idx.files(None if codex else _key_filter({}))
+
+
+class _Flight:
+    """一次进行中的 token 汇总计算；同参数的并发请求等它而不是各算一遍"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _token_stamp():
+    """缓存有效性的依据：会话索引游标（有文件追加/新建/删除就变）+ 日期（跨天窗口要挪）"""
+    idx = _file_index()
+    idx.ensure_fresh()
+    return idx.cursor(), time.strftime('%Y-%m-%d')
+
+
+def _token_summary(since_days, rust_compat=False, group='day'):
+    """token_summary.compute 的单飞 + 结果缓存包装。
+    同参数（since_days / rust_compat / group）的并发请求合并到一次计算；游标未变且未超 TOKEN_CACHE_TTL 时直接复用上次结果。
+    戳在计算前取：计算期间有文件变化的话，下一次请求会看到新游标而重算。"""
+    since_days = max(1, min(int(since_days or 400), 3650))
+    ck = (since_days, bool(rust_compat), group)
+    stamp = _token_stamp()
+    with _token_lock:
+        hit = _token_cache.get(ck)
+        if hit and hit[0] == stamp and time.monotonic() - hit[1] < TOKEN_CACHE_TTL:
+            REGISTRY.inc('relay_token_summary_cache_total', result='hit')
+            return hit[2]
+        flight = _token_flights.get(ck)
+        leader = flight is None
+        if leader:
+            flight = _token_flights[ck] = _Flight()
+    if not leader:
+        REGISTRY.inc('relay_token_summary_cache_total', result='coalesced')
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    REGISTRY.inc('relay_token_summary_cache_total', result='miss')
+    try:
+        import token_summary
+        t0 = time.perf_counter()
+        rep = token_summary.compute(since_days, rust_compat=bool(rust_compat), group=group)
+        REGISTRY.observe('relay_token_summary_seconds', time.perf_counter() - t0)
+        flight.result = rep
+        with _token_lock:
+            _token_cache[ck] = (stamp, time.monotonic(), rep)
+            while len(_token_cache) > TOKEN_CACHE_MAX_ENTRIES:
+                del _token_cache[min(_token_cache, key=lambda k: _token_cache[k][1])]
+        return rep
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _token_lock:
+            _token_flights.pop(ck, None)
+        flight.done.set()
+
+
+class _BodyTooLarge(ValueError):
+    """POST 正文的 Content-Length 超过 MAX_BODY_BYTES"""
+
+
+def _parse_range(header, size):
+    """解析单段 HTTP Range（bytes=a-b / bytes=a- / bytes=-n），返回闭区间 (start, end)。
+
+    不可满足（起点越过文件尾 / 空文件）返回 'unsatisfiable'；无 Range、格式不认识或
+    多段 Range 返回 None——按 RFC 7233 可忽略 Range 直接回整文件。
+    """
+    if not header:
+        return None
+    header = header.strip()
+    if not header.lower().startswith('bytes='):
+        return None
+    spec = header[6:].strip()
+    if ',' in spec or '-' not in spec:
+        return None
+    first, _, last = spec.partition('-')
+    first, last = first.strip(), last.strip()
+    try:
+        if not first:
+            # 后缀形式 bytes=-n：取最后 n 字节
+            n = int(last)
+            if n <= 0 or size == 0:
+                return 'unsatisfiable'
+            return max(0, size - n), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start < 0 or end < start:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    return start, min(end, size - 1)
+
+
+def _read_appended_lines(fp, start, size):
+    """读 fp 的 [start, size) 中完整的行（截到最后一个换行），返回 (lines, next_offset)"""
+    with open(fp, 'rb') as f:
+        f.seek(start)
+        data = f.read(size - start)
+    end = data.rfind(b'\n')
+    if end < 0:
+        return [], start
+    data = data[:end + 1]
+    lines = [ln.decode('utf-8', errors='replace') for ln in data.splitlines() if ln.strip()]
+    return lines, start + len(data)
+
+
+# 指标里的端点标签只取这些固定值（别名归一），其余一律记 other，防止标签基数失控
+_ENDPOINT_LABELS = {
+    '/api/ping': 'ping', '/ping': 'ping',
+    '/api/info': 'info', '/info': 'info', '': 'info',
+    '/api/metrics': 'metrics',
+    '/raw/list': 'raw_list', '/raw': 'raw_list',
+    '/raw/file': 'raw_file',
+    '/raw/batch': 'raw_batch',
+    '/raw/watch': 'raw_watch',
+    '/raw/fingerprint': 'raw_fingerprint',
+    '/api/token_summary': 'token_summary', '/token/summary': 'token_summary',
+    '/queue/list': 'queue', '/queue/push': 'queue', '/queue': 'queue',
+    '/claims/registry': 'claims', '/claims/set_registry': 'claims',
+    '/push/subscribe': 'push', '/push/unsubscribe': 'push', '/push/status': 'push',
+    '/api/shutdown': 'shutdown', '/shutdown': 'shutdown',
+}
+
+
+class _CountingWriter:
+    """包住 wfile 统计发出的字节数（指标 relay_bytes_out_total 用）"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        flush = getattr(self.raw, 'flush', None)
+        if flush:
+            flush()
+
+
+def _negotiate_encoding(accept):
+    """按 Accept-Encoding（含 q 值）选编码：zstd(若可用) > gzip > deflate；都不接受返回 None"""
+    if not accept:
+        return None
+    prefs = {}
+    for part in accept.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
             try:
-                st = (dir_path / fn).stat()
-            except OSError:
-                continue
-            out.append({
-                'key': f"{dir_name}/{fn}",
-                'session_id': fn[:-6],
-                'mtime': int(st.st_mtime),
-                'size': int(st.st_size),
-            })
-    return out
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            prefs[name] = q
+    supported = (['zstd'] if zstandard is not None else []) + ['gzip', 'deflate']
+    best, best_q = None, 0.0
+    for enc in supported:
+        q = prefs.get(enc, prefs.get('*', 0.0))
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+class _Compressor:
+    """流式压缩器：compress() 可反复喂块，flush() 收尾；与分块发送天然组合"""
+
+    def __init__(self, encoding):
+        if encoding == 'zstd':
+            self._obj = zstandard.ZstdCompressor(level=3).compressobj()
+        elif encoding == 'gzip':
+            self._obj = zlib.compressobj(6, zlib.DEFLATED, 31)
+        else:  # HTTP 的 deflate 指 zlib 封装格式
+            self._obj = zlib.compressobj(6, zlib.DEFLATED, 15)
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class _BodyWriter:
+    """响应正文写入器：按需压缩后写 wfile；chunked=True 时按 HTTP/1.1 分块编码输出，
+    否则（HTTP/1.0 对端）靠关连接界定结尾。"""
+
+    def __init__(self, wfile, encoding=None, sendfile=None, chunked=False):
+        self._wfile = wfile
+        self._comp = _Compressor(encoding) if encoding else None
+        self._sendfile = sendfile
+        self._chunked = chunked
+
+    def _emit(self, data):
+        if self._chunked:
+            self._wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        else:
+            self._wfile.write(data)
+
+    def copy_file(self, f, start, length):
+        """把文件区间写进正文，返回实际写出的原始字节数（文件被截短时会少于 length，
+        此时正文已不完整，调用方须断开连接）。不压缩时交给 sendfile 零拷贝
+        （chunked 下整段作为一个分块）；压缩时只能按块读进来再压。"""
+        if self._comp is None and self._sendfile is not None:
+            if self._chunked:
+                self._wfile.write(b'%x\r\n' % length)
+                sent = self._sendfile(f, start, length)
+                if sent == length:
+                    self._wfile.write(b'\r\n')
+                return sent
+            return self._sendfile(f, start, length)
+        f.seek(start)
+        done = 0
+        while done < length:
+            chunk = f.read(min(STREAM_CHUNK, length - done))
+            if not chunk:
+                break
+            self.write(chunk)
+            done += len(chunk)
+        return done
+
+    def write(self, data):
+        if self._comp is not None:
+            data = self._comp.compress(data)
+        if data:
+            self._emit(data)
+
+    def close(self):
+        if self._comp is not None:
+            tail = self._comp.flush()
+            if tail:
+                self._emit(tail)
+        if self._chunked:
+            self._wfile.write(b'0\r\n\r\n')
+
+
+def _replicator():
+    """推送复制入口：首次用到时按持久化的订阅表起推送线程（relay_push.start 只生效一次）"""
+    relay_push.start(_file_index(), _resolve_key,
+                     {'hostname': socket.gethostname(), 'machine_id': machine_id()})
+    return relay_push
+
+
+def _push_allowed(addr):
+    """推送订阅的改动只认本机，或 PUSH_ALLOW_ENV 里列出的主控机"""
+    if addr.startswith('::ffff:'):
+        addr = addr[7:]
+    if addr in ('127.0.0.1', '::1'):
+        return True
+    allow = os.environ.get(PUSH_ALLOW_ENV, '')
+    return addr in {a.strip() for a in allow.split(',') if a.strip()}
 
 
 def _resolve_key(key):
-    """把 key 安全映射回 projects 下的真实文件，防目录穿越；非法返回 None"""
+    """把 key 安全映射回 projects（或 codex/ 前缀对应的 Codex 目录）下的真实文件，防目录穿越；非法返回 None"""
     if not key or '..' in key:
         return None
     parts = key.replace('\\', '/').split('/')
-    if len(parts) != 2 or not parts[1].endswith('.jsonl'):
+    if not parts[-1].endswith('.jsonl') or not all(parts):
+        return None
+    if parts[0] == CODEX_KEY_PREFIX:
+        # codex/<sessions|archived_sessions>/<树内相对路径>
+        base = dict(_codex_mounts()).get('/'.join(parts[:2])) if len(parts) >= 3 else None
+        if base is None:
+            return None
+        fp = base.joinpath(*parts[2:])
+    elif len(parts) == 2:
+        base = PROJECTS_DIR
+        fp = PROJECTS_DIR / parts[0] / parts[1]
+    else:
         return None
-    fp = PROJECTS_DIR / parts[0] / parts[1]
     try:
         fp_resolved = fp.resolve()
-        root = PROJECTS_DIR.resolve()
+        root = base.resolve()
     except OSError:
         return None
     if root not in fp_resolved.parents:
@@ -135,24 +479,549 @@ def _resolve_key(key):
 
 class RelayHandler(BaseHTTPRequestHandler):
     server_version = "ClaudeSessionRelay/" + VERSION
+    # HTTP/1.1 长连接：Monitor 高频的 /api/ping、/raw/list 复用同一条 TCP。
+    # 因此每条响应都必须带 Content-Length，或走 chunked（见 _stream_headers）。
+    protocol_version = "HTTP/1.1"
+    # 连接空闲这么久没有下一个请求就关掉，把 worker 还给连接池
+    timeout = KEEPALIVE_IDLE_SECONDS
+    # 响应头与正文是两次小写入：开着 Nagle 时第二次要等对端（延迟确认）的 ACK，
+    # 长连接上每个请求白白多出约 40ms
+    disable_nagle_algorithm = True
+
+    def send_response(self, code, message=None):
+        self._responded = True
+        self._status = code
+        super().send_response(code, message)
+
+    def _observed(self, fn):
+        """执行一个请求并记指标：请求数(端点/方法/状态)、延迟直方图、收发字节、在途数"""
+        endpoint = _ENDPOINT_LABELS.get(urlparse(self.path).path.rstrip('/'), 'other')
+        self._status = 0
+        self._sendfile_bytes = 0
+        raw_wfile = self.wfile
+        self.wfile = _CountingWriter(raw_wfile)
+        REGISTRY.gauge_add('relay_in_flight', 1)
+        t0 = time.perf_counter()
+        try:
+            fn()
+        finally:
+            dt = time.perf_counter() - t0
+            REGISTRY.gauge_add('relay_in_flight', -1)
+            REGISTRY.inc('relay_requests_total', endpoint=endpoint, method=self.command,
+                         status=str(self._status or 0))
+            REGISTRY.observe('relay_request_seconds', dt, endpoint=endpoint)
+            REGISTRY.inc('relay_bytes_out_total', self.wfile.count + self._sendfile_bytes,
+                          endpoint=endpoint)
+            try:
+                n_in = int(self.headers.get('Content-Length', 0) or 0)
+            except ValueError:
+                n_in = 0
+            if n_in:
+                REGISTRY.inc('relay_bytes_in_total', n_in, endpoint=endpoint)
+            self.wfile = raw_wfile
 
-    def _json(self, obj, status=200):
+    def do_GET(self):
+        self._observed(self._do_get)
+
+    def do_POST(self):
+        self._observed(self._do_post)
+
+    def _json(self, obj, status=200, headers=None, compress=False):
         body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        headers = dict(headers or {})
+        if compress:
+            headers['Vary'] = 'Accept-Encoding'
+            enc = self._accepted_encoding(len(body))
+            if enc:
+                comp = _Compressor(enc)
+                body = comp.compress(body) + comp.flush()
+                headers['Content-Encoding'] = enc
         self.send_response(status)
         self.send_header('Content-Type', 'application/json; charset=utf-8')
         self.send_header('Access-Control-Allow-Origin', '*')
+        for k, v in headers.items():
+            self.send_header(k, v)
         self.send_header('Content-Length', str(len(body)))
         self.end_headers()
         self.wfile.write(body)
 
-    def _raw(self, data, status=200):
+    def _accepted_encoding(self, length):
+        """本响应该用的压缩编码；太小或对端不接受返回 None"""
+        if length < COMPRESS_MIN_BYTES:
+            return None
+        return _negotiate_encoding(self.headers.get('Accept-Encoding'))
+
+    def _stream_headers(self, status, content_type, headers=None, encoding=None):
+        """发出长度未知的流式响应头并返回 _BodyWriter。
+        HTTP/1.1 客户端用 chunked 界定正文、连接可复用；HTTP/1.0 客户端只能以关连接结束。"""
+        chunked = self.request_version == 'HTTP/1.1'
         self.send_response(status)
-        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Type', content_type)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
         self.end_headers()
+        return _BodyWriter(self.wfile, encoding, self._send_file_range, chunked)
+
+    def _read_body(self):
+        """读完 POST 正文（按 Content-Length；超过 MAX_BODY_BYTES 抛 _BodyTooLarge，长度不是整数抛 ValueError）"""
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        if length > MAX_BODY_BYTES:
+            raise _BodyTooLarge('body too large')
+        return self.rfile.read(length) if length > 0 else b''
+
+    def _raw(self, data, status=200, headers=None):
+        self._raw_headers(status, len(data), headers)
         self.wfile.write(data)
 
+    def _raw_headers(self, status, length, headers=None):
+        headers = dict(headers or {})
+        self.send_response(status)
+        self.send_header('Content-Type', headers.pop('Content-Type', 'text/plain; charset=utf-8'))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+    def _send_file_range(self, f, start, length):
+        """把 f 的 [start, start+length) 发给客户端，不整块读进内存，返回实际发出的字节数。
+
+        优先 socket.sendfile（Linux/macOS 走 os.sendfile 零拷贝；不支持的平台它自己退化为
+        分块 send）；拿不到真 socket 时按 STREAM_CHUNK 分块读写。文件在发送中途被截短时
+        提前结束——Content-Length 已发出，客户端会按短读处理，不会拿到错位数据。
+        """
+        sock = getattr(self, 'connection', None)
+        if isinstance(sock, socket.socket):
+            try:
+                sent = sock.sendfile(f, start, length)
+                self._sendfile_bytes = getattr(self, '_sendfile_bytes', 0) + sent
+                return sent
+            except (AttributeError, NotImplementedError, ValueError):
+                pass  # 非阻塞/非 SOCK_STREAM 等：走下面的缓冲回退
+        f.seek(start)
+        done = 0
+        while done < length:
+            chunk = f.read(min(STREAM_CHUNK, length - done))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            done += len(chunk)
+        return done
+
+    def _raw_file(self, fp, qs):
+        """回 /raw/file：整文件 200，或按 Range 头 / offset= 只回区间(206)。
+
+        offset=N 等价于 Range: bytes=N-，给只会拼 URL 的轮询端用：Monitor 记住上次拿到的
+        字节数，下次只拉新增部分。起点 >= 文件大小回 416 + Content-Range: bytes */size，
+        客户端比对 size 即可区分「没有新内容」(size == offset) 与「文件被改写变短」(size < offset)。
+        正文经 _send_file_range 流式发出，头部一发完首字节就上路。
+        只有整文件(200，含 offset=0)才按 Accept-Encoding 流式压缩：206 的 Content-Range
+        按 RFC 指编码后的字节，压了会让增量偏移失去意义，何况追加段通常很小。
+        带 types= / drop= / max_field= / fields= 时改走 _raw_filtered，起止取法相同：
+        有界 Range 的终点照样生效，只回整行落在区间内的那些行（X-Next-Offset 据此停在区间内）；
+        带 from_line= / to_line= 时按行号取区间（_raw_lines），可与过滤参数同用。
+        """
+        try:
+            flt = relay_filter.LineFilter.from_query(qs)
+        except ValueError as e:
+            self._json({'ok': False, 'error': str(e)}, 400)
+            return
+        with open(fp, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            from_line = (qs.get('from_line', [''])[0] or '').strip()
+            to_line = (qs.get('to_line', [''])[0] or '').strip()
+            if from_line or to_line:
+                self._raw_lines(f, fp, flt, from_line, to_line)
+                return
+            rng = _parse_range(self.headers.get('Range'), size)
+            offset = (qs.get('offset', [''])[0] or '').strip()
+            if rng is None and offset:
+                try:
+                    start = int(offset)
+                except ValueError:
+                    self._json({'ok': False, 'error': 'invalid offset'}, 400)
+                    return
+                if start < 0:
+                    self._json({'ok': False, 'error': 'invalid offset'}, 400)
+                    return
+                if start == 0 and size:
+                    rng = None  # offset=0 就是整文件：回 200，可压缩
+                else:
+                    rng = (start, size - 1) if start < size else 'unsatisfiable'
+            if rng == 'unsatisfiable':
+                self._raw(b'', 416, {
+                    'Accept-Ranges': 'bytes',
+                    'Content-Range': f'bytes */{size}',
+                })
+                return
+            if flt is not None:
+                first, end = relay_filter.line_bounds(f, *((rng[0], rng[1] + 1) if rng else (0, size)))
+                self._raw_filtered(f, flt, first, size, end)
+                return
+            if rng is None:
+                start, end, status, headers = 0, size - 1, 200, {'Accept-Ranges': 'bytes'}
+                enc = self._accepted_encoding(size)
+                if enc:
+                    headers['Vary'] = 'Accept-Encoding'
+                    out = self._stream_headers(status, 'text/plain; charset=utf-8', headers, enc)
+                    out.copy_file(f, 0, size)
+                    out.close()
+                    return
+            else:
+                start, end = rng
+                status, headers = 206, {
+                    'Accept-Ranges': 'bytes',
+                    'Content-Range': f'bytes {start}-{end}/{size}',
+                }
+            length = end - start + 1 if size else 0
+            self._raw_headers(status, length, headers)
+            if length:
+                self._send_file_range(f, start, length)
+
+    def _raw_lines(self, f, fp, flt, from_line, to_line):
+        """回 /raw/file?from_line=&to_line=：行号区间 [from_line, to_line)，语义同切片（0 起、可为负）。
+
+        行首偏移取自 line_index（旁路索引，文件长了只补扫新增部分），所以只读这一页的字节。
+        未过滤时回 206，Content-Range 就是这些行在原文件里的字节区间，照旧走 sendfile；
+        X-Line-Start / X-Line-End 是实际落到的行号，X-Line-Count 是当前完整行数。区间为空回 416。
+        """
+        try:
+            start = int(from_line) if from_line else 0
+            stop = int(to_line) if to_line else None
+        except ValueError:
+            self._json({'ok': False, 'error': 'invalid line range'}, 400)
+            return
+        idx = line_index.get(fp)
+        begin, end, first, last = idx.span(start, stop)
+        size = os.fstat(f.fileno()).st_size  # 索引可能比开头那次 fstat 看到的更新
+        headers = {'X-Line-Start': str(first), 'X-Line-End': str(last), 'X-Line-Count': str(len(idx))}
+        if begin >= end:
+            self._raw(b'', 416, {'Accept-Ranges': 'bytes', 'Content-Range': f'bytes */{size}',
+                                 'Access-Control-Expose-Headers': ', '.join(headers), **headers})
+            return
+        if flt is not None:
+            self._raw_filtered(f, flt, begin, size, end, headers)
+            return
+        headers.update({
+            'Accept-Ranges': 'bytes',
+            'Content-Range': f'bytes {begin}-{end - 1}/{size}',
+            'Access-Control-Expose-Headers': ', '.join(headers),
+        })
+        self._raw_headers(206, end - begin, headers)
+        self._send_file_range(f, begin, end - begin)
+
+    def _raw_filtered(self, f, flt, start, size, end=None, extra=None):
+        """回过滤后的 /raw/file：NDJSON 流，每个对象带原文件 _offset，只含完整行。
+
+        状态码总是 200（正文已不是原文件的字节区间，不能用 Content-Range）；原文件坐标走头部：
+        X-Offset-Start 实际起点（起点落在行中间时顺延到下一行首，方便配 Range: bytes=-N 取尾部）、
+        X-Next-Offset 处理到的位置（下次 offset= 它）、X-Source-Size 当时的文件大小。
+        end 已知（按行号取时起止都在行边界）就不再找行界；extra 是附加的响应头。
+        """
+        if end is None:
+            first, end = relay_filter.line_bounds(f, start, size)
+        else:
+            first = start
+        headers = {
+            'X-Source-Size': str(size),
+            'X-Offset-Start': str(first),
+            'X-Next-Offset': str(end),
+            **(extra or {}),
+        }
+        headers['Access-Control-Expose-Headers'] = ', '.join(headers)
+        headers['Vary'] = 'Accept-Encoding'
+        out = self._stream_headers(200, 'application/x-ndjson; charset=utf-8', headers,
+                                   self._accepted_encoding(end - first))
+        sent = 0
+        for chunk in flt.iter_range(f, first, end):
+            out.write(chunk)
+            sent += len(chunk)
+        out.close()
+        REGISTRY.inc('relay_raw_filter_bytes_total', end - first, direction='in')
+        REGISTRY.inc('relay_raw_filter_bytes_total', sent, direction='out')
+
+    def _raw_list(self, qs):
+        """回 /raw/list。带 since=游标 → 增量；否则全量 + ETag（If-None-Match 命中回 304）。
+
+        游标/ETag 语义见 relay_index：游标来自别的中继进程或已过期时增量退化为 full=true 全量，
+        对端照全量处理即可，不会漏掉删除。
+        """
+        idx = _file_index()
+        idx.ensure_fresh()
+        keep = _key_filter(qs)
+        since = (qs.get('since', [''])[0] or '').strip()
+        if since:
+            delta = idx.changes_since(since, keep)
+            self._json({'ok': True, 'hostname': socket.gethostname(), 'fingerprint': _FINGERPRINT_INFO,
+                        **delta}, compress=True)
+            return
+        etag = idx.etag() if keep else f'"{idx.cursor()}.{CODEX_KEY_PREFIX}"'  # 两种视图的 ETag 不能混用
+        inm = self.headers.get('If-None-Match') or ''
+        if etag in [t.strip() for t in inm.split(',')] or inm.strip() == '*':
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return
+        self._json({
+            'ok': True,
+            'hostname': socket.gethostname(),
+            'cursor': idx.cursor(),
+            'fingerprint': _FINGERPRINT_INFO,
+            'files': idx.files(keep),
+        }, headers={'ETag': etag}, compress=True)
+
+    def _raw_fingerprint(self, fp, key, qs):
+        """回 /raw/fingerprint：前 upto 字节（缺省整文件）的首尾指纹，full=1 再加整段前缀哈希。
+
+        upto 超过当前大小回 416 + 当前 size：文件变短了，必是被改写。
+        整段哈希要把前缀全读一遍（几十 MB 的会话约百毫秒级），只在对端确实要强校验时才算。
+        """
+        with open(fp, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            raw = (qs.get('upto', [''])[0] or '').strip()
+            try:
+                upto = int(raw) if raw else size
+            except ValueError:
+                upto = -1
+            if upto < 0:
+                self._json({'ok': False, 'error': 'invalid upto'}, 400)
+                return
+            if upto > size:
+                self._json({'ok': False, 'error': 'upto beyond end', 'size': size}, 416)
+                return
+            out = {'ok': True, 'key': key, 'size': size, 'upto': upto,
+                   'fingerprint': relay_index.fingerprint(f, upto), **_FINGERPRINT_INFO}
+            if (qs.get('full', [''])[0] or '') in ('1', 'true'):
+                h = hashlib.blake2b(digest_size=16)
+                f.seek(0)
+                left = upto
+                while left > 0:
+                    chunk = f.read(min(STREAM_CHUNK, left))
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    left -= len(chunk)
+                out['prefix_hash'] = h.hexdigest()
+        self._json(out)
+
+    def _raw_batch(self, payload):
+        """回 /raw/batch：按请求顺序把多个文件（各自可带起始 offset）流成一个 NDJSON 帧流。
+
+        每个文件一帧：先一行 JSON 头 {key, offset, length, size, eof}，紧跟恰好 length 个原始字节；
+        key 非法/不存在的帧为 {key, error, length: 0}。末行是 {done: true}，或预算用尽时
+        {done: false, continue: 令牌}——令牌记着「第几个 key、从哪个字节续」，对端原样带上同一份
+        keys 再请求即可，服务端不留状态。字节预算取 min(max_bytes, BATCH_MAX_BYTES)。
+        """
+        items = payload.get('keys')
+        if not isinstance(items, list):
+            self._json({'ok': False, 'error': 'keys must be a list'}, 400)
+            return
+        try:
+            budget = int(payload.get('max_bytes') or BATCH_MAX_BYTES)
+        except (TypeError, ValueError):
+            budget = BATCH_MAX_BYTES
+        budget = max(1, min(budget, BATCH_MAX_BYTES))
+        first, resume_at = 0, None
+        token = payload.get('continue')
+        if token:
+            try:
+                state = json.loads(base64.urlsafe_b64decode(str(token).encode('ascii')))
+                first, resume_at = int(state['i']), int(state['o'])
+            except Exception:
+                self._json({'ok': False, 'error': 'invalid continue token'}, 400)
+                return
+
+        out = self._stream_headers(200, 'application/x-ndjson; charset=utf-8',
+                                   {'Vary': 'Accept-Encoding'},
+                                   _negotiate_encoding(self.headers.get('Accept-Encoding')))
+
+        def frame(obj):
+            out.write(json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n')
+
+        for i in range(first, len(items)):
+            item = items[i]
+            if isinstance(item, str):
+                item = {'key': item}
+            key = str((item or {}).get('key') or '').strip()
+            try:
+                start = int((item or {}).get('offset') or 0)
+            except (TypeError, ValueError):
+                start = 0
+            if i == first and resume_at is not None:
+                start = resume_at
+            fp = _resolve_key(key)
+            if not fp:
+                frame({'key': key, 'error': 'invalid key', 'length': 0})
+                continue
+            try:
+                f = open(fp, 'rb')
+            except OSError as e:
+                frame({'key': key, 'error': str(e), 'length': 0})
+                continue
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                start = max(0, start)
+                length = max(0, min(size - start, budget))
+                eof = start + length >= size
+                frame({'key': key, 'offset': start, 'length': length, 'size': size, 'eof': eof})
+                if length:
+                    sent = out.copy_file(f, start, length)
+                    if sent < length:
+                        # 发送中途文件被截短：帧已对不齐，直接断流，对端按未完成重拉
+                        self.close_connection = True
+                        return
+                budget -= length
+            if not eof:
+                cont = base64.urlsafe_b64encode(
+                    json.dumps({'i': i, 'o': start + length}).encode('ascii')).decode('ascii')
+                frame({'done': False, 'continue': cont})
+                out.close()
+                return
+        frame({'done': True})
+        out.close()
+
+    def _raw_watch(self, qs):
+        """回 /raw/watch：Server-Sent Events 推送索引变化，取代对 /raw/list 的轮询。
+
+        事件：hello{cursor,mode}；change{key,size,mtime,cursor}；delete{key,cursor}；
+        resync{cursor}（本订阅队列溢出 / 续订游标失效，对端应走 /raw/list?since= 补齐）。
+        每个事件的 id 是索引游标，EventSource 断线重连时会带 Last-Event-ID，据此补发其后的变化。
+        codex=1 时 Codex 文件的变化也推（点名 keys 时以 keys 为准）。
+        keys=a,b 只推这些文件；再加 lines=1 时 change 事件附带该文件自上次以来新增的完整行
+        {offset, next_offset, lines}，超过 WATCH_MAX_APPEND_BYTES 只给 truncated=true 由对端按 offset 拉。
+        """
+        if not _watch_slots.acquire(blocking=False):
+            self._json({'ok': False, 'error': 'too many watchers'}, 503)
+            return
+        idx = _file_index()
+        idx.start_watcher()
+        sub = idx.subscribe()
+        try:
+            keys = {k.strip() for k in ','.join(qs.get('keys', [])).split(',') if k.strip()}
+            keep = None if keys else _key_filter(qs)  # 点名了 keys 就按 keys；否则默认不推 codex/ 文件
+            with_lines = bool(keys) and (qs.get('lines', [''])[0] or '').lower() in ('1', 'true', 'yes')
+            offsets = {}
+            if with_lines:
+                for k in keys:
+                    st = idx.get(k)
+                    offsets[k] = st[0] if st else 0
+            out = self._stream_headers(200, 'text/event-stream; charset=utf-8', {
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+            })
+
+            def send(event, data, eid=None):
+                head = f"id: {eid}\n" if eid else ''
+                body = json.dumps(data, ensure_ascii=False)
+                out.write(f"{head}event: {event}\ndata: {body}\n\n".encode('utf-8'))
+                _state["last"] = time.monotonic()
+
+            def on_change(key, size, mtime, cursor):
+                data = {'key': key, 'size': size, 'mtime': mtime, 'cursor': cursor}
+                if with_lines and key in offsets:
+                    start = offsets[key]
+                    if size < start:
+                        data['rewritten'] = True
+                        offsets[key] = size
+                    elif size - start > WATCH_MAX_APPEND_BYTES:
+                        data['truncated'] = True
+                        data['offset'] = start
+                    elif size > start:
+                        fp = _resolve_key(key)
+                        if fp:
+                            lines, nxt = _read_appended_lines(fp, start, size)
+                            data.update({'offset': start, 'next_offset': nxt, 'lines': lines})
+                            offsets[key] = nxt
+                send('change', data, cursor)
+
+            send('hello', {'cursor': idx.cursor(), 'mode': idx.mode})
+            since = (qs.get('since', [''])[0] or self.headers.get('Last-Event-ID') or '').strip()
+            if since:
+                delta = idx.changes_since(since, keep)
+                if delta['full']:
+                    send('resync', {'cursor': delta['cursor']}, delta['cursor'])
+                else:
+                    for e in delta['files']:
+                        if not keys or e['key'] in keys:
+                            on_change(e['key'], e['size'], e['mtime'], delta['cursor'])
+                    for k in delta['deleted']:
+                        if not keys or k in keys:
+                            send('delete', {'key': k, 'cursor': delta['cursor']}, delta['cursor'])
+            while True:
+                ev = sub.get(WATCH_HEARTBEAT_SECONDS)
+                if ev is None:
+                    out.write(b': ping\n\n')  # SSE 注释行当心跳，顺便探测对端是否已断开
+                elif ev[0] == 'resync':
+                    send('resync', {'cursor': idx.cursor()}, idx.cursor())
+                elif keys and ev[1] not in keys:
+                    continue
+                elif keep and not keep(ev[1]):
+                    continue
+                elif ev[0] == 'change':
+                    on_change(*ev[1:])
+                elif ev[0] == 'delete':
+                    send('delete', {'key': ev[1], 'cursor': ev[2]}, ev[2])
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError, socket.timeout):
+            pass
+        finally:
+            idx.unsubscribe(sub)
+            _watch_slots.release()
+
+    def _token_summary_response(self, qs):
+        """回 /api/token_summary；format=ndjson 时把同一份结果逐行分帧发出。
+
+        行并不是边算边出：任何文件都可能给任何一天/小时记账，compute() 扫完全部文件前没有哪一行是终值，
+        所以首字节仍要等整次汇总（增量索引命中时只是毫秒级）。NDJSON 省的是对端：不必等整个大 JSON
+        收完再解析，按行解析、按块（TOKEN_NDJSON_FLUSH_BYTES）渲染，大 group=session 结果也不用整段进内存。
+        """
+        try:
+            since_days = int((qs.get('since_days', ['400'])[0] or '400'))
+        except ValueError:
+            since_days = 400
+        # rust_compat=1：复现 Rust 版每 provider 2000 文件上限，供对账
+        rust_compat = qs.get('rust_compat', ['0'])[0] in ('1', 'true')
+        group = qs.get('group', ['day'])[0] or 'day'
+        if group not in TOKEN_GROUPS:
+            self._json({'ok': False, 'error': 'invalid group'}, 400)
+            return
+        # 并发的同参请求共用一次计算，短时间内重复请求直接命中缓存（见 _token_summary）
+        rep = _token_summary(since_days, rust_compat, group)
+        if qs.get('format', ['json'])[0] != 'ndjson':
+            rep = dict(rep)
+            rep['hostname'] = socket.gethostname()
+            self._json(rep, compress=True)
+            return
+        # NDJSON：首行元信息，随后一行一条，末行 {"done":true,"rows":N}，对端可边收边解析；
+        # 没收到末行即视为不完整
+        out = self._stream_headers(200, 'application/x-ndjson; charset=utf-8',
+                                   {'Vary': 'Accept-Encoding'},
+                                   _negotiate_encoding(self.headers.get('Accept-Encoding')))
+        buf = bytearray()
+
+        def line(obj):
+            buf.extend(json.dumps(obj, ensure_ascii=False).encode('utf-8'))
+            buf.extend(b'\n')
+            if len(buf) >= TOKEN_NDJSON_FLUSH_BYTES:
+                out.write(bytes(buf))
+                buf.clear()
+
+        line({'ok': True, 'hostname': socket.gethostname(), 'group': group,
+              'since_days': since_days})
+        for row in rep['days']:
+            line(row)
+        line({'done': True, 'rows': len(rep['days'])})
+        out.write(bytes(buf))
+        out.close()
+
     def log_message(self, *args):
         """静默，避免刷屏（心跳轮询很频繁）"""
         pass
@@ -164,8 +1033,20 @@ class RelayHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', '*')
         self.end_headers()
 
-    def do_POST(self):
+    def _do_post(self):
         path = urlparse(self.path).path.rstrip('/')
+        # 先把正文整段读走：长连接上哪怕 404 也得读完，否则下个请求会从正文中间开始解析；
+        # 读不了（太大/长度不对）就回 413/400 并断开，没读走的字节不能留在连接上
+        try:
+            raw = self._read_body()
+        except OSError:
+            self.close_connection = True
+            return
+        except ValueError as e:
+            self.close_connection = True
+            self._json({'ok': False, 'error': str(e) if isinstance(e, _BodyTooLarge) else 'invalid Content-Length'},
+                       413 if isinstance(e, _BodyTooLarge) else 400, headers={'Connection': 'close'})
+            return
         if path in ('/api/shutdown', '/shutdown'):
             # 仅允许本机优雅关闭
             if self.client_address[0] in ('127.0.0.1', '::1'):
@@ -174,12 +1055,22 @@ class RelayHandler(BaseHTTPRequestHandler):
             else:
                 self._json({'ok': False, 'error': 'forbidden'}, 403)
             return
+        if path == '/raw/batch':
+            _state["last"] = time.monotonic()
+            try:
+                payload = json.loads(raw.decode('utf-8') or '{}')
+            except Exception as e:
+                self._json({'ok': False, 'error': f'bad json: {e}'}, 400)
+                return
+            try:
+                self._raw_batch(payload if isinstance(payload, dict) else {})
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
         if path in ('/queue/push', '/queue'):
             # Claude Usage Monitor 把「预备发言」推到本机：写入 ~/.claude/launcher_queue.json，
             # 由本机启动器进入对话时消费。{session_id, text, id?}
             try:
-                length = int(self.headers.get('Content-Length', 0) or 0)
-                raw = self.rfile.read(length) if length else b''
                 payload = json.loads(raw.decode('utf-8') or '{}')
             except Exception as e:
                 self._json({'ok': False, 'error': f'bad json: {e}'}, 400)
@@ -198,12 +1089,34 @@ class RelayHandler(BaseHTTPRequestHandler):
                 return
             self._json({'ok': bool(ok)}, 200 if ok else 500)
             return
+        if path in ('/push/subscribe', '/push/unsubscribe'):
+            # 收集端登记/取消推送订阅 {url, codex?, from?}；订阅表与游标持久化，重启后自动恢复
+            if not _push_allowed(self.client_address[0]):
+                self._json({'ok': False, 'error': 'forbidden'}, 403)
+                return
+            try:
+                payload = json.loads(raw.decode('utf-8') or '{}')
+            except Exception as e:
+                self._json({'ok': False, 'error': f'bad json: {e}'}, 400)
+                return
+            url = str(payload.get('url') or '').strip()
+            if not url:
+                self._json({'ok': False, 'error': 'url required'}, 400)
+                return
+            try:
+                if path == '/push/unsubscribe':
+                    self._json({'ok': _replicator().unsubscribe(url)})
+                else:
+                    st = _replicator().subscribe(url, bool(payload.get('codex')),
+                                                 str(payload.get('from') or 'now'))
+                    self._json({'ok': True, 'subscriber': st})
+            except ValueError as e:
+                self._json({'ok': False, 'error': str(e)}, 400)
+            return
         if path in ('/claims/set_registry',):
             # 主控机下发它的 claim registry 地址 {url}；本机写 claim_registry.json，
             # 由本机 PreToolUse hook 据此向主控机 acquire（先来后到的跨机文件占用）。
             try:
-                length = int(self.headers.get('Content-Length', 0) or 0)
-                raw = self.rfile.read(length) if length else b''
                 payload = json.loads(raw.decode('utf-8') or '{}')
             except Exception as e:
                 self._json({'ok': False, 'error': f'bad json: {e}'}, 400)
@@ -222,13 +1135,27 @@ class RelayHandler(BaseHTTPRequestHandler):
             return
         self._json({'ok': False, 'error': 'not found'}, 404)
 
-    def do_GET(self):
+    def _do_get(self):
         _state["last"] = time.monotonic()  # 任意访问（含心跳）都续命
+        self._responded = False
         parsed = urlparse(self.path)
         path = parsed.path.rstrip('/')
         try:
             if path in ('/api/ping', '/ping'):
                 self._json({'ok': True, 'pong': True})
+            elif path == '/api/metrics':
+                qs = parse_qs(parsed.query)
+                fmt = (qs.get('format', [''])[0] or '').lower()
+                if fmt in ('prometheus', 'prom', 'text'):
+                    self._raw(REGISTRY.to_prometheus().encode('utf-8'), 200, {
+                        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+                    })
+                else:
+                    rep = REGISTRY.to_json()
+                    idx = _file_index()
+                    rep.update({'ok': True, 'engine_pid': os.getpid(),
+                                'index_mode': idx.mode, 'index_files': len(idx.snapshot_keys())})
+                    self._json(rep, compress=True)
             elif path in ('/api/info', '/info', ''):
                 self._json({
                     'ok': True,
@@ -240,31 +1167,24 @@ class RelayHandler(BaseHTTPRequestHandler):
                     'platform': sys.platform,
                 })
             elif path in ('/raw/list', '/raw'):
-                self._json({
-                    'ok': True,
-                    'hostname': socket.gethostname(),
-                    'files': _list_files(),
-                })
-            elif path == '/raw/file':
-                key = (parse_qs(parsed.query).get('key', [''])[0] or '').strip()
+                self._raw_list(parse_qs(parsed.query))
+            elif path == '/raw/watch':
+                self._raw_watch(parse_qs(parsed.query))
+            elif path in ('/raw/file', '/raw/fingerprint'):
+                qs = parse_qs(parsed.query)
+                key = (qs.get('key', [''])[0] or '').strip()
                 fp = _resolve_key(key)
                 if not fp:
                     self._json({'ok': False, 'error': 'invalid key'}, 400)
                     return
-                with open(fp, 'rb') as f:
-                    self._raw(f.read())
+                if path == '/raw/file':
+                    self._raw_file(fp, qs)
+                else:
+                    self._raw_fingerprint(fp, key, qs)
             elif path in ('/api/token_summary', '/token/summary'):
                 # 跨机器 token 汇总：本机扫 jsonl 算 token 摘要(按 date/provider/model)传出，
                 # 由对端 Claude Usage Monitor 合并。算法与其 Rust token_usage.rs 逐字段一致。
-                qs = parse_qs(parsed.query)
-                try:
-                    since_days = int((qs.get('since_days', ['400'])[0] or '400'))
-                except ValueError:
-                    since_days = 400
-                import token_summary
-                rep = token_summary.compute(since_days)
-                rep['hostname'] = socket.gethostname()
-                self._json(rep)
+                self._token_summary_response(parse_qs(parsed.query))
             elif path in ('/queue/list', '/queue'):
                 # 查看本机待发的预备发言队列（按 session_id 分组），供调试/校验
                 try:
@@ -273,6 +1193,8 @@ class RelayHandler(BaseHTTPRequestHandler):
                 except Exception:
                     q = {}
                 self._json({'ok': True, 'queue': q})
+            elif path == '/push/status':
+                self._json({'ok': True, 'subscribers': _replicator().status()})
             elif path in ('/claims/registry',):
                 # 查看本机已存的 registry 地址（调试/校验用；hook 直接读文件不经此）
                 try:
@@ -283,15 +1205,61 @@ class RelayHandler(BaseHTTPRequestHandler):
                 self._json({'ok': True, 'url': url})
             else:
                 self._json({'ok': False, 'error': 'not found'}, 404)
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            self.close_connection = True
         except Exception as e:
-            self._json({'ok': False, 'error': str(e)}, 500)
+            if self._responded:
+                # 响应头已发、正文发到一半：没法再补一个 500，只能断开让对端重试
+                self.close_connection = True
+            else:
+                self._json({'ok': False, 'error': str(e)}, 500)
 
 
-class SessionHTTPServer(ThreadingHTTPServer):
+class SessionHTTPServer(HTTPServer):
+    """固定大小 worker 池的 HTTP 服务器（取代 ThreadingHTTPServer 的一连接一线程）。
+
+    accept 循环只把连接放进有界队列，WORKER_POOL_SIZE 个常驻线程逐个服务；
+    长连接在空闲 KEEPALIVE_IDLE_SECONDS 后释放 worker。队列满时 accept 循环阻塞，
+    积压交给内核 listen backlog——失控客户端最多占满池子，不会把线程数/内存推上去。
+    """
     # 关闭端口复用：Windows 下 SO_REUSEADDR 会让多个进程都 bind 成功，
     # 关掉后第二个实例 bind 失败 → 竞态兜底（安静退出）才可靠，保证全局单例。
     allow_reuse_address = False
-    daemon_threads = True
+    request_queue_size = 128
+    pool_size = WORKER_POOL_SIZE
+
+    def __init__(self, server_address, handler_class):
+        super().__init__(server_address, handler_class)
+        self._pending = queue.Queue(PENDING_CONNECTIONS)
+        self._workers = []
+        for i in range(self.pool_size):
+            t = threading.Thread(target=self._worker, name=f'relay-worker-{i}', daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def process_request(self, request, client_address):
+        self._pending.put((request, client_address))
+
+    def _worker(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        for _ in self._workers:
+            try:
+                self._pending.put_nowait(None)
+            except queue.Full:
+                break
 
 
 def _idle_watchdog(server, timeout):
@@ -301,6 +1269,8 @@ def _idle_watchdog(server, timeout):
     check_interval = min(30, max(5, timeout // 4))
     while True:
         time.sleep(check_interval)
+        if relay_push.status():
+            _state["last"] = time.monotonic()  # 有推送订阅者时没人来轮询，但中继并不空闲
         if time.monotonic() - _state["last"] > timeout:
             print(f"空闲超过 {timeout}s，自动退出")
             threading.Thread(target=server.shutdown, daemon=True).start()
@@ -347,13 +1317,28 @@ def get_lan_ip():
     return ip
 
 
-def run(host='0.0.0.0', port=DEFAULT_PORT, idle_timeout=IDLE_TIMEOUT_SECONDS):
+def make_server(host='0.0.0.0', port=DEFAULT_PORT, engine='threaded'):
+    """按引擎名建服务器（端口被占抛 OSError）。两种引擎接口一致：
+    serve_forever() / shutdown() / server_close()"""
+    if engine == 'asyncio':
+        import session_api_async
+        return session_api_async.AsyncRelayServer((host, port), RelayHandler,
+                                                  idle_timeout=KEEPALIVE_IDLE_SECONDS,
+                                                  max_body=MAX_BODY_BYTES)
+    return SessionHTTPServer((host, port), RelayHandler)
+
+
+def run(host='0.0.0.0', port=DEFAULT_PORT, idle_timeout=IDLE_TIMEOUT_SECONDS, engine=None):
+    engine = (engine or os.environ.get('CLAUDE_RELAY_ENGINE') or 'threaded').strip().lower()
     try:
-        server = SessionHTTPServer((host, port), RelayHandler)
+        server = make_server(host, port, engine)
     except OSError:
         print(f"端口 {port} 已被占用，可能已有中继实例在运行，本次不重复启动")
         return
     _state["last"] = time.monotonic()
+    # 文件索引交给后台线程维护（inotify / 轮询），列表请求只读内存
+    _file_index().start_watcher()
+    pushing = len(_replicator().status())  # 按订阅表恢复推送复制
     if idle_timeout and idle_timeout > 0:
         threading.Thread(target=_idle_watchdog, args=(server, idle_timeout), daemon=True).start()
     advertiser = _start_mdns_advertise(port)  # mDNS 广播(便于对端零配置发现)；不支持的平台返回 None
@@ -365,6 +1350,10 @@ def run(host='0.0.0.0', port=DEFAULT_PORT, idle_timeout=IDLE_TIMEOUT_SECONDS):
     print(f"  局域网   : http://{lan}:{port}/api/info")
     print(f"            （在另一台机器的 Claude Usage Monitor「会话」里填这个地址）")
     print(f"  端点     : /api/ping /api/info /raw/list /raw/file?key= /api/token_summary /queue/push")
+    print(f"  文件索引 : 后台维护（{_file_index().mode}）")
+    print(f"  服务引擎 : {engine}")
+    if pushing:
+        print(f"  推送复制 : {pushing} 个订阅者（/push/status 查看）")
     if advertiser is not None:
         print(f"  局域网发现: 已用 Bonjour 广播 _claude-relay._tcp（对端可零配置发现本机）")
     if idle_timeout and idle_timeout > 0:
@@ -386,16 +1375,21 @@ def run(host='0.0.0.0', port=DEFAULT_PORT, idle_timeout=IDLE_TIMEOUT_SECONDS):
 
 
 if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    engine = None
+    for a in sys.argv[1:]:
+        if a.startswith('--engine='):
+            engine = a.split('=', 1)[1]
     port = DEFAULT_PORT
-    if len(sys.argv) > 1:
+    if len(args) > 0:
         try:
-            port = int(sys.argv[1])
+            port = int(args[0])
         except ValueError:
             print(f"端口参数无效，使用默认 {DEFAULT_PORT}")
     idle = IDLE_TIMEOUT_SECONDS
-    if len(sys.argv) > 2:
+    if len(args) > 1:
         try:
-            idle = int(sys.argv[2])
+            idle = int(args[1])
         except ValueError:
             pass
-    run(port=port, idle_timeout=idle)
+    run(port=port, idle_timeout=idle, engine=engine)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""token_summary 快速解析路径的回归校验：夹具语料上 _parse_*_segment 必须与原始全量扫描逐字段一致。
+
+夹具覆盖 _claude_fields_fast 的各个分支：规范长行命中定点提取，其余各种「形状不符 / 层级陷阱」
+（键序不同、content 里混进 usage/model、非法 UTF-8、message 之后的顶层对象里也有 usage、
+嵌套 dict 很多的长工具输入……）必须与整行解析结果一致。改动 token_summary 的解析路径后跑一遍。
+纯标准库。
+
+用法：python token_selfcheck.py      （一致时退出码 0，否则 1）
+"""
+import sys
+import json
+import tempfile
+from pathlib import Path
+from datetime import date
+
+import token_summary as ts
+
+
+def fixture_lines():
+    """Claude 夹具行（bytes 列表），各行用途见行尾注释"""
+    pad = "长文本 " * 400  # 撑过 FAST_PARSE_MIN_BYTES
+    tool = {"type": "tool_use", "id": "toolu_1", "name": "Task",
+            "input": {"model": "fake", "id": "x", "usage": {"input_tokens": 999999}}}
+
+    def msg(i, **kw):
+        m = {"id": f"msg_{i}", "type": "message", "role": "assistant", "model": "claude-opus-4@2025",
+             "content": [{"type": "text", "text": pad}, tool],
+             "stop_reason": "end_turn", "stop_sequence": None,
+             "usage": {"input_tokens": 10 + i, "cache_read_input_tokens": 100,
+                       "cache_creation_input_tokens": 5, "output_tokens": 20,
+                       "cache_creation": {"ephemeral_5m_input_tokens": 5}, "service_tier": "standard"}}
+        m.update(kw)
+        return m
+
+    def line(i, m, ts="2025-10-05T12:00:00.000Z", **top):
+        v = {"parentUuid": "p", "isSidechain": False, "cwd": "C:\\work", "sessionId": "s",
+             "version": "2.0.0", "message": m, "requestId": f"req_{i}", "type": "assistant",
+             "uuid": f"u{i}", "timestamp": ts}
+        v.update(top)
+        return json.dumps(v, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def multi_edit(n):
+        """MultiEdit 式的长工具输入：每个 edit 里都有嵌套 dict，content 与 usage 之间 n 个 }," 候选"""
+        edits = [{"old_string": f"旧 {k}\n" * 20, "new_string": f"新 {k}\n" * 20,
+                  "range": {"line": k, "column": 4}, "replace_all": False} for k in range(n)]
+        return [{"type": "text", "text": "改几处"},
+                {"type": "tool_use", "id": "toolu_2", "name": "MultiEdit",
+                 "input": {"file_path": "C:\\work\\a.py", "edits": edits}}]
+
+    out = [
+        line(1, msg(1)),                                                       # 规范形状
+        line(1, msg(1)),                                                       # 重复键 → 去重
+        line(2, msg(2, content=[{"type": "text", "text": '引号 \\"model\\":\\"x\\" ,"usage":{'}])),
+        line(3, msg(3), ts="2025-10-05T23:30:00-05:00"),
+        line(4, msg(4), ts="20251005"),                                        # 前缀解析不了
+        line(5, msg(5), ts="Oct 5 2025"),
+        line(6, msg(6, model="claude-sonnet-4-5@20250929 ")),
+        line(7, msg(7, usage={"input_tokens": 0, "output_tokens": 0})),        # 全零
+        line(8, msg(8, usage="n/a")),
+        line(9, {k: v for k, v in msg(9).items() if k != "usage"}),           # 只有 content 里有 usage
+        line(10, {k: v for k, v in msg(10).items() if k != "id"}),            # 无 id → 不去重
+        line(11, msg(11), requestId=None),
+        line(12, msg(12), type="user"),
+        line(13, msg(13), usage={"input_tokens": 1}),                          # 顶层也有 usage
+        line(14, msg(14, model="")),
+        line(15, dict(msg(15), container=None)),                               # usage 不是最后一个键
+    ]
+    m16 = msg(16)
+    out.append(line(16, {"content": m16.pop("content"), **m16}))            # content 排第一
+    m17 = msg(17)
+    model = m17.pop("model")
+    out.append(line(17, dict(m17, model=model)))                            # model 排在 content 之后
+    out.append(line(18, msg(18)).replace("长".encode("utf-8"), b"\xff", 1))  # content 里的非法 UTF-8
+    out.append(line(27, msg(27)) + b"\xff")                                 # 行尾的非法 UTF-8
+    out.append(json.dumps({"message": msg(19), "type": "assistant", "requestId": "r19",
+                           "timestamp": "2025-10-06T00:00:00Z"},
+                          separators=(",", ":")).encode("utf-8"))              # message 为首键、纯 ASCII
+    for i in range(20, 26):
+        out.append(line(i, msg(i), ts=f"2025-10-{i - 14:02d}T08:00:00Z"))
+    out.append(line(26, msg(26, content=[{"type": "text", "text": "短行"}])))  # 低于阈值走整行
+    out.append(line(28, msg(28), meta={"usage": {"input_tokens": 999999, "output_tokens": 1}}))
+    # ↑ message 之后的顶层对象里也有 usage：最后一个 "usage":{ 不是 message.usage
+    out.append(line(29, msg(29, content=multi_edit(3))))                    # 少量内层候选：逐个验证
+    out.append(line(30, msg(30, content=multi_edit(2000))))                 # 候选过多（约 0.9 MB）：整行解析
+    out.append(line(31, msg(31, content=multi_edit(3)),
+                    meta={"usage": {"input_tokens": 999999, "output_tokens": 1}}))
+    return out
+
+
+def selfcheck():
+    """返回 (是否一致, 命中定点提取的行数)"""
+    lines = fixture_lines()
+    fast_hits = sum(1 for raw in lines if ts._claude_fields_fast(raw) is not None)
+    codex = [json.dumps(v, separators=(",", ":")).encode("utf-8") for v in (
+        {"type": "turn_context", "payload": {"model": "gpt-5-codex"}},
+        {"type": "event_msg", "timestamp": "2025-10-05T01:00:00Z", "payload": {
+            "type": "token_count", "info": {"last_token_usage": {
+                "input_tokens": 100, "cached_input_tokens": 400, "output_tokens": 7}}}},
+        {"type": "event_msg", "timestamp": "20251005", "payload": {
+            "type": "token_count", "info": {"model": "o3", "last_token_usage": {"input_tokens": 5}}}},
+        {"type": "event_msg", "timestamp": "2025-10-06T01:00:00+08:00", "payload": {
+            "type": "token_count", "info": {"last_token_usage": {"input_tokens": 3}}}},
+    )]
+    lo, hi = date(1970, 1, 2), date(9999, 12, 30)
+    with tempfile.TemporaryDirectory() as d:
+        cfp, xfp = Path(d) / "c.jsonl", Path(d) / "x.jsonl"
+        cfp.write_bytes(b"\n".join(lines) + b"\n")
+        xfp.write_bytes(b"\n".join(codex) + b"\n")
+
+        ref_c, ref_x = {}, {}
+        ts._scan_claude_file(cfp, lo, hi, set(), ref_c)
+        ts._scan_codex_file(xfp, lo, hi, ref_x)
+
+        got_c, got_x, seen = {}, {}, set()
+        for key, hk, model, tot in ts._parse_claude_segment(cfp, 0)[1]:
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            ts._acc(got_c, hk[:10], model, tot)
+        for hk, models in ts._parse_codex_segment(xfp, 0, None)[3].items():
+            for model, tot in models.items():
+                ts._acc(got_x, hk[:10], model, tot)
+
+    def lists(days):
+        return {d: {m: [t["input"], t["cache_read"], t["cache_create"], t["output"]]
+                    for m, t in ms.items()} for d, ms in days.items()}
+
+    return lists(ref_c) == got_c and lists(ref_x) == got_x, fast_hits
+
+
+if __name__ == "__main__":
+    ok, hits = selfcheck()
+    print(f"快速解析路径 vs 原始扫描：{'一致' if ok else '不一致'}（定点提取命中 {hits} 行）")
+    sys.exit(0 if ok else 1)
@@ -10,14 +10,81 @@
   day 取 timestamp 前 10 字符(或 rfc3339→UTC date)。
 - Codex: turn_context 记 current_model；event_msg+payload.type==token_count 取 info.last_token_usage；
   cache_read = max(cached_input_tokens, cache_read_input_tokens) 再 min(input)。
-- 文件: 扫 mtime >= (since - 1day) 的 .jsonl，按 mtime 倒序取前 2000；Codex 去重文件名。
+- 文件: 扫 mtime >= (since - 1day) 的 .jsonl；Codex 去重文件名。
+  Rust 版按 mtime 倒序只取前 2000 个，重度用户几个月就超，窗口被悄悄截短、用量偏低；
+  这里默认不设上限（增量索引让文件数不再决定耗时），rust_compat=True 时才复现截断，供两边对账。
+
+增量索引（compute 默认走这条路，incremental=False 退回上面的逐文件全量扫描，供对照）：
+每个文件一条检查点 {id, size, mtime, offset(已解析到的完整行末尾), head(文件头哈希),
+agg(全历史 小时×model 聚合，键 YYYY-MM-DDTHH), dups(被别的文件先认领而跳过的行)}，
+存 ~/.claude/launcher_cache/token_index/files.json，进程内常驻一份。再次计算时：
+  - size/mtime 没变 → 零解析；
+  - 只追加（size >= offset 且文件头哈希不变）→ 只解析 offset 之后新增的完整行；
+  - 变短或文件头变了（被改写/压缩）→ 释放它认领的键，从 0 重扫。
+跨文件去重：同一 message.id:requestId 只由第一个遇到它的文件认领计入 agg；其余文件把这行记进
+dups。合并时按本次选中的文件求和，若某键的认领者不在本次选中集合里（被 mtime 下限或数量上限
+筛掉），由第一个选中的持有者通过 dups 补计——结果与「只在选中文件里按顺序去重」一致
+（同一去重键对应同一条 API 响应，各副本的 usage/model/timestamp 相同，归给谁不影响合计）。
+
+去重键的认领表不放 Python 字符串集合，而是 _DedupeStore：键取 blake2b 的 64 位哈希，
+按 day 分区，每个分区是按哈希排序的 array('Q') + 并列的认领者文件 id array('I')，
+存 token_index/dedupe/<day>.bin。只在解析到/合并到某天时才载入那一天的分区，
+最多常驻 MAX_LOADED_PARTITIONS 个，按 LRU 换出（有改动的先写盘）；新认领攒够一批就并进有序数组
+——冷建索引时内存也随「正在活跃的天数」而不是全部历史增长。
+分区文件头带代数，files.json 记着每个分区应有的代数；两者对不上（写盘中途崩溃）就整库重建。
+代数是每次写盘新取的 64 位随机数而不是递增计数：中继和命令行可能同时对着同一个索引目录算，
+递增计数会让两边写出「代数相同、内容（文件 id 空间）不同」的分区，校验就失效了。
+
+冷扫描（首次建索引 / 大批文件被改写）时，待解析文件按扫描顺序分片交给进程池：
+worker 只跑纯函数 _parse_*_segment，返回各文件的部分聚合与候选去重键（64 位哈希），
+认领仍由主进程按原扫描顺序逐文件应用，因此全局去重与单进程结果完全一致。
 """
 import os
+import re
 import json
+import time
+import array
+import bisect
+import struct
+import hashlib
+import tempfile
+import threading
+from json.decoder import JSONObject as _JSONObject
 from pathlib import Path
 from datetime import datetime, date, timedelta, timezone
 
-MAX_FILES_PER_PROVIDER = 2000
+MAX_FILES_PER_PROVIDER = 2000  # 仅 rust_compat 模式：复现 Rust 版每个 provider 的文件数上限
+
+INDEX_DIR = Path.home() / ".claude" / "launcher_cache" / "token_index"
+INDEX_VERSION = 3
+MAX_LOADED_PARTITIONS = 64  # 同时载入内存的去重分区上限（有未落盘改动的换出前先写盘）
+# 分区里未归并的新认领（dict）达到 max(此值, 已归并条数/8) 就并进有序数组：冷建索引时内存不按 dict 涨
+PENDING_COMPACT_MIN = 4096
+HEAD_BYTES = 4096          # 文件头哈希覆盖的字节数，用来识别「被改写」而非追加
+INDEX_SAVE_INTERVAL = 10   # 秒：中继里频繁计算时，索引最多这么久落盘一次
+# 进程池扫描：待解析文件数达到此值才起进程池（进程启动 + 结果回传有固定开销，热路径通常只有几个追加文件）
+PARALLEL_MIN_FILES = 64
+# Codex 按 YYYY/MM/DD 分片存 rollout（目录日期=会话开始的本地日期）。增量路径上整棵子树的最晚日期
+# 早于扫描下限再减这么多天才剪掉：留余量给时区差和隔几天 resume 续写的旧 rollout；更久以后才 resume
+# 的靠检查点找回（见 _recent_jsonl 的 known）；冷索引和每 CODEX_FULL_WALK_INTERVAL 秒一次整棵遍历不剪，
+# 把窗口外又被续写、还没有检查点的旧 rollout 也捡回来
+CODEX_SHARD_GRACE_DAYS = 7
+CODEX_FULL_WALK_INTERVAL = 24 * 3600
+# 被剪子树里的 Codex 检查点 mtime 早于「本次窗口」与「最近这么多天」中更早的那个才淘汰：
+# 不随 compute 的默认窗口 400 天之内的小窗口调用来回淘汰、重解析
+CODEX_CHECKPOINT_KEEP_DAYS = 400
+# 不低于此长度的 Claude assistant 行走定点提取（跳过 message.content）；短行整行 json.loads 反而更快
+FAST_PARSE_MIN_BYTES = 1024
+DAY_CACHE_MAX = 4096
+GROUPS = ("day", "hour", "session", "project")
+SCAN_WORKERS_ENV = "CLAUDE_TOKEN_SCAN_WORKERS"  # 覆盖进程数；1 = 强制单进程
+
+_index = None              # 进程内常驻的索引 {"files": {path: entry}, "next_id": int, "dedupe": _DedupeStore,
+                           #                  "codex_walked": 上次整棵遍历 Codex 目录的时间戳}
+_index_stamp = None        # 载入时 files.json 的 mtime_ns，别的进程写过就重新载入
+_index_dirty = False
+_index_saved_at = 0.0
+_index_lock = threading.Lock()
 
 
 def _claude_roots():
@@ -48,12 +115,46 @@ def _scan_floor_ts(since):
     return datetime(floor.year, floor.month, floor.day, tzinfo=timezone.utc).timestamp()
 
 
-def _recent_jsonl(root, since):
+def _shard_last_day(parts):
+    """YYYY / YYYY/MM / YYYY/MM/DD 分片目录 → 子树可能含有的最晚日期；不像分片则 None"""
+    if not 1 <= len(parts) <= 3:
+        return None
+    if [len(p) for p in parts] != [4, 2, 2][:len(parts)] or not all(p.isdigit() for p in parts):
+        return None
+    try:
+        y = int(parts[0])
+        if len(parts) == 1:
+            return date(y, 12, 31)
+        m = int(parts[1])
+        if len(parts) == 2:
+            return (date(y, m, 1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return date(y, m, int(parts[2]))
+    except ValueError:
+        return None
+
+
+def _shard_before(parts, cutoff):
+    last = _shard_last_day(parts)
+    return last is not None and last < cutoff
+
+
+def _recent_jsonl(root, since, existing=None, shards=False, limit=None, known=()):
+    """root 下 mtime >= 扫描下限的 .jsonl，按 mtime 倒序；limit 不为 None 时只取前 limit 个。
+    existing 为集合时顺手记下遍历到的全部文件路径（增量索引清理检查点时，这些路径免去逐个 exists 检查）。
+    shards=True（Codex）时整棵剪掉日期早于下限的 YYYY/MM/DD 子树，不再逐个 stat 多年的旧 rollout；
+    目录名不像分片的（archived_sessions 平铺、旧版布局）照常全走。
+    known 是已有检查点的路径：落在被剪子树里的逐个 stat，mtime 仍在窗口内（旧 rollout 被 resume 续写）
+    就照常返回并记进 existing；窗口外的不记，由调用方把检查点淘汰掉"""
     floor = _scan_floor_ts(since)
     out = []
     if not root.exists():
         return out
-    for dirpath, _dirs, files in os.walk(root):
+    cutoff = since - timedelta(days=1 + CODEX_SHARD_GRACE_DAYS) if shards else None
+    walked = set()
+    for dirpath, dirs, files in os.walk(root):
+        if cutoff is not None:
+            rel = Path(dirpath).relative_to(root).parts
+            dirs[:] = [d for d in dirs if not _shard_before(rel + (d,), cutoff)]
         for fn in files:
             if not fn.endswith(".jsonl"):
                 continue
@@ -62,10 +163,27 @@ def _recent_jsonl(root, since):
                 st = fp.stat()
             except OSError:
                 continue
+            walked.add(str(fp))
             if st.st_mtime >= floor:
                 out.append((fp, int(st.st_mtime)))
+    if cutoff is not None:
+        prefix = str(root) + os.sep
+        for path in known:
+            if path in walked or not path.startswith(prefix):
+                continue
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if mtime >= floor:
+                walked.add(path)
+                out.append((Path(path), int(mtime)))
+    if existing is not None:
+        existing.update(walked)
     out.sort(key=lambda x: (-x[1], str(x[0])))
-    return [fp for fp, _ in out[:MAX_FILES_PER_PROVIDER]]
+    if limit is not None:
+        out = out[:limit]
+    return [fp for fp, _ in out]
 
 
 def _parse_day(ts):
@@ -202,28 +320,790 @@ def _scan_codex_file(fp, since, until, days):
         pass
 
 
-def compute(since_days=400):
+# ---------- 增量索引 ----------
+
+def _key_hash(key):
+    """去重键 message.id:requestId → 64 位无符号整数"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class _IndexCorrupt(Exception):
+    pass
+
+
+_PART_HEADER = struct.Struct("<4sQQ")  # magic, 代数, 条数
+_PART_MAGIC = b"TKD1"
+
+
+class _Partition:
+    """一天的认领表：按哈希排序的 hashes + 并列 owners，外加尚未归并的 pending"""
+
+    def __init__(self, hashes=None, owners=None):
+        self.hashes = hashes if hashes is not None else array.array("Q")
+        self.owners = owners if owners is not None else array.array("I")
+        self.pending = {}
+        self.dirty = False
+
+    def owner(self, h):
+        o = self.pending.get(h)
+        if o is not None:
+            return o
+        i = bisect.bisect_left(self.hashes, h)
+        if i < len(self.hashes) and self.hashes[i] == h:
+            return self.owners[i]
+        return None
+
+    def claim(self, h, owner):
+        self.pending[h] = owner
+        self.dirty = True
+        if len(self.pending) >= max(PENDING_COMPACT_MIN, len(self.hashes) >> 3):
+            self.compact()
+
+    def release(self, owner):
+        keep = [i for i, o in enumerate(self.owners) if o != owner]
+        if len(keep) != len(self.owners):
+            self.hashes = array.array("Q", (self.hashes[i] for i in keep))
+            self.owners = array.array("I", (self.owners[i] for i in keep))
+            self.dirty = True
+        before = len(self.pending)
+        self.pending = {h: o for h, o in self.pending.items() if o != owner}
+        if len(self.pending) != before:
+            self.dirty = True
+
+    def compact(self):
+        """把 pending 归并进有序数组：按插入点分段拷贝已有数组，不为整个分区建 Python 元组"""
+        if not self.pending:
+            return
+        hashes, owners = array.array("Q"), array.array("I")
+        prev = 0
+        for h, o in sorted(self.pending.items()):
+            i = bisect.bisect_left(self.hashes, h, prev)
+            hashes.extend(self.hashes[prev:i])
+            owners.extend(self.owners[prev:i])
+            hashes.append(h)
+            owners.append(o)
+            prev = i
+        hashes.extend(self.hashes[prev:])
+        owners.extend(self.owners[prev:])
+        self.hashes, self.owners = hashes, owners
+        self.pending = {}
+
+
+def _new_gen(old):
+    """分区的新代数：随机 64 位，与旧值不同（见模块说明）"""
+    while True:
+        gen = int.from_bytes(os.urandom(8), "little")
+        if gen != old:
+            return gen
+
+
+class _DedupeStore:
+    """按 day 分区、懒加载的去重认领表（见模块说明）"""
+
+    def __init__(self, root, gens):
+        self.root = Path(root)
+        self.gens = dict(gens)     # day -> 磁盘上该分区应有的代数（来自 files.json）
+        self.parts = {}            # day -> _Partition（dict 保持插入序，兼做 LRU）
+
+    def _path(self, day):
+        return self.root / f"{day}.bin"
+
+    def _part(self, day):
+        part = self.parts.pop(day, None)
+        if part is None:
+            part = self._load(day)
+            self._evict()
+        self.parts[day] = part  # 移到末尾 = 最近使用
+        return part
+
+    def _load(self, day):
+        gen = self.gens.get(day)
+        if gen is None:
+            return _Partition()
+        try:
+            with open(self._path(day), "rb") as f:
+                magic, file_gen, n = _PART_HEADER.unpack(f.read(_PART_HEADER.size))
+                if magic != _PART_MAGIC or file_gen != gen:
+                    raise _IndexCorrupt(day)
+                hashes = array.array("Q")
+                hashes.fromfile(f, n)
+                owners = array.array("I")
+                owners.fromfile(f, n)
+        except (OSError, EOFError, struct.error) as e:
+            raise _IndexCorrupt(day) from e
+        return _Partition(hashes, owners)
+
+    def _evict(self):
+        """按 LRU 换出到 MAX_LOADED_PARTITIONS 以下；有改动的先写盘（代数随之更新，
+        files.json 下次落盘时记下；在那之前崩溃则代数对不上，整库重建）"""
+        while len(self.parts) >= MAX_LOADED_PARTITIONS:
+            day = next(iter(self.parts))
+            part = self.parts.pop(day)
+            if part.dirty:
+                try:
+                    self.root.mkdir(parents=True, exist_ok=True)
+                    self._write(day, part)
+                except OSError:
+                    self.parts[day] = part  # 写不了就先留在内存里，save 时再试
+                    return
+
+    def owner(self, day, h):
+        return self._part(day).owner(h)
+
+    def claim(self, day, h, owner):
+        self._part(day).claim(h, owner)
+
+    def release(self, day, owner):
+        self._part(day).release(owner)
+
+    def _write(self, day, part):
+        """把一个分区原子替换写盘，换上新代数"""
+        part.compact()
+        gen = _new_gen(self.gens.get(day))
+        fd, tmp = tempfile.mkstemp(dir=str(self.root), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_PART_HEADER.pack(_PART_MAGIC, gen, len(part.hashes)))
+                part.hashes.tofile(f)
+                part.owners.tofile(f)
+            os.replace(tmp, self._path(day))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.gens[day] = gen
+        part.dirty = False
+
+    def save(self):
+        """写出有改动的分区（各自原子替换），返回更新后的 day->代数 供 files.json 记录"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        for day, part in self.parts.items():
+            if part.dirty:
+                self._write(day, part)
+        return dict(self.gens)
+
+def _head_hash(f, n):
+    """文件前 n 字节的短哈希（n=0 时为空串）"""
+    if n <= 0:
+        return ""
+    f.seek(0)
+    return hashlib.blake2b(f.read(n), digest_size=8).hexdigest()
+
+
+_day_cache = {}   # timestamp 前 10 字符 -> _parse_day 的结果（已转成 str）或 _NO_DAY
+_NO_DAY = object()
+
+
+def _hour_key(ts):
+    """'YYYY-MM-DDTHH'：日期与 _parse_day 同口径（能按前 10 字符解析就用字面日期，否则换算 UTC），
+    小时取同一表示里的小时，保证按小时汇总再折回按天与按天直接汇总一致；取不到小时记 00"""
+    day = _day_str(ts)
+    if not day:
+        return None
+    if ts[:10] == day:
+        hh = ts[11:13]
+        return f"{day}T{hh}" if len(hh) == 2 and hh.isdigit() and ts[10] in "T " else f"{day}T00"
+    try:
+        hh = datetime.fromisoformat(ts.replace("Z", "+00:00")).astimezone(timezone.utc).hour
+    except Exception:
+        hh = 0
+    return f"{day}T{hh:02d}"
+
+
+def _day_str(ts):
+    """str(_parse_day(ts)) 的快速版（失败返回 None）：前 10 个字符能确定结果的按它缓存，
+    同一天的成千上万行只 strptime 一次；前缀解析不了的照旧走 fromisoformat 且不缓存"""
+    if not ts or not isinstance(ts, str):
+        return None
+    if len(ts) >= 10:
+        head = ts[:10]
+        day = _day_cache.get(head)
+        if day is None:
+            try:
+                day = str(datetime.strptime(head, "%Y-%m-%d").date())
+            except ValueError:
+                day = _NO_DAY
+            if len(_day_cache) >= DAY_CACHE_MAX:
+                _day_cache.clear()
+            _day_cache[head] = day
+        if day is not _NO_DAY:
+            return day
+    day = _parse_day(ts)
+    return str(day) if day else None
+
+
+_MSG_OPEN = b'"message":{'
+_CONTENT_KEY = b',"content":'
+_USAGE_OPEN = b'"usage":{'
+_decoder = json.JSONDecoder()
+_TOP_CLOSE = re.compile(rb'\}\s*,\s*"')
+_TOP_CLOSE_MAX = 4  # content 与 usage 之间的候选超过这么多（嵌套 dict 很多的工具输入）就直接整行解析
+
+
+def _closes_top_value(raw, start, end):
+    """raw[start:end] 里是否有顶层值对象的收尾：从某个 }, 之后的键起按对象成员解析，
+    能一直解析到行尾，说明那个 } 所在层级就是顶层（message 在这里已经闭合）。
+    Claude Code 的规范行在 content 与 usage 之间通常连候选都没有；候选多于 _TOP_CLOSE_MAX 时
+    不逐个验证，按「可能闭合」返回 True 让调用方整行解析，免得长行上每个候选都重解析一遍行尾。
+    整行按 latin-1 解码一次：字节与字符一一对应，候选的字节位置直接可用；结构字符都是 ASCII，
+    多字节 UTF-8 落成 U+0080..U+00FF 仍是合法的字符串内容，解析成败与按 UTF-8 解码相同。
+    候选处解析失败或停在某个内层对象的 } 上，只花掉那个内层对象剩下的长度"""
+    hits = []
+    for hit in _TOP_CLOSE.finditer(raw, start, end):
+        if len(hits) == _TOP_CLOSE_MAX:
+            return True
+        hits.append(hit.end() - 1)
+    if not hits:
+        return False
+    s = raw.decode("latin-1")
+    stop = len(s.rstrip(" \t\r\n"))
+    for k in hits:
+        try:
+            _, n = _JSONObject((s, k), True, _decoder.scan_once, None, None, {})
+        except ValueError:
+            continue
+        if n == stop:
+            return True
+    return False
+
+
+def _claude_fields_fast(raw):
+    """从 Claude Code 写出的规范形状 assistant 行里只解析用得到的部分，不构造 message.content：
+      {<顶层前缀>,"message":{<id/model 等>,"content":[...],...,"usage":{...}},<顶层后缀>}
+    前缀/消息头/后缀各自补齐括号后必须能单独解析成对象——括号层级不对（匹配到的键其实嵌在
+    content 里）就解析失败，因此命中即说明各段确在预期层级。返回 (top, msg_head, usage)，
+    形状不符（键序不同、消息头缺 id/model、非法 UTF-8 等）返回 None，由调用方整行解析。
+    usage 取最后一个 "usage":{：尾段解析保证它所在对象是某个顶层键的值，再用 _closes_top_value 确认
+    message 没在 content 与它之间闭合，即它就是 message.usage（而不是其后另一个顶层对象里的 usage）。
+    前提与 Claude Code 的写法一致：整行是合法 JSON、无重复键。"""
+    m = raw.find(_MSG_OPEN)
+    if m < 1:
+        return None
+    c = raw.find(_CONTENT_KEY, m)
+    u = raw.rfind(_USAGE_OPEN)
+    if c < 0 or u < c:
+        return None
+    try:
+        if m == 1 and raw[:1] == b"{":
+            top = {}
+        elif raw[m - 1:m] == b",":
+            top = json.loads(raw[:m - 1] + b"}")
+        else:
+            return None
+        head = json.loads(raw[m + 10:c] + b"}")
+        rest = raw[u + 8:].decode("utf-8")
+        usage, n = _decoder.raw_decode(rest)
+        tail = rest[n:].rstrip()
+        if tail == "}}":
+            after = {}
+        elif tail.startswith("},"):
+            after = json.loads("{" + tail[2:])
+        else:
+            return None
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not (isinstance(top, dict) and isinstance(head, dict)
+            and isinstance(usage, dict) and isinstance(after, dict)):
+        return None
+    if "id" not in head or "model" not in head:
+        return None  # 可能排在 content 之后，只能整行解析
+    if _closes_top_value(raw, c, u):
+        return None  # 最后一个 usage 属于 message 之后的另一个顶层对象
+    top.update(after)
+    return top, head, usage
+
+
+def _iter_complete_lines(f, offset):
+    """从 offset 起逐行产出 (line_bytes, 行末偏移)。末尾没有换行的残行只有能完整解析成 JSON
+    时才产出（与旧扫描器一致：能解析就计入），否则视为写了一半、留给下次"""
+    f.seek(offset)
+    pos = offset
+    for line in f:
+        end = pos + len(line)
+        if not line.endswith(b"\n"):
+            try:
+                json.loads(line.decode("utf-8", errors="ignore"))
+            except Exception:
+                return
+        yield line, end
+        pos = end
+
+
+def _parse_claude_segment(fp, offset):
+    """解析 Claude 文件 offset 之后的完整行（纯函数，不碰索引）。
+    返回 (new_offset, entries)，entries 为 [(去重键的 64 位哈希 或 None, 小时键, model, (i, cr, cc, o))]"""
+    entries = []
+    new_offset = offset
+    try:
+        with open(fp, "rb") as f:
+            for raw, end in _iter_complete_lines(f, offset):
+                new_offset = end
+                if b'"type":"assistant"' not in raw or b'"usage"' not in raw:
+                    continue
+                fields = _claude_fields_fast(raw) if len(raw) >= FAST_PARSE_MIN_BYTES else None
+                if fields is None:
+                    try:
+                        v = json.loads(raw.decode("utf-8", errors="ignore"))
+                    except Exception:
+                        continue
+                    if not isinstance(v, dict):
+                        continue
+                    msg = v.get("message")
+                    if not isinstance(msg, dict):
+                        continue
+                    usage = msg.get("usage")
+                else:
+                    v, msg, usage = fields
+                if v.get("type") != "assistant":
+                    continue
+                hk = _hour_key(v.get("timestamp"))
+                if not hk:
+                    continue
+                model = msg.get("model")
+                if not model or not isinstance(model, str):
+                    continue
+                if not isinstance(usage, dict):
+                    continue
+                tot = (
+                    _i(usage, "input_tokens"),
+                    _i(usage, "cache_read_input_tokens"),
+                    _i(usage, "cache_creation_input_tokens"),
+                    _i(usage, "output_tokens"),
+                )
+                if sum(tot) == 0:
+                    continue
+                mid = msg.get("id")
+                rid = v.get("requestId")
+                key = _key_hash(f"{mid}:{rid}") if mid and rid else None
+                entries.append((key, hk, _norm_model(model, "claude_code"), tot))
+    except OSError:
+        pass
+    return new_offset, entries
+
+
+def _parse_codex_segment(fp, offset, current_model, cwd=None):
+    """解析 Codex 文件 offset 之后的完整行（纯函数）。current_model / cwd 是 offset 处的
+    turn_context 状态。返回 (new_offset, current_model, cwd, agg)，agg 按小时键聚合"""
+    agg = {}
+    new_offset = offset
+    try:
+        with open(fp, "rb") as f:
+            for raw, end in _iter_complete_lines(f, offset):
+                new_offset = end
+                if b'"token_count"' not in raw and b'"turn_context"' not in raw:
+                    continue
+                try:
+                    v = json.loads(raw.decode("utf-8", errors="ignore"))
+                except Exception:
+                    continue
+                if not isinstance(v, dict):
+                    continue
+                t = v.get("type")
+                if t == "turn_context":
+                    pl = v.get("payload") or {}
+                    m = pl.get("model") or (pl.get("info") or {}).get("model")
+                    if m:
+                        current_model = m
+                    if isinstance(pl, dict) and isinstance(pl.get("cwd"), str):
+                        cwd = pl["cwd"]
+                elif t == "event_msg":
+                    pl = v.get("payload")
+                    if not isinstance(pl, dict) or pl.get("type") != "token_count":
+                        continue
+                    hk = _hour_key(v.get("timestamp"))
+                    if not hk:
+                        continue
+                    info = pl.get("info") or {}
+                    last = info.get("last_token_usage")
+                    if not isinstance(last, dict):
+                        continue
+                    model = (
+                        info.get("model")
+                        or info.get("model_name")
+                        or pl.get("model")
+                        or v.get("model")
+                        or current_model
+                        or "gpt-5"
+                    )
+                    inp = _i(last, "input_tokens")
+                    cr = max(_i(last, "cached_input_tokens"), _i(last, "cache_read_input_tokens"))
+                    cc = _i(last, "cache_creation_input_tokens")
+                    out = _i(last, "output_tokens")
+                    cr = min(cr, inp)
+                    if inp + cr + cc + out == 0:
+                        continue
+                    _acc(agg, hk, _norm_model(model, "codex"), (inp, cr, cc, out))
+    except OSError:
+        pass
+    return new_offset, current_model, cwd, agg
+
+
+def _acc(agg, day, model, tot):
+    m = agg.setdefault(day, {}).setdefault(model, [0, 0, 0, 0])
+    for j in range(4):
+        m[j] += tot[j]
+
+
+def _new_entry(index, provider):
+    entry = {"id": index["next_id"], "p": provider, "size": 0, "mtime": 0, "offset": 0,
+             "head_len": 0, "head": "", "agg": {}}
+    index["next_id"] += 1
+    if provider == "claude_code":
+        entry["dups"] = []
+    else:
+        entry["model"] = None
+        entry["cwd"] = None
+    return entry
+
+
+def _release(index, path):
+    """丢弃某文件的检查点，并释放它认领的去重键（认领过的行都计入了 agg，按 agg 的天找分区）"""
+    entry = index["files"].pop(path, None)
+    if entry and entry.get("p") == "claude_code":
+        for day in {hk[:10] for hk in entry["agg"]}:
+            index["dedupe"].release(day, entry["id"])
+
+
+def _apply_claude(index, entry, entries):
+    """把新解析出的 Claude 行并入该文件检查点：未被认领的键由本文件认领并计入 agg，
+    已被认领的（含本文件内的重复行）记进 dups，合并时视认领者是否被选中决定是否补计"""
+    store = index["dedupe"]
+    for key, hk, model, tot in entries:
+        if key is not None:
+            if store.owner(hk[:10], key) is not None:
+                entry["dups"].append([key, hk, model, *tot])
+                continue
+            store.claim(hk[:10], key, entry["id"])
+        _acc(entry["agg"], hk, model, tot)
+
+
+def _plan(index, fp, provider):
+    """判断文件要不要解析、从哪解析。返回 (entry, start_offset)；无需解析时 start_offset=None"""
+    path = str(fp)
+    try:
+        st = os.stat(fp)
+    except OSError:
+        return None, None
+    size, mtime = int(st.st_size), int(st.st_mtime)
+    entry = index["files"].get(path)
+    if entry is not None and entry.get("p") == provider:
+        if entry["size"] == size and entry["mtime"] == mtime:
+            return entry, None  # 热路径：只花一次 stat
+        try:
+            with open(fp, "rb") as f:
+                appended = size >= entry["offset"] and _head_hash(f, entry["head_len"]) == entry["head"]
+        except OSError:
+            return None, None
+        if appended:
+            entry["size"], entry["mtime"] = size, mtime
+            return entry, entry["offset"]
+    # 新文件 / 被改写：从头来
+    _release(index, path)
+    entry = _new_entry(index, provider)
+    entry["size"], entry["mtime"] = size, mtime
+    index["files"][path] = entry
+    return entry, 0
+
+
+def _finish(entry, fp, new_offset):
+    """解析完更新 offset 与文件头哈希"""
+    entry["offset"] = new_offset
+    n = min(HEAD_BYTES, new_offset)
+    try:
+        with open(fp, "rb") as f:
+            entry["head"] = _head_hash(f, n)
+        entry["head_len"] = n
+    except OSError:
+        entry["head"], entry["head_len"] = "", 0
+
+
+def _index_path():
+    return INDEX_DIR / "files.json"
+
+
+def _load_index():
+    """取进程内索引；磁盘上的 files.json 被别的进程更新过则重新载入"""
+    global _index, _index_stamp
+    path = _index_path()
+    try:
+        stamp = path.stat().st_mtime_ns
+    except OSError:
+        stamp = None
+    if _index is not None and (stamp is None or stamp == _index_stamp):
+        return _index
+    files, next_id, gens, walked = {}, 1, {}, 0
+    if stamp is not None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get("version") == INDEX_VERSION:
+                files = data.get("files") or {}
+                next_id = int(data.get("next_id") or 1)
+                gens = data.get("partitions") or {}
+                walked = float(data.get("codex_walked") or 0)
+        except Exception:
+            files, next_id, gens, walked = {}, 1, {}, 0
+    _index = {"files": files, "next_id": next_id,
+              "dedupe": _DedupeStore(INDEX_DIR / "dedupe", gens), "codex_walked": walked}
+    _index_stamp = stamp
+    return _index
+
+
+def _reset_index():
+    """索引与去重分区对不上（写盘中途崩溃等）：清空重建"""
+    global _index, _index_stamp, _index_dirty
+    _index = {"files": {}, "next_id": 1, "dedupe": _DedupeStore(INDEX_DIR / "dedupe", {}), "codex_walked": 0}
+    _index_stamp = None
+    _index_dirty = True
+    return _index
+
+
+def _save_index(force=False):
+    """索引落盘：先写有改动的去重分区，再原子替换 files.json（记下各分区代数）；
+    非 force 时按 INDEX_SAVE_INTERVAL 节流"""
+    global _index_dirty, _index_saved_at, _index_stamp
+    if _index is None or not _index_dirty:
+        return
+    if not force and time.monotonic() - _index_saved_at < INDEX_SAVE_INTERVAL:
+        return
+    tmp = None
+    try:
+        gens = _index["dedupe"].save()
+        fd, tmp = tempfile.mkstemp(dir=str(INDEX_DIR), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "next_id": _index["next_id"], "partitions": gens,
+                       "codex_walked": _index["codex_walked"], "files": _index["files"]}, f,
+                      ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, _index_path())
+        _index_stamp = _index_path().stat().st_mtime_ns
+        _index_dirty = False
+        _index_saved_at = time.monotonic()
+    except Exception:
+        try:
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+        except Exception:
+            pass
+
+
+def flush_index():
+    """立即把进程内索引写盘（命令行单次运行结束时调用）"""
+    with _index_lock:
+        _save_index(force=True)
+
+
+def _fold(out, group, hk, model, tot, session, project):
+    """把一格（小时键×model）的 token 并入按 group 分组的结果；分组键首两项恒为 (date, model)"""
+    if group == "hour":
+        gk = (hk[:10], model, hk[11:13])
+    elif group == "session":
+        gk = (hk[:10], model, session, project)
+    elif group == "project":
+        gk = (hk[:10], model, project)
+    else:
+        gk = (hk[:10], model)
+    m = out.get(gk)
+    if m is None:
+        m = out[gk] = [0, 0, 0, 0]
+    for j in range(4):
+        m[j] += tot[j]
+
+
+def _merge_rows(groups_by_provider, group):
+    rows = []
+    for provider, groups in groups_by_provider:
+        for gk, tot in groups.items():
+            row = {"date": gk[0], "provider": provider, "model": gk[1]}
+            if group == "hour":
+                row["hour"] = int(gk[2])
+            elif group == "session":
+                row["session_id"], row["project"] = gk[2], gk[3]
+            elif group == "project":
+                row["project"] = gk[2]
+            row.update({
+                "input_tokens": tot[0],
+                "cache_read_tokens": tot[1],
+                "cache_creation_tokens": tot[2],
+                "output_tokens": tot[3],
+            })
+            rows.append(row)
+    return rows
+
+
+def _codex_project(cwd):
+    """Codex 的 cwd 按 Claude 项目目录名的规则编码，两边的 project 字段可直接对照"""
+    return re.sub(r"[^A-Za-z0-9]", "-", cwd) if cwd else ""
+
+
+def _compute_incremental(since, until, workers, rust_compat, group):
+    with _index_lock:
+        try:
+            return _compute_locked(since, until, _load_index(), workers, rust_compat, group)
+        except _IndexCorrupt:
+            return _compute_locked(since, until, _reset_index(), workers, rust_compat, group)
+
+
+def _scan_workers(workers):
+    if workers is None:
+        try:
+            workers = int(os.environ.get(SCAN_WORKERS_ENV) or 0)
+        except ValueError:
+            workers = 0
+        workers = workers or os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def _parse_many(fn, jobs, workers):
+    """按 jobs 顺序返回 fn(*job) 的结果；文件够多且 workers>1 时分片到进程池，
+    进程池起不来（受限环境 / 冻结打包等）就退回本进程逐个解析。
+    子进程用 forkserver（没有就 spawn）起：中继是多线程进程，直接 fork 可能把别的线程
+    正持有的锁带进子进程而卡死"""
+    if workers > 1 and len(jobs) >= PARALLEL_MIN_FILES:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        chunksize = max(1, len(jobs) // (workers * 4))
+        try:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                     mp_context=multiprocessing.get_context(method)) as pool:
+                return list(pool.map(fn, *zip(*jobs), chunksize=chunksize))
+        except Exception:
+            pass
+    return [fn(*job) for job in jobs]
+
+
+def _compute_locked(since, until, index, workers=1, rust_compat=False, group="day"):
+    global _index_dirty
+    limit = MAX_FILES_PER_PROVIDER if rust_compat else None
+    lo, hi = str(since), str(until)
+    existing = set()
+    claude_days = {}
+    claude_files = []
+    pending = []
+    for root in _claude_roots():
+        for fp in _recent_jsonl(root, since, existing, limit=limit):
+            entry, start = _plan(index, fp, "claude_code")
+            if entry is None:
+                continue
+            if start is not None:
+                pending.append((fp, entry, start))
+            claude_files.append((str(fp), entry))
+    results = _parse_many(_parse_claude_segment, [(fp, start) for fp, _, start in pending], workers)
+    # 认领按扫描顺序逐文件应用，与单进程解析时完全相同
+    for (fp, entry, _), (new_offset, entries) in zip(pending, results):
+        _apply_claude(index, entry, entries)
+        _finish(entry, fp, new_offset)
+        _index_dirty = True
+    selected = {e["id"] for _, e in claude_files}
+    credited = set()
+    for path, entry in claude_files:
+        fp = Path(path)
+        session, project = fp.stem, fp.parent.name
+        for hk, models in entry["agg"].items():
+            if lo <= hk[:10] <= hi:
+                for model, tot in models.items():
+                    _fold(claude_days, group, hk, model, tot, session, project)
+        for key, hk, model, *tot in entry["dups"]:
+            if key in credited or index["dedupe"].owner(hk[:10], key) in selected:
+                continue
+            credited.add(key)
+            if lo <= hk[:10] <= hi:
+                _fold(claude_days, group, hk, model, tot, session, project)
+
+    codex_days = {}
+    codex_files = []
+    pending = []
+    seen_names = set()
+    known = [p for p, e in index["files"].items() if e.get("p") == "codex"]
+    prune = not rust_compat and time.time() - index["codex_walked"] < CODEX_FULL_WALK_INTERVAL
+    if not prune and not rust_compat:
+        index["codex_walked"] = time.time()
+        _index_dirty = True
+    for root in _codex_roots():
+        for fp in _recent_jsonl(root, since, existing, shards=prune, limit=limit, known=known):
+            if fp.name in seen_names:
+                continue
+            seen_names.add(fp.name)
+            entry, start = _plan(index, fp, "codex")
+            if entry is None:
+                continue
+            if start is not None:
+                pending.append((fp, entry, start))
+            codex_files.append((fp, entry))
+    results = _parse_many(_parse_codex_segment,
+                          [(fp, start, entry["model"], entry["cwd"]) for fp, entry, start in pending],
+                          workers)
+    for (fp, entry, _), (new_offset, model, cwd, agg) in zip(pending, results):
+        entry["model"] = model
+        entry["cwd"] = cwd
+        for hk, models in agg.items():
+            for m, tot in models.items():
+                _acc(entry["agg"], hk, m, tot)
+        _finish(entry, fp, new_offset)
+        _index_dirty = True
+    for fp, entry in codex_files:
+        session, project = fp.stem, _codex_project(entry["cwd"])
+        for hk, models in entry["agg"].items():
+            if lo <= hk[:10] <= hi:
+                for m, tot in models.items():
+                    _fold(codex_days, group, hk, m, tot, session, project)
+
+    # 文件已被删除的检查点：释放其认领的键，免得索引只增不减。
+    # 本轮没遍历到 ≠ 已删除：按 since 剪掉的旧 Codex 分片子树也不在 existing 里，须确认文件真没了；
+    # 其中还在但 mtime 早于保留下限的 Codex 检查点一并淘汰（窗口放大时子树不再被剪，会重新解析），
+    # 这样被剪子树里要逐个 stat 的检查点只剩保留期内的，不随全部历史增长
+    keep_floor = _scan_floor_ts(min(since, until - timedelta(days=CODEX_CHECKPOINT_KEEP_DAYS - 1)))
+    for path in [p for p in index["files"] if p not in existing]:
+        try:
+            stale = index["files"][path].get("p") == "codex" and os.stat(path).st_mtime < keep_floor
+        except OSError:
+            stale = True
+        if stale:
+            _release(index, path)
+            _index_dirty = True
+    _save_index()
+    return _merge_rows((("claude_code", claude_days), ("codex", codex_days)), group)
+
+
+def compute(since_days=400, incremental=True, workers=None, rust_compat=False, group="day"):
     """扫本机算 token，返回扁平行：
     {ok, days: [{date, provider, model, input_tokens, cache_read_tokens,
                  cache_creation_tokens, output_tokens}]}
+    group 细分行：hour 多一列 hour(0-23)；session 多 session_id + project；project 多 project
+    （Claude 为项目目录名，Codex 为按同规则编码的 cwd）。细分只在增量索引上做，不额外重扫。
+    incremental=False 时不用索引、逐文件全量扫描（即原始算法，供对照校验）。
+    workers：解析进程数，None = 环境变量 CLAUDE_TOKEN_SCAN_WORKERS 或 CPU 核数，1 = 单进程。
+    rust_compat=True：与 Rust token_usage.rs 完全同口径（每个 provider 只取最新 MAX_FILES_PER_PROVIDER
+    个文件），用于两边对账；默认不设文件数上限。只有增量路径剪 Codex 分片目录（见 _recent_jsonl），
+    incremental=False 与 rust_compat 都整棵遍历。
     """
+    if group not in GROUPS:
+        raise ValueError(f"unknown group: {group}")
     since_days = max(1, min(int(since_days or 400), 3650))
     today = date.today()
     since = today - timedelta(days=since_days - 1)
     until = today
 
+    if incremental:
+        return {"ok": True, "days": _compute_incremental(since, until, _scan_workers(workers),
+                                                         rust_compat, group)}
+    if group != "day":
+        raise ValueError("group requires the incremental index")
+
+    limit = MAX_FILES_PER_PROVIDER if rust_compat else None
+
     # Claude：跨文件全局去重
     claude_days = {}
     seen = set()
     for root in _claude_roots():
-        for fp in _recent_jsonl(root, since):
+        for fp in _recent_jsonl(root, since, limit=limit):
             _scan_claude_file(fp, since, until, seen, claude_days)
 
     # Codex：去重文件名（sessions / archived_sessions 可能重名）
     codex_days = {}
     seen_names = set()
     for root in _codex_roots():
-        for fp in _recent_jsonl(root, since):
+        for fp in _recent_jsonl(root, since, limit=limit):
             if fp.name in seen_names:
                 continue
             seen_names.add(fp.name)
@@ -247,8 +1127,21 @@ def compute(since_days=400):
 
 if __name__ == "__main__":
     import sys
-    sd = int(sys.argv[1]) if len(sys.argv) > 1 else 30
-    rep = compute(sd)
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    sd = int(args[0]) if args else 30
+    workers = None
+    for a in sys.argv[1:]:
+        if a.startswith("--workers="):
+            workers = int(a.split("=", 1)[1])
+    t0 = time.perf_counter()
+    group = "day"
+    for a in sys.argv[1:]:
+        if a.startswith("--group="):
+            group = a.split("=", 1)[1]
+    rep = compute(sd, incremental="--full" not in sys.argv, workers=workers,
+                  rust_compat="--rust-compat" in sys.argv, group=group)
+    elapsed = time.perf_counter() - t0
+    flush_index()
     tot = {"input": 0, "cache_read": 0, "cache_create": 0, "output": 0}
     for r in rep["days"]:
         tot["input"] += r["input_tokens"]
@@ -258,3 +1151,4 @@ if __name__ == "__main__":
     print(f"近 {sd} 天：{len(rep['days'])} 行 (date×provider×model)")
     print(f"  input={tot['input']:,} cache_read={tot['cache_read']:,} "
           f"cache_create={tot['cache_create']:,} output={tot['output']:,}")
+    print(f"  耗时 {elapsed * 1000:.1f} ms")